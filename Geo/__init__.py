@@ -0,0 +1,14 @@
+"""
+Geo Module for Geoportal PR
+Provides in-memory access to the map features (data.geojson),
+spatial queries and per-tile delivery
+"""
+
+from .feature_store import FeatureStore
+from .feature_log import FeatureLog
+from .delivery import GeoJSONPublisher
+from .tiles import TileCache, MAX_ZOOM
+from .clustering import ClusterIndex
+
+__version__ = "1.0.0"
+__all__ = ['FeatureStore', 'FeatureLog', 'GeoJSONPublisher', 'TileCache', 'MAX_ZOOM', 'ClusterIndex']
@@ -0,0 +1,180 @@
+"""
+Clustering - Agrupación jerárquica de puntos por nivel de zoom (estilo supercluster)
+Cada zoom usa una rejilla de `radius` píxeles en coordenadas Web Mercator; como
+la rejilla de z+1 es exactamente el doble de fina, los clusters de un zoom se
+anidan en los del zoom anterior. Agregar un punto actualiza un cluster por zoom.
+"""
+
+import math
+import time
+import threading
+from collections import Counter
+
+MAX_CLUSTER_ZOOM = 16
+CLUSTER_RADIUS_PX = 60
+
+
+def _mercator(lng, lat):
+    """Coordenadas Web Mercator normalizadas a [0, 1]"""
+    siny = min(max(math.sin(math.radians(lat)), -0.9999), 0.9999)
+    return (lng + 180.0) / 360.0, 0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi)
+
+
+class _Cluster:
+    __slots__ = ('count', 'sum_lng', 'sum_lat', 'statuses', 'first_row')
+
+    def __init__(self, first_row):
+        self.count = 0
+        self.sum_lng = 0.0
+        self.sum_lat = 0.0
+        self.statuses = Counter()
+        self.first_row = first_row
+
+
+class ClusterIndex:
+    def __init__(self, feature_store, status_source, max_zoom=MAX_CLUSTER_ZOOM, radius=CLUSTER_RADIUS_PX,
+                 status_ttl=60):
+        """status_source(feature_ids) -> {feature_id: {status: n}} (None = todos).
+
+        Los estados pueden cambiar en otro worker: cada status_ttl segundos se
+        vuelven a leer todos y se aplican solo las diferencias.
+        """
+        self.feature_store = feature_store
+        self.status_source = status_source
+        self.status_ttl = status_ttl
+        self._statuses_at = 0.0
+        self.max_zoom = max_zoom
+        self._scales = [256 * 2 ** z / radius for z in range(max_zoom + 1)]
+        self._state = (None, 0)         # (generation, filas) del store ya indexados
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._zooms = [dict() for _ in range(self.max_zoom + 1)]   # z -> {(cx, cy): _Cluster}
+        self._uid_status = {}           # feature_uid -> Counter de estados ya agregado
+        self._uid_point = {}            # feature_uid -> (u, v) del punto al que se atribuyen sus estados
+
+    def _cell(self, z, u, v):
+        scale = self._scales[z]
+        return (int(u * scale), int(v * scale))
+
+    def _add_point(self, row, lng, lat):
+        u, v = _mercator(lng, lat)
+        for z, clusters in enumerate(self._zooms):
+            key = self._cell(z, u, v)
+            cluster = clusters.get(key)
+            if cluster is None:
+                cluster = clusters[key] = _Cluster(row)
+            cluster.count += 1
+            cluster.sum_lng += lng
+            cluster.sum_lat += lat
+        return u, v
+
+    def _set_statuses(self, feature_uid, statuses):
+        """Aplicar la diferencia de estados de un feature a sus clusters en cada zoom"""
+        point = self._uid_point.get(feature_uid)
+        if point is None:
+            return
+        previous = self._uid_status.get(feature_uid, Counter())
+        delta = Counter(statuses)
+        delta.subtract(previous)
+        delta = {status: n for status, n in delta.items() if n}
+        if not delta:
+            return
+        for z, clusters in enumerate(self._zooms):
+            cluster = clusters[self._cell(z, *point)]
+            for status, n in delta.items():
+                cluster.statuses[status] += n
+                if cluster.statuses[status] <= 0:
+                    del cluster.statuses[status]
+        self._uid_status[feature_uid] = Counter(statuses)
+
+    def _sync(self):
+        generation, rows = self.feature_store.row_state()
+        cached_generation, cached_rows = self._state
+        if generation != cached_generation or rows < cached_rows:
+            self._reset()
+            cached_rows = 0
+        if rows == cached_rows:
+            if time.monotonic() - self._statuses_at > self.status_ttl:
+                self._refresh_all_statuses()
+            return
+
+        uids = []
+        for offset, feature in enumerate(self.feature_store.row_features(cached_rows)):
+            row = cached_rows + offset
+            lng, lat = feature['geometry']['coordinates'][:2]
+            point = self._add_point(row, float(lng), float(lat))
+            feature_uid = (feature.get('properties') or {}).get('feature_uid')
+            if feature_uid:
+                self._uid_point.setdefault(feature_uid, point)
+                uids.append(feature_uid)
+
+        self._state = (generation, rows)
+
+        # Recarga completa: estados de todos los features; anexos: solo de los nuevos
+        if cached_rows == 0:
+            self._refresh_all_statuses()
+        else:
+            statuses = self.status_source(uids)
+            for feature_uid in set(uids):
+                self._set_statuses(feature_uid, statuses.get(feature_uid, {}))
+
+    def _refresh_all_statuses(self):
+        statuses = self.status_source(None)
+        for feature_uid in self._uid_point:
+            self._set_statuses(feature_uid, statuses.get(feature_uid, {}))
+        self._statuses_at = time.monotonic()
+
+    def refresh_statuses(self, feature_uids):
+        """Volver a leer los estados de features concretos (p. ej. tras cambiar o borrar solicitudes)"""
+        with self._lock:
+            statuses = self.status_source(list(feature_uids))
+            for feature_uid in feature_uids:
+                self._set_statuses(feature_uid, statuses.get(feature_uid, {}))
+
+    def clusters(self, z, min_lng, min_lat, max_lng, max_lat):
+        """FeatureCollection de clusters (o puntos sueltos) visibles en el zoom z"""
+        z = min(max(int(z), 0), self.max_zoom)
+        with self._lock:
+            self._sync()
+            min_cx, min_cy = self._cell(z, *_mercator(min_lng, max_lat))
+            max_cx, max_cy = self._cell(z, *_mercator(max_lng, min_lat))
+            clusters = self._zooms[z]
+
+            span = (max_cx - min_cx + 1) * (max_cy - min_cy + 1)
+            if span > len(clusters):
+                visible = [
+                    (key, cluster) for key, cluster in clusters.items()
+                    if min_cx <= key[0] <= max_cx and min_cy <= key[1] <= max_cy
+                ]
+            else:
+                visible = [
+                    ((cx, cy), clusters[(cx, cy)])
+                    for cx in range(min_cx, max_cx + 1)
+                    for cy in range(min_cy, max_cy + 1)
+                    if (cx, cy) in clusters
+                ]
+
+            features = []
+            for (cx, cy), cluster in visible:
+                if cluster.count == 1:
+                    feature = self.feature_store.row_feature(cluster.first_row)
+                    properties = dict(feature.get('properties') or {})
+                    properties['statuses'] = dict(cluster.statuses)
+                    features.append({"type": "Feature", "properties": properties, "geometry": feature['geometry']})
+                    continue
+                features.append({
+                    "type": "Feature",
+                    "properties": {
+                        "cluster": True,
+                        "cluster_id": f"{z}:{cx}:{cy}",
+                        "point_count": cluster.count,
+                        "statuses": dict(cluster.statuses)
+                    },
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": [cluster.sum_lng / cluster.count, cluster.sum_lat / cluster.count]
+                    }
+                })
+            return {"type": "FeatureCollection", "features": features}
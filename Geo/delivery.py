@@ -0,0 +1,98 @@
+"""
+Entrega de /data.geojson - Builds minificados y precomprimidos con ETag
+La colección se serializa y comprime una sola vez por versión del FeatureStore;
+cada petición solo elige la representación según Accept-Encoding.
+"""
+
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+
+# Brotli es opcional: sin él se sirve gzip/identity
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+class GeoJSONBuild:
+    """Una versión de la colección en cada codificación disponible"""
+
+    def __init__(self, version, collection):
+        self.version = version
+        self.identity = json.dumps(collection, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(self.identity).hexdigest()[:32]
+
+        # mtime=0 para que el gzip (y su ETag) sea idéntico en todos los workers
+        self.bodies = {
+            'identity': self.identity,
+            'gzip': gzip.compress(self.identity, compresslevel=GZIP_LEVEL, mtime=0),
+        }
+        if BROTLI_AVAILABLE:
+            self.bodies['br'] = brotli.compress(self.identity, quality=BROTLI_QUALITY)
+
+        # ETag fuerte distinto por representación
+        self.etags = {
+            'identity': digest,
+            'gzip': f"{digest}-gz",
+            'br': f"{digest}-br",
+        }
+
+    def select(self, accept_encodings):
+        """Elegir la codificación más compacta que acepte el cliente"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+
+class GeoJSONPublisher:
+    def __init__(self, feature_store, min_rebuild_interval=2.0, observer=None):
+        """observer(segundos) recibe la duración de cada reconstrucción"""
+        self.feature_store = feature_store
+        self.min_rebuild_interval = min_rebuild_interval
+        self.observer = observer
+        self.hits = 0               # Peticiones servidas con un build existente
+        self.rebuilds = 0
+        self._build = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Build de la versión actual; se regenera solo cuando cambian los features.
+
+        Durante ráfagas de envíos se reconstruye como mucho una vez cada
+        min_rebuild_interval segundos (mientras tanto se sirve el build previo).
+        """
+        build = self._build
+        version = self.feature_store.current_version()
+        if build is not None and (build.version == version or
+                                  time.monotonic() - self._built_at < self.min_rebuild_interval):
+            self.hits += 1
+            return build
+
+        # Un solo hilo reconstruye; el resto sigue sirviendo el build anterior
+        if not self._lock.acquire(blocking=build is None):
+            self.hits += 1
+            return build
+        try:
+            if self._build is None or self._build.version != self.feature_store.current_version():
+                started = time.perf_counter()
+                version, collection = self.feature_store.versioned_collection()
+                self._build = GeoJSONBuild(version, collection)
+                self._built_at = time.monotonic()
+                self.rebuilds += 1
+                if self.observer is not None:
+                    self.observer(time.perf_counter() - started)
+                sizes = ', '.join(f"{k}={len(v)}" for k, v in self._build.bodies.items())
+                logging.info(f"GeoJSON regenerado (v{version}) en {time.perf_counter() - started:.3f}s: {sizes}")
+            return self._build
+        finally:
+            self._lock.release()
@@ -0,0 +1,38 @@
+"""
+Feature Log - Registro append-only de features nuevos en SQLite
+Cada envío inserta una fila (O(1), serializado por SQLite entre workers); la
+compactación periódica los vuelca a data.geojson, que pasa a ser un snapshot
+con el número de secuencia (log_seq) hasta el que está compactado.
+"""
+
+import json
+from datetime import datetime
+
+SQL_APPEND = "INSERT INTO feature_log (feature_uid, feature, created_at) VALUES (?, ?, ?)"
+SQL_TAIL = "SELECT seq, feature FROM feature_log WHERE seq > ? ORDER BY seq"
+SQL_PRUNE = "DELETE FROM feature_log WHERE seq <= ?"
+
+
+class FeatureLog:
+    def __init__(self, database):
+        self.database = database
+
+    def append(self, feature):
+        """Registrar un feature; devuelve su número de secuencia"""
+        properties = feature.get('properties') or {}
+        with self.database.connection() as conn:
+            cursor = conn.execute(SQL_APPEND, (
+                properties.get('feature_uid'),
+                json.dumps(feature, ensure_ascii=False, separators=(',', ':')),
+                datetime.utcnow().isoformat()
+            ))
+            return cursor.lastrowid
+
+    def tail(self, after_seq):
+        """[(seq, feature)] registrados después de after_seq"""
+        rows = self.database.fetch_all(SQL_TAIL, (after_seq,))
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def prune(self, through_seq):
+        """Eliminar entradas ya incluidas en un snapshot"""
+        return self.database.execute(SQL_PRUNE, (through_seq,))
@@ -0,0 +1,350 @@
+"""
+Feature Store - Índice en memoria de los features del GeoJSON
+El archivo se parsea una sola vez por proceso y se vuelve a cargar solo cuando
+cambia su mtime/tamaño (p. ej. lo compactó otro worker) o tras una escritura propia.
+
+Con un FeatureLog, data.geojson es un snapshot y los features nuevos se leen
+del log (snapshot + cola); la compactación en segundo plano los vuelca al archivo.
+El snapshot lleva log_seq al principio: si otro worker compactó hasta un seq que
+ya está en memoria, se adopta el archivo sin volver a parsearlo.
+
+Archivo y log se comprueban como mucho cada check_interval segundos (salvo
+tras una escritura propia): los envíos de otros workers aparecen con ese retraso.
+"""
+
+import os
+import re
+import json
+import math
+import time
+import logging
+import threading
+from array import array
+
+from .spatial_index import GridIndex
+
+# log_seq en la cabecera del snapshot (ver _write_snapshot)
+SNAPSHOT_SEQ = re.compile(rb'^\{"type":\s*"FeatureCollection",\s*"log_seq":\s*(\d+)')
+
+
+class FeatureStore:
+    def __init__(self, geojson_file, feature_log=None, observer=None, check_interval=1.0):
+        """observer(operación, segundos) recibe la duración de cada carga ('load') y
+        escritura ('write') del snapshot, p. ej. para métricas."""
+        self.geojson_file = geojson_file
+        self.feature_log = feature_log
+        self.observer = observer
+        self.check_interval = check_interval
+        self._next_check = 0.0      # time.monotonic() de la próxima comprobación de archivo y log
+        self._lock = threading.RLock()
+        self._signature = None      # (st_mtime_ns, st_size) del archivo cargado
+        self._features = []         # Features completos, en el orden del archivo + log
+        self._index = {}            # feature_uid -> fila en la tabla de coordenadas
+        self._titles = []           # Título por fila
+        self._row_features = []     # Feature completo por fila
+        self._coords = array('d')   # Tabla compacta de coordenadas: lng, lat intercalados
+        self._grid = GridIndex()    # Índice espacial sobre las filas
+        self._snapshot_seq = 0      # Último seq del log incluido en el snapshot cargado
+        self._log_seq = 0           # Último seq del log incluido en memoria
+        self._compactor = None
+        self._stale = True          # Forzar (re)carga en el próximo acceso
+        self.version = 0            # Se incrementa en cada (re)carga o escritura
+        self.generation = 0         # Se incrementa solo en recargas completas (las filas cambian de número)
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.geojson_file)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _ensure_loaded(self, force=False):
+        if not force and not self._stale and time.monotonic() < self._next_check:
+            return
+        signature = self._stat_signature()
+        with self._lock:
+            if self._stale or (signature != self._signature and not self._adopt_snapshot(signature)):
+                self._load(signature)
+            self._sync_tail()
+            self._next_check = time.monotonic() + self.check_interval
+
+    def _read_snapshot_seq(self):
+        """log_seq de la cabecera del snapshot sin parsearlo, o None"""
+        try:
+            with open(self.geojson_file, 'rb') as f:
+                match = SNAPSHOT_SEQ.match(f.read(128))
+        except OSError:
+            return None
+        return int(match.group(1)) if match else None
+
+    def _adopt_snapshot(self, signature):
+        """Snapshot nuevo compactado por otro worker: si solo contiene features que ya
+        están en memoria (snapshot + log) basta con adoptar su firma.
+
+        Devuelve False si hay que recargarlo completo (archivo de otro origen, o
+        entradas del log que faltan en memoria y ya se podaron).
+        """
+        if self.feature_log is None or signature is None or self._signature is None:
+            return False
+        snapshot_seq = self._read_snapshot_seq()
+        if snapshot_seq is None:
+            return False
+        if snapshot_seq > self._log_seq:
+            # Ponerse al día por el log; la poda solo borra un prefijo, así que basta
+            # con que la primera entrada siga a la última que tenemos
+            entries = self.feature_log.tail(self._log_seq)
+            if not entries or entries[0][0] != self._log_seq + 1:
+                return False
+            self._apply_tail(entries)
+            if snapshot_seq > self._log_seq:
+                return False
+        self._signature = signature
+        self._snapshot_seq = snapshot_seq
+        return True
+
+    def _load(self, signature):
+        started = time.perf_counter()
+        features = []
+        snapshot_seq = 0
+        if signature is not None:
+            try:
+                with open(self.geojson_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('type') == 'FeatureCollection':
+                    features = data.get('features', [])
+                    snapshot_seq = int(data.get('log_seq', 0))
+            except (OSError, ValueError) as e:
+                logging.warning(f"No se pudo cargar GeoJSON {self.geojson_file}: {e}")
+
+        self._features = []
+        self._index = {}
+        self._titles = []
+        self._row_features = []
+        self._coords = array('d')
+        self._grid.clear()
+        for feature in features:
+            self._add(feature)
+        self._signature = signature
+        self._snapshot_seq = self._log_seq = snapshot_seq
+        self._stale = False
+        self.generation += 1
+        self.version += 1
+        self._observe('load', started)
+
+    def _observe(self, operation, started):
+        if self.observer is not None:
+            self.observer(operation, time.perf_counter() - started)
+
+    def _sync_tail(self):
+        """Incorporar las entradas del log posteriores a lo que ya está en memoria"""
+        if self.feature_log is None:
+            return
+        self._apply_tail(self.feature_log.tail(self._log_seq))
+
+    def _apply_tail(self, entries):
+        if not entries:
+            return
+        for seq, feature in entries:
+            self._add(feature)
+            self._log_seq = seq
+        self.version += 1
+
+    def _add(self, feature):
+        properties = feature.get('properties') or {}
+        geometry = feature.get('geometry') or {}
+        coordinates = geometry.get('coordinates') or []
+        if geometry.get('type') != 'Point' or len(coordinates) < 2:
+            self._features.append(feature)
+            return
+
+        try:
+            lng, lat = float(coordinates[0]), float(coordinates[1])
+        except (TypeError, ValueError):
+            lng = lat = math.nan
+        if not (math.isfinite(lng) and math.isfinite(lat)):
+            # Un punto NaN/inf no cabe en la rejilla ni en el JSON: se omite en lugar de
+            # romper todas las rutas del mapa (y desaparece en la próxima compactación)
+            logging.warning(f"Feature {properties.get('feature_uid')} omitido: coordenadas inválidas {coordinates[:2]}")
+            return
+
+        self._features.append(feature)
+        row = len(self._titles)
+        self._titles.append(properties.get('title', 'Sin título'))
+        self._row_features.append(feature)
+        self._coords.append(lng)
+        self._coords.append(lat)
+        self._grid.insert(row, lng, lat)
+        # Si un feature_uid se repite, gana el último (mismo comportamiento que antes)
+        feature_uid = properties.get('feature_uid')
+        if feature_uid:
+            self._index[feature_uid] = row
+
+    def invalidate(self):
+        """Forzar recarga en el próximo acceso"""
+        with self._lock:
+            self._stale = True
+
+    def _info(self, row):
+        return {
+            'title': self._titles[row],
+            'coordinates': [self._coords[2 * row], self._coords[2 * row + 1]]
+        }
+
+    def get(self, feature_uid):
+        """{'title', 'coordinates': [lng, lat]} del feature o None"""
+        self._ensure_loaded()
+        with self._lock:
+            row = self._index.get(feature_uid)
+            return None if row is None else self._info(row)
+
+    def get_many(self, feature_uids):
+        """{feature_uid: info} para los ids conocidos (una sola comprobación del archivo)"""
+        self._ensure_loaded()
+        with self._lock:
+            index = self._index
+            return {uid: self._info(index[uid]) for uid in set(feature_uids) if uid in index}
+
+    def ids_in_bbox(self, min_lng, min_lat, max_lng, max_lat):
+        self._ensure_loaded()
+        with self._lock:
+            rows = self._grid.query_bbox(min_lng, min_lat, max_lng, max_lat, self._coords)
+            ids = ((self._row_features[row].get('properties') or {}).get('feature_uid') for row in rows)
+            return list({feature_uid for feature_uid in ids if feature_uid})
+
+    def ids_matching_title(self, text):
+        """feature_uid de los features cuyo título contiene text (sin distinguir mayúsculas)"""
+        text = text.casefold()
+        self._ensure_loaded()
+        with self._lock:
+            return [uid for uid, row in self._index.items() if text in self._titles[row].casefold()]
+
+    def features_in_bbox(self, min_lng, min_lat, max_lng, max_lat, limit=None):
+        """Features puntuales dentro del bbox (en orden de inserción)"""
+        self._ensure_loaded()
+        with self._lock:
+            rows = sorted(self._grid.query_bbox(min_lng, min_lat, max_lng, max_lat, self._coords))
+            if limit is not None:
+                rows = rows[:limit]
+            return [self._row_features[row] for row in rows]
+
+    def nearby(self, lat, lng, radius_m, limit=None):
+        """[(distancia_m, feature)] dentro de radius_m metros, del más cercano al más lejano"""
+        self._ensure_loaded()
+        with self._lock:
+            matches = self._grid.query_radius(lng, lat, radius_m, self._coords)
+            if limit is not None:
+                matches = matches[:limit]
+            return [(distance, self._row_features[row]) for distance, row in matches]
+
+    def nearest_feature_uid(self, lat, lng, radius_m):
+        """(feature_uid, distancia_m) del feature con id más cercano dentro del radio, o None"""
+        for distance, feature in self.nearby(lat, lng, radius_m):
+            feature_uid = (feature.get('properties') or {}).get('feature_uid')
+            if feature_uid:
+                return feature_uid, distance
+        return None
+
+    def row_state(self):
+        """(generation, número de filas) para cachés que se invalidan de forma incremental"""
+        self._ensure_loaded()
+        with self._lock:
+            return self.generation, len(self._row_features)
+
+    def row_feature(self, row):
+        with self._lock:
+            return self._row_features[row]
+
+    def row_features(self, start):
+        """Features de las filas a partir de `start` (las agregadas desde entonces)"""
+        with self._lock:
+            return self._row_features[start:]
+
+    def row_coordinates(self, start):
+        """[(lng, lat)] de las filas a partir de `start` (las agregadas desde entonces)"""
+        with self._lock:
+            coords = self._coords
+            return [(coords[2 * row], coords[2 * row + 1]) for row in range(start, len(self._row_features))]
+
+    def current_version(self):
+        self._ensure_loaded()
+        return self.version
+
+    def collection(self):
+        """FeatureCollection actual: snapshot + cola del log (no modificar los features)"""
+        return self.versioned_collection()[1]
+
+    def versioned_collection(self):
+        """(version, FeatureCollection) leídos de forma consistente"""
+        self._ensure_loaded()
+        with self._lock:
+            return self.version, {"type": "FeatureCollection", "features": list(self._features)}
+
+    def append(self, feature):
+        """Anexar un feature: O(1) en el log si existe, si no reescribiendo el archivo"""
+        if self.feature_log is not None:
+            self.feature_log.append(feature)
+            self._ensure_loaded(force=True)
+            return
+
+        with self._lock:
+            self._ensure_loaded(force=True)
+            self._add(feature)
+            self._write_snapshot(self._features, 0)
+            self.version += 1
+
+    def _write_snapshot(self, features, log_seq):
+        started = time.perf_counter()
+        # log_seq antes de features: los demás workers lo leen sin parsear el archivo
+        collection = {"type": "FeatureCollection"}
+        if log_seq:
+            collection["log_seq"] = log_seq
+        collection["features"] = features
+        tmp_path = f"{self.geojson_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(collection, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.geojson_file)
+        self._signature = self._stat_signature()
+        self._observe('write', started)
+
+    # ========== COMPACTACIÓN ==========
+
+    def compact(self, min_entries=1):
+        """Volcar la cola del log al snapshot; devuelve el número de features compactados"""
+        if self.feature_log is None:
+            return 0
+        with self._lock:
+            self._ensure_loaded(force=True)
+            pending = self._log_seq - self._snapshot_seq
+            if pending < min_entries:
+                return 0
+            previous_seq = self._snapshot_seq
+            self._write_snapshot(self._features, self._log_seq)
+            self._snapshot_seq = self._log_seq
+
+        # Se conserva una generación del log: un worker que acabe de leer el
+        # snapshot anterior todavía puede pedir su cola sin perder features.
+        if previous_seq:
+            self.feature_log.prune(previous_seq)
+        logging.info(f"GeoJSON compactado: {pending} features del log, log_seq={self._snapshot_seq}")
+        return pending
+
+    def start_compactor(self, database, interval=60, min_entries=1):
+        """Hilo en segundo plano que compacta periódicamente (un solo worker a la vez)"""
+        if self.feature_log is None or interval <= 0:
+            return
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            owner = f"{os.getpid()}-{id(self)}"
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        if database.try_acquire_lease('feature_log_compaction', owner, ttl=interval * 2):
+                            self.compact(min_entries)
+                    except Exception as e:
+                        logging.warning(f"Error compactando el log de features: {e}")
+
+            self._compactor = threading.Thread(target=run, name='feature-log-compactor', daemon=True)
+            self._compactor.start()
@@ -0,0 +1,82 @@
+"""
+Spatial Index - Rejilla uniforme sobre la tabla de coordenadas del FeatureStore
+Cada celda guarda las filas cuyos puntos caen dentro; una consulta por bbox solo
+revisa las celdas que la intersectan en lugar de todos los features.
+"""
+
+import math
+from collections import defaultdict
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lng1, lat1, lng2, lat2):
+    """Distancia en metros entre dos puntos lng/lat"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    def __init__(self, cell_size=0.01):
+        # 0.01° ≈ 1.1 km en Puerto Rico
+        self.cell_size = cell_size
+        self._cells = defaultdict(list)
+
+    def clear(self):
+        self._cells = defaultdict(list)
+
+    def _cell(self, lng, lat):
+        return (math.floor(lng / self.cell_size), math.floor(lat / self.cell_size))
+
+    def insert(self, row, lng, lat):
+        self._cells[self._cell(lng, lat)].append(row)
+
+    def query_bbox(self, min_lng, min_lat, max_lng, max_lat, coords):
+        """Filas con (lng, lat) dentro del bbox; coords es la tabla lng/lat intercalada"""
+        min_cx, min_cy = self._cell(min_lng, min_lat)
+        max_cx, max_cy = self._cell(max_lng, max_lat)
+
+        # Con bboxes enormes es más barato recorrer solo las celdas ocupadas
+        span = (max_cx - min_cx + 1) * (max_cy - min_cy + 1)
+        if span > len(self._cells):
+            candidates = (
+                rows for (cx, cy), rows in self._cells.items()
+                if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy
+            )
+        else:
+            cells = self._cells
+            candidates = (
+                cells[(cx, cy)]
+                for cx in range(min_cx, max_cx + 1)
+                for cy in range(min_cy, max_cy + 1)
+                if (cx, cy) in cells
+            )
+
+        result = []
+        for rows in candidates:
+            for row in rows:
+                lng, lat = coords[2 * row], coords[2 * row + 1]
+                if min_lng <= lng <= max_lng and min_lat <= lat <= max_lat:
+                    result.append(row)
+        return result
+
+    def query_radius(self, lng, lat, radius_m, coords):
+        """[(distancia_m, fila)] dentro de radius_m, de la más cercana a la más lejana"""
+        # bbox del casquete esférico con el mismo radio terrestre que haversine_m: si
+        # fuera más chico que el círculo se perderían puntos cerca del borde
+        angle = radius_m / EARTH_RADIUS_M
+        dlat = math.degrees(angle)
+        ratio = math.sin(min(angle, math.pi / 2)) / max(math.cos(math.radians(lat)), 1e-12)
+        dlng = 180.0 if abs(lat) + dlat >= 90 or ratio >= 1 else math.degrees(math.asin(ratio))
+        rows = self.query_bbox(lng - dlng, lat - dlat, lng + dlng, lat + dlat, coords)
+
+        result = []
+        for row in rows:
+            distance = haversine_m(lng, lat, coords[2 * row], coords[2 * row + 1])
+            if distance <= radius_m:
+                result.append((distance, row))
+        result.sort()
+        return result
@@ -0,0 +1,94 @@
+"""
+Tiles - GeoJSON por tile XYZ (Web Mercator) con caché por nivel de zoom
+Los tiles se generan desde el índice espacial del FeatureStore; al anexarse
+features nuevos solo se descartan los tiles que los contienen.
+
+Un tile lleva como máximo max_features features (en zooms bajos un solo tile
+cubre todo el conjunto); si se recorta lleva "truncated": true y el cliente
+debe pedir /clusters para ese nivel.
+"""
+
+import json
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+
+MAX_ZOOM = 22
+
+
+def tile_bbox(z, x, y):
+    """(min_lng, min_lat, max_lng, max_lat) del tile XYZ"""
+    n = 2 ** z
+    min_lng = x / n * 360.0 - 180.0
+    max_lng = (x + 1) / n * 360.0 - 180.0
+    max_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    min_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def tile_for(lng, lat, z):
+    """(x, y) del tile que contiene el punto en el zoom z"""
+    n = 2 ** z
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+class Tile:
+    def __init__(self, features, truncated=False):
+        collection = {"type": "FeatureCollection", "features": features}
+        if truncated:
+            collection["truncated"] = True
+        self.truncated = truncated
+        self.body = json.dumps(collection, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+
+
+class TileCache:
+    def __init__(self, feature_store, max_tiles_per_zoom=512, max_features=5000):
+        self.feature_store = feature_store
+        self.max_tiles_per_zoom = max_tiles_per_zoom
+        self.max_features = max_features
+        self._zooms = {}                # z -> OrderedDict((x, y) -> Tile), LRU
+        self._state = (None, 0)         # (generation, filas) del store cuando se llenó la caché
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _sync(self):
+        """Invalidar solo lo necesario según lo que cambió en el store"""
+        generation, rows = self.feature_store.row_state()
+        cached_generation, cached_rows = self._state
+        if generation != cached_generation or rows < cached_rows:
+            self._zooms.clear()
+        elif rows > cached_rows:
+            for lng, lat in self.feature_store.row_coordinates(cached_rows):
+                for z, tiles in self._zooms.items():
+                    tiles.pop(tile_for(lng, lat, z), None)
+        self._state = (generation, rows)
+
+    def get(self, z, x, y):
+        with self._lock:
+            self._sync()
+            tiles = self._zooms.setdefault(z, OrderedDict())
+            tile = tiles.get((x, y))
+            if tile is not None:
+                tiles.move_to_end((x, y))
+                self.hits += 1
+                return tile
+
+            self.misses += 1
+            state = self._state
+
+        features = self.feature_store.features_in_bbox(*tile_bbox(z, x, y), limit=self.max_features + 1)
+        tile = Tile(features[:self.max_features], truncated=len(features) > self.max_features)
+        with self._lock:
+            # Si el store cambió mientras se generaba, no cachear un tile posiblemente viejo
+            if state == self._state:
+                tiles = self._zooms.setdefault(z, OrderedDict())
+                tiles[(x, y)] = tile
+                if len(tiles) > self.max_tiles_per_zoom:
+                    tiles.popitem(last=False)
+        return tile
@@ -4,10 +4,8 @@ Provides advanced file scanning capabilities
 """
 
 from .scanner import ClamAVScanner
-from .virus import VirusTotalScanner
+from .virus import VirusTotalScanner, AsyncVirusTotalClient
+from .clamd import ClamdClient, ClamdError
 
 __version__ = "1.0.0"
-__all__ = ['ClamAVScanner', 'VirusTotalScanner']
-
-# Mensaje de inicialización
-print("Security module loaded - ClamAV and VirusTotal scanners available")
+__all__ = ['ClamAVScanner', 'VirusTotalScanner', 'AsyncVirusTotalClient', 'ClamdClient', 'ClamdError']
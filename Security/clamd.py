@@ -0,0 +1,224 @@
+"""
+Cliente clamd - Protocolo de clamd sobre socket UNIX o TCP
+Las conexiones se mantienen abiertas en modo IDSESSION y se reutilizan entre
+escaneos; cada archivo se envía con INSTREAM en bloques, sin que clamd tenga
+que leer el disco del servidor web. scan_many encadena varios INSTREAM en la
+misma sesión antes de leer las respuestas.
+"""
+
+import os
+import time
+import queue
+import socket
+import struct
+import logging
+import threading
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ClamdError(Exception):
+    """clamd no disponible o respuesta inesperada"""
+
+
+class _Session:
+    """Conexión en modo IDSESSION: cada respuesta lleva el id de su comando"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.next_id = 1
+        self.last_used = time.monotonic()
+        self._buffer = b''
+
+    def send(self, command, payload=None):
+        """Enviar un comando; devuelve su id de sesión"""
+        self.sock.sendall(b'z' + command + b'\0')
+        if payload is not None:
+            payload()
+        request_id = self.next_id
+        self.next_id += 1
+        return request_id
+
+    def read_reply(self):
+        """(id, texto) de la siguiente respuesta terminada en NUL"""
+        while b'\0' not in self._buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ClamdError("clamd cerró la conexión")
+            self._buffer += data
+        reply, self._buffer = self._buffer.split(b'\0', 1)
+        request_id, _, text = reply.decode('utf-8', errors='replace').partition(': ')
+        try:
+            return int(request_id), text
+        except ValueError:
+            raise ClamdError(f"Respuesta de clamd inesperada: {reply!r}")
+
+    def close(self):
+        try:
+            self.sock.sendall(b'zEND\0')
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class ClamdClient:
+    def __init__(self, socket_path=None, host=None, port=3310, timeout=10.0, pool_size=2,
+                 max_idle=20.0, pipeline_depth=8):
+        """socket_path (UNIX) tiene prioridad sobre host/port (TCP).
+
+        max_idle debe ser menor que IdleTimeout de clamd (30 s por defecto):
+        una sesión inactiva más tiempo se descarta en lugar de reutilizarse.
+        """
+        if not socket_path and not host:
+            raise ValueError("Se requiere socket_path o host de clamd")
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.pipeline_depth = pipeline_depth
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __repr__(self):
+        target = self.socket_path or f"{self.host}:{self.port}"
+        return f"ClamdClient({target})"
+
+    # ========== CONEXIONES ==========
+
+    def _connect(self):
+        if self.socket_path:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self.socket_path
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Comandos y bloques pequeños: sin Nagle cada escaneo pagaría el ACK retardado
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            address = (self.host, self.port)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(address)
+            sock.sendall(b'zIDSESSION\0')
+        except OSError as e:
+            sock.close()
+            raise ClamdError(f"No se pudo conectar a clamd ({address}): {e}")
+        return _Session(sock)
+
+    def _reset_after_fork(self):
+        # Las sesiones heredadas de otro proceso comparten el socket: se descartan
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = queue.LifoQueue(maxsize=self._idle.maxsize)
+                    self._pid = os.getpid()
+
+    def _acquire(self):
+        """(sesión, reutilizada): reutilizada indica si salió del pool"""
+        self._reset_after_fork()
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect(), False
+            if time.monotonic() - session.last_used < self.max_idle:
+                return session, True
+            session.close()
+
+    def _release(self, session):
+        session.last_used = time.monotonic()
+        try:
+            self._idle.put_nowait(session)
+        except queue.Full:
+            session.close()
+
+    def _run(self, operation):
+        """Ejecutar operation(session) con una sesión del pool; si falla una sesión
+        reutilizada (clamd pudo cerrarla) se reintenta con otra, pero nunca tras un
+        fallo en una conexión recién abierta"""
+        while True:
+            session, reused = self._acquire()
+            try:
+                result = operation(session)
+            except (OSError, ClamdError) as e:
+                session.sock.close()
+                if reused and not isinstance(e, socket.timeout):
+                    continue
+                raise ClamdError(str(e))
+            self._release(session)
+            return result
+
+    # ========== COMANDOS ==========
+
+    def ping(self):
+        """True si clamd responde PONG"""
+        try:
+            def operation(session):
+                session.send(b'PING')
+                return session.read_reply()[1]
+            return self._run(operation) == 'PONG'
+        except ClamdError as e:
+            logging.warning(f"clamd no responde: {e}")
+            return False
+
+    def _send_stream(self, session, path):
+        def payload():
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    session.sock.sendall(struct.pack('!L', len(chunk)) + chunk)
+            session.sock.sendall(struct.pack('!L', 0))
+        return session.send(b'INSTREAM', payload)
+
+    @staticmethod
+    def _parse_result(text):
+        """'stream: OK' / 'stream: <firma> FOUND' / '<mensaje> ERROR' -> (estado, detalle)"""
+        if text.endswith(' FOUND'):
+            signature = text[:-len(' FOUND')]
+            if signature.startswith('stream: '):
+                signature = signature[len('stream: '):]
+            return 'FOUND', signature
+        if text.endswith(' ERROR'):
+            return 'ERROR', text[:-len(' ERROR')]
+        if text.endswith('OK'):
+            return 'OK', None
+        return 'ERROR', text
+
+    def scan_stream(self, path):
+        """(estado, detalle) de un archivo enviado por INSTREAM"""
+        def operation(session):
+            request_id = self._send_stream(session, path)
+            reply_id, text = session.read_reply()
+            if reply_id != request_id:
+                raise ClamdError(f"Respuesta de clamd fuera de orden ({reply_id} != {request_id})")
+            return self._parse_result(text)
+        return self._run(operation)
+
+    def scan_many(self, paths):
+        """{ruta: (estado, detalle)} enviando hasta pipeline_depth INSTREAM por sesión
+        antes de leer las respuestas (clamd puede contestarlas en otro orden)"""
+        results = {}
+        paths = list(paths)
+        for start in range(0, len(paths), self.pipeline_depth):
+            batch = paths[start:start + self.pipeline_depth]
+
+            def operation(session):
+                pending = {self._send_stream(session, path): path for path in batch}
+                replies = {}
+                while pending:
+                    reply_id, text = session.read_reply()
+                    path = pending.pop(reply_id, None)
+                    if path is None:
+                        raise ClamdError(f"Respuesta de clamd con id desconocido: {reply_id}")
+                    replies[path] = self._parse_result(text)
+                return replies
+
+            replies = self._run(operation)
+            results.update((path, replies[path]) for path in batch)
+        return results
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
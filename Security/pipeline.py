@@ -0,0 +1,185 @@
+"""
+Scanner Pipeline - Escáneres registrables que corren en paralelo
+Cada escáner se registra con prioridad, costo y timeout. Los de igual prioridad
+son independientes y corren a la vez en un pool de hilos (la latencia es la del
+más lento); los grupos de prioridad siguientes solo corren si los anteriores no
+rechazaron el archivo. El primer rechazo definitivo termina el escaneo.
+
+Un escáner registrado con gated=True corre junto a los demás de su grupo y
+recibe además un future (gate) que se resuelve a True cuando todos ellos
+aceptaron el archivo, o a False si alguno lo rechazó o falló: así puede
+adelantar el trabajo barato y reservar el costoso (p. ej. subir el archivo a
+VirusTotal) para los archivos que los demás aceptan.
+"""
+
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class ScannerStage:
+    __slots__ = ('name', 'scan', 'accept', 'reject', 'cost', 'priority', 'timeout', 'gated')
+
+    def __init__(self, name, scan, accept, reject, cost, priority, timeout, gated=False):
+        self.name = name
+        self.scan = scan            # scan(ruta, sha256[, gate]) -> dict con 'status'
+        self.accept = accept        # estados que aprueban el archivo
+        self.reject = reject        # estados que lo rechazan de forma definitiva
+        self.cost = cost
+        self.priority = priority
+        self.timeout = timeout
+        self.gated = gated
+
+
+class ScannerPipeline:
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.stages = []
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def register(self, name, scan, accept, reject, cost=1, priority=100, timeout=30.0, gated=False):
+        """Agregar un escáner; con igual prioridad los más baratos se lanzan primero.
+
+        Un resultado con status 'pending' y un 'future' deja la decisión en espera
+        (solo se admite un escáner pendiente por archivo). Con gated=True scan
+        recibe el gate de su grupo como tercer argumento.
+        """
+        self.stages.append(ScannerStage(name, scan, frozenset(accept), frozenset(reject), cost, priority, timeout, gated))
+        self.stages.sort(key=lambda stage: (stage.priority, stage.cost))
+
+    def _get_executor(self):
+        # Se crea en el primer uso: así cada worker de gunicorn tiene su propio pool
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='scanner')
+            return self._executor
+
+    def _groups(self):
+        groups = []
+        for stage in self.stages:
+            if groups and groups[-1][0].priority == stage.priority:
+                groups[-1].append(stage)
+            else:
+                groups.append([stage])
+        return groups
+
+    def run(self, file_path, sha256=None, progress=None):
+        """Resultados por escáner en results['<nombre>_result'] y tiempos en results['timings'].
+
+        final_decision es 'approved', 'rejected' (con rejected_by y definitive) o
+        'deferred' (con pending_stage y pending_future). progress(etapa, porcentaje)
+        recibe el primer escáner sin terminar.
+        """
+        started = time.perf_counter()
+        results = {'safe': False, 'final_decision': 'pending', 'timings': {}}
+        finished = set()
+        pending = None
+        rejected_by = None
+        failed = []
+
+        def report():
+            if progress:
+                remaining = [stage.name for stage in self.stages if stage.name not in finished]
+                if remaining:
+                    progress(remaining[0], 30 + 60 * len(finished) // len(self.stages))
+
+        report()
+        for group in self._groups():
+            submitted = time.perf_counter()
+            gate = Future()
+            ungated = {stage.name for stage in group if not stage.gated}
+            accepted = set()
+            if not ungated:
+                gate.set_result(True)
+            futures = {
+                self._get_executor().submit(stage.scan, file_path, sha256, *((gate,) if stage.gated else ())): stage
+                for stage in group
+            }
+            deadlines = {stage.name: submitted + stage.timeout for stage in group}
+
+            while futures and rejected_by is None:
+                timeout = max(0.0, min(deadlines[stage.name] for stage in futures.values()) - time.perf_counter())
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                now = time.perf_counter()
+
+                for future in list(futures):
+                    stage = futures[future]
+                    if future in done:
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            logging.error(f"Escáner {stage.name} falló: {e}")
+                            result = {'status': 'error', 'message': str(e)}
+                    elif now >= deadlines[stage.name]:
+                        # El hilo sigue ocupado hasta que el escáner termine, pero no se le espera
+                        logging.warning(f"Escáner {stage.name} superó {stage.timeout}s")
+                        result = {'status': 'timeout', 'message': f'{stage.name} no respondió en {stage.timeout:g}s'}
+                    else:
+                        continue
+                    del futures[future]
+                    finished.add(stage.name)
+                    results[f'{stage.name}_result'] = result
+                    results['timings'][stage.name] = round(now - submitted, 4)
+                    status = result['status']
+
+                    if status in stage.reject:
+                        rejected_by = stage.name
+                        break
+                    if status == 'pending' and 'future' in result and pending is None:
+                        pending = stage.name
+                    elif status not in stage.accept:
+                        failed.append(stage.name)
+                    else:
+                        accepted.add(stage.name)
+                    if stage.name in ungated and not gate.done():
+                        if stage.name not in accepted:
+                            gate.set_result(False)
+                        elif ungated <= accepted:
+                            gate.set_result(True)
+                    report()
+
+            if not gate.done():
+                # Rechazo o fin del grupo sin que todos aceptaran
+                gate.set_result(ungated <= accepted and rejected_by is None)
+
+            if rejected_by is not None or failed:
+                # Corto circuito: el resto no cambia la decisión (un error o timeout también
+                # rechaza, así que no se lanzan las etapas siguientes)
+                for future, stage in futures.items():
+                    future.cancel()
+                results['skipped'] = [stage.name for stage in self.stages if stage.name not in finished]
+                break
+
+        results['timings']['total'] = round(time.perf_counter() - started, 4)
+        if rejected_by is None and not failed and pending is not None:
+            results['final_decision'] = 'deferred'
+            results['pending_stage'] = pending
+            results['pending_future'] = results[f'{pending}_result'].pop('future')
+        elif rejected_by is None and not failed:
+            results['safe'] = True
+            results['final_decision'] = 'approved'
+        else:
+            if pending is not None:
+                results[f'{pending}_result'].pop('future', None)
+            results['final_decision'] = 'rejected'
+            results['rejected_by'] = rejected_by or failed[0]
+            # Definitivo = un escáner detectó algo (no un error o timeout de un servicio)
+            results['definitive'] = rejected_by is not None
+        return results
+
+    def complete(self, results, stage_result):
+        """Decisión de un escaneo 'deferred' cuando llega el resultado del escáner pendiente"""
+        name = results.pop('pending_stage')
+        results.pop('pending_future', None)
+        results[f'{name}_result'] = stage_result
+        stage = next(stage for stage in self.stages if stage.name == name)
+        if stage_result['status'] in stage.accept:
+            results['safe'] = True
+            results['final_decision'] = 'approved'
+        else:
+            results['final_decision'] = 'rejected'
+            results['rejected_by'] = name
+            results['definitive'] = stage_result['status'] in stage.reject
+        return results
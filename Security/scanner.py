@@ -1,36 +1,96 @@
+import os
+import time
+import logging
+
+from .clamd import ClamdClient, ClamdError
+from .signatures import SignatureEngine
+
+
 class ClamAVScanner:
-    def __init__(self):
+    def __init__(self, client=None, health_interval=30.0, signatures=None, fail_open=None):
+        """Las firmas locales (Aho–Corasick) se revisan siempre; además se usa clamd si
+        CLAMD_SOCKET o CLAMD_HOST están configurados (o se pasa un client).
+
+        Con clamd configurado y sin respuesta el escaneo termina en 'error' (el archivo
+        se rechaza sin recordar el veredicto). fail_open (CLAMD_FAIL_OPEN=true) acepta
+        en su lugar el resultado de las firmas locales, marcado como 'degraded'.
+        """
+        self.signatures = signatures or SignatureEngine()
+        if fail_open is None:
+            fail_open = os.getenv('CLAMD_FAIL_OPEN', 'false').lower() == 'true'
+        self.fail_open = fail_open
+        if client is None:
+            socket_path = os.getenv('CLAMD_SOCKET')
+            host = os.getenv('CLAMD_HOST')
+            if socket_path or host:
+                client = ClamdClient(
+                    socket_path=socket_path,
+                    host=host,
+                    port=int(os.getenv('CLAMD_PORT', 3310)),
+                    timeout=float(os.getenv('CLAMD_TIMEOUT', 10)),
+                    pool_size=int(os.getenv('CLAMD_POOL_SIZE', 2)),
+                    pipeline_depth=int(os.getenv('CLAMD_PIPELINE_DEPTH', 8))
+                )
+        self.client = client
+        self.health_interval = health_interval
+        self._checked_at = 0.0
         self.clamav_available = False
-        
+
+    def is_available(self):
+        """Health check con PING, como mucho una vez cada health_interval segundos"""
+        if self.client is None:
+            return False
+        now = time.monotonic()
+        if now - self._checked_at >= self.health_interval:
+            self.clamav_available = self.client.ping()
+            self._checked_at = now
+        return self.clamav_available
+
     def scan_file(self, file_path):
-        import time
-        # Simular tiempo de escaneo para hacer visible el progreso
-        time.sleep(1.5)
-        
-        # Leer contenido del archivo para detectar patrones maliciosos
+        # 1. Firmas locales: una sola pasada sobre el archivo completo
         try:
-            with open(file_path, 'rb') as f:
-                content = f.read(1024)  # Leer primeros 1KB
-                content_str = content.decode('utf-8', errors='ignore').lower()
-                
-                # Patrones que consideramos "maliciosos" para prueba
-                malicious_patterns = [
-                    'virus',
-                    'malware', 
-                    'trojan',
-                    'hack',
-                    'exploit',
-                    'payload',
-                    'backdoor',
-                    'corrupted',
-                    'malicious'
-                ]
-                
-                for pattern in malicious_patterns:
-                    if pattern in content_str:
-                        return {"status": "infected", "message": f"VIRUS DETECTADO: Patrón '{pattern}' encontrado en el archivo"}
-                        
-        except Exception as e:
-            pass  # Si no se puede leer, continuar con escaneo normal
-        
-        return {"status": "clean", "message": "Archivo escaneado - Sin amenazas detectadas"}
+            matches = self.signatures.scan_file(file_path)
+        except OSError as e:
+            logging.warning(f"No se pudo leer {file_path} para las firmas locales: {e}")
+            matches = []
+        for rule, offset in matches:
+            if rule.severity == 'block':
+                return {
+                    "status": "infected",
+                    "message": f"VIRUS DETECTADO: {rule.description or rule.id} (firma '{rule.id}' en byte {offset})",
+                    "engine": "signatures"
+                }
+        warnings = sorted({rule.id for rule, _ in matches})
+
+        # 2. clamd, si está configurado
+        result = {"status": "clean", "message": "Archivo escaneado - Sin amenazas detectadas", "engine": "signatures"}
+        if self.client is not None:
+            error = None
+            if not self.is_available():
+                error = "clamd no responde a PING"
+            else:
+                try:
+                    status, detail = self.client.scan_stream(file_path)
+                except ClamdError as e:
+                    error = str(e)
+                    # Forzar un nuevo PING en el próximo escaneo
+                    self._checked_at = 0.0
+                else:
+                    if status == 'FOUND':
+                        return {"status": "infected", "message": f"VIRUS DETECTADO: {detail}", "engine": "clamd"}
+                    if status != 'OK':
+                        return {"status": "error", "message": f"Error de clamd: {detail}", "engine": "clamd"}
+                    result["engine"] = "clamd+signatures"
+
+            if error is not None:
+                if not self.fail_open:
+                    logging.warning(f"clamd no disponible, archivo no escaneado: {error}")
+                    return {"status": "error", "message": f"clamd no disponible: {error}", "engine": "clamd"}
+                logging.warning(f"clamd no disponible, solo se usan firmas locales (CLAMD_FAIL_OPEN): {error}")
+                result["degraded"] = True
+
+        if warnings:
+            result["status"] = "warning"
+            result["message"] = f"Contenido a revisar: {', '.join(warnings)}"
+            result["warnings"] = warnings
+        return result
@@ -3,15 +3,18 @@ Security Manager - Coordina escáneres de seguridad
 """
 
 import os
-import time
+import logging
 from .scanner import ClamAVScanner
 from .virus import VirusTotalScanner
+from .pipeline import ScannerPipeline
 
 class SecurityManager:
     def __init__(self, upload_folder="uploads"):
         self.upload_folder = upload_folder
         self.clamav_scanner = ClamAVScanner()
         self.virustotal_scanner = VirusTotalScanner()
+        self.pipeline = ScannerPipeline(max_workers=int(os.getenv('SCAN_PIPELINE_WORKERS', 4)))
+        self._register_scanners()
         
         # Crear directorios necesarios
         self._setup_directories()
@@ -27,58 +30,81 @@ class SecurityManager:
         for directory in directories:
             os.makedirs(directory, exist_ok=True)
     
-    def scan_file(self, file_path):
-        """Escanear archivo con ambos escáneres"""
-        import logging
-        import time
+    def _register_scanners(self):
+        """Escáneres del pipeline: ClamAV (firmas locales + clamd) y VirusTotal.
+
+        Por defecto corren a la vez (la latencia es la del más lento): VirusTotal
+        consulta el hash de inmediato y solo sube un archivo desconocido si ClamAV
+        lo acepta. Con VIRUSTOTAL_AFTER_LOCAL=true VirusTotal es una etapa
+        posterior y no se consulta por archivos que ClamAV rechazó.
+        """
+        after_local = os.getenv('VIRUSTOTAL_AFTER_LOCAL', 'false').lower() == 'true'
+        self.pipeline.register(
+            'clamav',
+            lambda path, sha256: self.clamav_scanner.scan_file(path),
+            accept=('clean', 'warning'),
+            reject=('infected',),
+            cost=1,
+            timeout=float(os.getenv('CLAMAV_TIMEOUT', 60))
+        )
+        # Su timeout solo debe cubrir VIRUSTOTAL_WAIT (el veredicto que tarda más queda diferido)
+        self.pipeline.register(
+            'virustotal',
+            lambda path, sha256, gate=None: self.virustotal_scanner.check_file_reputation(
+                path, sha256=sha256, upload_gate=gate),
+            accept=('clean', 'no_api_key'),
+            reject=('malicious', 'suspicious'),
+            cost=10,
+            priority=200 if after_local else 100,
+            gated=not after_local,
+            timeout=self.virustotal_scanner.wait + 10
+        )
+    
+    def scan_file(self, file_path, progress=None, sha256=None):
+        """Escanear archivo con todos los escáneres registrados.
+
+        progress(etapa, porcentaje) es opcional y permite reportar el avance
+        cuando el escaneo corre como job en segundo plano. sha256 evita volver
+        a leer el archivo para consultar VirusTotal.
+
+        Los tiempos por escáner quedan en results['timings']. Si VirusTotal no
+        responde a tiempo la decisión queda en 'deferred' y
+        results['pending_future'] trae el future del veredicto; al llegar se
+        completa con complete_scan().
+        """
         filename = os.path.basename(file_path)
         
-        # Log inicio de escaneo
-        print(f"[SECURITY] Iniciando escaneo completo de: {filename}")
-        logging.info(f"SECURITY SCAN INICIADO - Archivo: {filename}")
-        
-        results = {
-            'safe': False,
-            'clamav_result': None,
-            'virustotal_result': None,
-            'final_decision': 'pending'
-        }
-        
-        # Retraso para hacer visible el inicio
-        time.sleep(1)
-        
-        # Escaneo con ClamAV
-        print(f"[ClamAV] Escaneando {filename}...")
-        results['clamav_result'] = self.clamav_scanner.scan_file(file_path)
-        clamav_status = results['clamav_result']['status']
-        print(f"[ClamAV] Resultado: {clamav_status}")
-        
-        # Retraso para hacer visible el progreso
-        time.sleep(2)
+        logging.debug("SECURITY SCAN INICIADO - Archivo: %s", filename)
         
-        # Escaneo con VirusTotal
-        print(f"[VirusTotal] Verificando {filename}...")
-        results['virustotal_result'] = self.virustotal_scanner.check_file_reputation(file_path)
-        vt_status = results['virustotal_result']['status']
-        print(f"[VirusTotal] Resultado: {vt_status}")
+        results = self.pipeline.run(file_path, sha256=sha256, progress=progress)
+        timings = ', '.join(f"{name}={seconds}s" for name, seconds in results['timings'].items())
+        logging.info(f"SECURITY SCAN {filename}: {timings}", extra={'timings': results['timings']})
         
-        # Retraso para hacer visible el progreso
-        time.sleep(2)
+        if results['final_decision'] == 'deferred':
+            # No esperar aquí: quien pidió el escaneo decide dónde retener el archivo
+            logging.info(f"SECURITY SCAN EN ESPERA - {filename}: veredicto de {results['pending_stage']} pendiente")
+            return results
         
-        # Decisión final (por ahora, simple)
-        clamav_ok = results['clamav_result']['status'] in ['clean', 'warning']
-        vt_ok = results['virustotal_result']['status'] in ['clean', 'no_api_key']
-        
-        if clamav_ok and vt_ok:
-            results['safe'] = True
-            results['final_decision'] = 'approved'
-            print(f"[SECURITY] {filename} APROBADO - Archivo seguro")
+        if progress:
+            progress('final', 95)
+        self._log_decision(results, filename)
+        return results
+    
+    def complete_scan(self, results, stage_result, filename):
+        """Decisión final de un escaneo en 'deferred' cuando llega el resultado pendiente"""
+        logging.info(f"SECURITY SCAN resultado diferido de {results['pending_stage']} para {filename}: {stage_result['status']}")
+        self.pipeline.complete(results, stage_result)
+        self._log_decision(results, filename)
+        return results
+    
+    def _log_decision(self, results, filename):
+        if results['final_decision'] == 'approved':
             logging.info(f"SECURITY SCAN COMPLETADO - {filename} APROBADO")
         else:
-            results['final_decision'] = 'rejected'
-            print(f"[SECURITY] {filename} RECHAZADO - Archivo potencialmente peligroso")
-            if results['clamav_result']['status'] == 'infected':
-                print(f"[SECURITY] AMENAZA DETECTADA: {results['clamav_result']['message']}")
-            logging.warning(f"SECURITY SCAN COMPLETADO - {filename} RECHAZADO")
-        
-        return results
+            clamav_result = results.get('clamav_result')
+            threat = clamav_result['message'] if clamav_result and clamav_result['status'] == 'infected' else None
+            logging.warning(
+                f"SECURITY SCAN COMPLETADO - {filename} RECHAZADO ({results['rejected_by']})"
+                + (f": {threat}" if threat else ""),
+                extra={'rejected_by': results['rejected_by'], 'threat': threat}
+            )
@@ -0,0 +1,207 @@
+"""
+Motor de firmas local - Aho–Corasick sobre el archivo completo
+Las reglas (texto, hex y marcadores PDF como /JavaScript o /Launch) se compilan
+en un autómata con tabla de transiciones completa; el archivo se recorre en
+bloques en una sola pasada lineal. Las reglas se recargan solas cuando cambia
+el archivo JSON.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(__file__), 'rules', 'signatures.json')
+
+
+class Rule:
+    __slots__ = ('id', 'pattern', 'nocase', 'severity', 'description', 'max_offset')
+
+    def __init__(self, id, pattern, nocase, severity, description, max_offset=None):
+        self.id = id
+        self.pattern = pattern
+        self.nocase = nocase
+        self.severity = severity
+        self.description = description
+        self.max_offset = max_offset    # Solo coincidencias que empiezan antes de este offset
+
+    @classmethod
+    def from_dict(cls, data):
+        kind = data.get('type', 'string')
+        if kind == 'hex':
+            pattern = bytes.fromhex(data['pattern'])
+            nocase = False
+        elif kind == 'string':
+            pattern = data['pattern'].encode('utf-8')
+            nocase = data.get('nocase', True)
+        else:
+            raise ValueError(f"Tipo de regla desconocido: {kind}")
+        if not pattern:
+            raise ValueError(f"Regla {data.get('id')} sin patrón")
+        severity = data.get('severity', 'block')
+        if severity not in ('block', 'warn'):
+            raise ValueError(f"Severidad desconocida en {data.get('id')}: {severity}")
+        max_offset = data.get('max_offset')
+        return cls(data['id'], pattern, nocase, severity, data.get('description', ''),
+                   int(max_offset) if max_offset is not None else None)
+
+
+class SignatureSet:
+    """Reglas compiladas en un autómata Aho–Corasick sobre bytes en minúsculas.
+
+    Las reglas sensibles a mayúsculas se buscan igual en minúsculas y se
+    verifican contra los bytes originales al encontrarlas.
+    """
+
+    def __init__(self, rules, digest=''):
+        self.rules = rules
+        self.digest = digest
+        self.max_length = max((len(rule.pattern) for rule in rules), default=0)
+        self._build()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        data = json.loads(raw.decode('utf-8'))
+        rules = [Rule.from_dict(item) for item in data.get('rules', [])]
+        return cls(rules, digest=hashlib.sha256(raw).hexdigest()[:16])
+
+    def _build(self):
+        goto = [{}]
+        outputs = [[]]
+        for index, rule in enumerate(self.rules):
+            state = 0
+            for byte in rule.pattern.lower():
+                nxt = goto[state].get(byte)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][byte] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(index)
+
+        # Enlaces de fallo por BFS y tabla de transiciones completa (256 por estado):
+        # el recorrido hace un solo acceso por byte, sin seguir enlaces de fallo
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = [goto[0].get(byte, 0) for byte in range(256)]
+        order = list(goto[0].values())     # los hijos de la raíz fallan a la raíz
+        i = 0
+        while i < len(order):
+            state = order[i]
+            i += 1
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            row = list(delta[fail[state]])
+            for byte, nxt in goto[state].items():
+                row[byte] = nxt
+                fail[nxt] = delta[fail[state]][byte]
+                order.append(nxt)
+            delta[state] = row
+
+        self._delta = delta
+        self._outputs = [tuple(out) for out in outputs]
+        # Desde la raíz se salta en C hasta el siguiente byte que inicia algún patrón
+        first_bytes = sorted(goto[0])
+        self._root_skip = re.compile(b'[' + b''.join(re.escape(bytes([b])) for b in first_bytes) + b']') \
+            if first_bytes else None
+
+    def scan_chunks(self, chunks, stop_on_block=True):
+        """[(regla, offset)] sobre un iterable de bloques de bytes (una sola pasada)"""
+        matches = []
+        if self._root_skip is None:
+            return matches
+        delta = self._delta
+        outputs = self._outputs
+        rules = self.rules
+        root_skip = self._root_skip
+        keep = max(self.max_length - 1, 0)
+        state = 0
+        offset = 0          # offset del inicio del bloque actual en el archivo
+        tail = b''          # últimos bytes originales del bloque anterior (para verificar)
+
+        for chunk in chunks:
+            lowered = chunk.lower()
+            window = tail + chunk
+            pos = 0
+            size = len(lowered)
+            while pos < size:
+                if state == 0:
+                    found = root_skip.search(lowered, pos)
+                    if found is None:
+                        break
+                    pos = found.start()
+                state = delta[state][lowered[pos]]
+                pos += 1
+                for index in outputs[state]:
+                    rule = rules[index]
+                    start = offset + pos - len(rule.pattern)
+                    if rule.max_offset is not None and start >= rule.max_offset:
+                        continue
+                    end = len(tail) + pos
+                    if not rule.nocase and window[end - len(rule.pattern):end] != rule.pattern:
+                        continue
+                    matches.append((rule, start))
+                    if stop_on_block and rule.severity == 'block':
+                        return matches
+            offset += size
+            tail = window[-keep:] if keep else b''
+        return matches
+
+    def scan_file(self, path, chunk_size=CHUNK_SIZE, stop_on_block=True):
+        with open(path, 'rb') as f:
+            return self.scan_chunks(iter(lambda: f.read(chunk_size), b''), stop_on_block)
+
+
+class SignatureEngine:
+    """SignatureSet que se recompila cuando cambia el archivo de reglas"""
+
+    def __init__(self, rules_file=None, check_interval=5.0):
+        self.rules_file = rules_file or os.getenv('SIGNATURE_RULES_FILE') or DEFAULT_RULES_FILE
+        self.check_interval = check_interval
+        self._signature_set = SignatureSet([])
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._reload()
+
+    @property
+    def digest(self):
+        return self._current().digest
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.rules_file).st_mtime_ns
+        except OSError as e:
+            logging.warning(f"Archivo de firmas no disponible ({self.rules_file}): {e}")
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            signature_set = SignatureSet.from_file(self.rules_file)
+        except (OSError, ValueError, KeyError) as e:
+            # Reglas inválidas: se conservan las anteriores
+            logging.error(f"Error compilando firmas de {self.rules_file}: {e}")
+            self._mtime = mtime
+            return
+        self._signature_set = signature_set
+        self._mtime = mtime
+        logging.info(f"Firmas cargadas: {len(signature_set.rules)} reglas ({signature_set.digest})")
+
+    def _current(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if now - self._checked_at >= self.check_interval:
+                    self._reload()
+                    self._checked_at = now
+        return self._signature_set
+
+    def scan_file(self, path, stop_on_block=True):
+        """[(regla, offset)] encontrados en el archivo completo"""
+        return self._current().scan_file(path, stop_on_block=stop_on_block)
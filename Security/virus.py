@@ -1,157 +1,357 @@
-import requests
-import hashlib
+"""
+VirusTotal - Cliente asíncrono con límite de tasa
+Las consultas corren en un event loop propio (un hilo por proceso): el hilo de
+escaneo espera el veredicto solo unos segundos y, si VirusTotal sigue
+analizando el archivo, recibe un future para continuar cuando llegue.
+El contenido se lee antes de encolar la consulta: el archivo puede moverse (a
+cuarentena) o borrarse mientras la consulta espera su turno en la cuota.
+Un token bucket respeta la cuota de la API gratuita (4 peticiones por minuto y
+500 al día), los errores transitorios se reintentan con backoff exponencial y
+las consultas en curso del mismo hash se comparten.
+"""
+
+import os
 import time
+import atexit
+import random
+import asyncio
+import hashlib
 import logging
-import os
+import functools
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
 from typing import Dict, Optional
 
+import requests
+
+# aiohttp es opcional: sin él las peticiones se hacen con requests en hilos del loop
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+DEFAULT_BASE_URL = 'https://www.virustotal.com/api/v3'
+USER_AGENT = 'GeoportalPR-SecurityScanner/1.0'
+MAX_UPLOAD_SIZE = 32 * 1024 * 1024      # límite de /files en la API gratuita
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class VirusTotalError(Exception):
+    """VirusTotal no disponible tras los reintentos"""
+
+
+class QuotaExceededError(VirusTotalError):
+    """Se agotó la cuota diaria de peticiones"""
+
+
+class _TransientError(Exception):
+    """Error de red o timeout de una petición (se reintenta)"""
+
+
+class TokenBucket:
+    """Hasta capacity peticiones seguidas; los tokens se reponen a rate por segundo"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Con el lock tomado, quien espera un token no deja pasar a los que llegaron después
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _AiohttpTransport:
+    def __init__(self, headers, timeout):
+        self.headers = headers
+        self.timeout = timeout
+        self._session = None
+
+    async def request(self, method, url, upload=None):
+        """(código HTTP, json o None); upload es (nombre, bytes) para /files"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers, timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        try:
+            if upload is None:
+                async with self._session.request(method, url) as response:
+                    return response.status, await self._json(response)
+            form = aiohttp.FormData()
+            form.add_field('file', upload[1], filename=upload[0])
+            async with self._session.request(method, url, data=form) as response:
+                return response.status, await self._json(response)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise _TransientError(f"{type(e).__name__}: {e}")
+
+    @staticmethod
+    async def _json(response):
+        try:
+            return await response.json(content_type=None)
+        except ValueError:
+            return None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class _RequestsTransport:
+    """Alternativa sin aiohttp: requests en el executor por defecto del loop"""
+
+    def __init__(self, headers, timeout):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+
+    async def request(self, method, url, upload=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self._request, method, url, upload))
+
+    def _request(self, method, url, upload):
+        try:
+            if upload is None:
+                response = self.session.request(method, url, timeout=self.timeout)
+            else:
+                response = self.session.request(method, url, files={'file': upload}, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise _TransientError(f"{type(e).__name__}: {e}")
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+    async def close(self):
+        self.session.close()
+
+
+class AsyncVirusTotalClient:
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, timeout=30.0, max_wait=120.0,
+                 requests_per_minute=4, daily_quota=500, max_retries=3, backoff=2.0, poll_interval=15.0):
+        """timeout es por petición HTTP; max_wait acota el veredicto completo (esperas
+        por cuota, reintentos y el análisis de un archivo nuevo).
+
+        La cuota es por proceso: con varios workers de gunicorn conviene repartirla.
+        """
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.requests_per_minute = requests_per_minute
+        self.daily_quota = daily_quota
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def __repr__(self):
+        return f"AsyncVirusTotalClient({self.base_url})"
+
+    # ========== EVENT LOOP ==========
+
+    def _ensure_loop(self):
+        with self._lock:
+            # Tras un fork el hilo del loop no existe en el hijo: se crea uno nuevo
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='virustotal-loop', daemon=True).start()
+                headers = {'x-apikey': self.api_key, 'User-Agent': USER_AGENT}
+                transport = _AiohttpTransport if AIOHTTP_AVAILABLE else _RequestsTransport
+                self._transport = transport(headers, self.timeout)
+                self._bucket = None
+                self._inflight = {}
+                self._day = None
+                self._day_count = 0
+                self._loop = loop
+                self._pid = os.getpid()
+            return self._loop
+
+    def submit(self, sha256, content=None, filename='file', gate=None):
+        """concurrent.futures.Future con el veredicto (dict); el future no lanza excepciones.
+
+        Si el hash no es conocido y se indica content (bytes), se sube para analizarlo;
+        con gate (concurrent.futures.Future) solo se sube si se resuelve a True.
+        """
+        return asyncio.run_coroutine_threadsafe(self.verdict(sha256, content, filename, gate), self._ensure_loop())
+
+    def close(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                return
+            loop, self._loop = self._loop, None
+        try:
+            asyncio.run_coroutine_threadsafe(self._transport.close(), loop).result(timeout=5)
+        except Exception as e:
+            logging.warning(f"No se pudo cerrar el cliente de VirusTotal: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+    # ========== VEREDICTOS ==========
+
+    async def verdict(self, sha256, content=None, filename='file', gate=None):
+        """Veredicto de un hash; las consultas del mismo hash en curso se comparten"""
+        task = self._inflight.get(sha256)
+        if task is None:
+            task = asyncio.ensure_future(self._verdict_within_deadline(sha256, content, filename, gate))
+            self._inflight[sha256] = task
+            task.add_done_callback(lambda done: self._inflight.get(sha256) is done and self._inflight.pop(sha256))
+        # shield: si un interesado deja de esperar, la consulta sigue para los demás
+        return await asyncio.shield(task)
+
+    async def _verdict_within_deadline(self, sha256, content, filename, gate):
+        try:
+            return await asyncio.wait_for(self._verdict(sha256, content, filename, gate), self.max_wait)
+        except asyncio.TimeoutError:
+            return {'status': 'timeout', 'message': f'Timeout esperando análisis de VirusTotal ({self.max_wait:g}s)'}
+        except QuotaExceededError as e:
+            logging.warning(f"VirusTotal: {e}")
+            return {'status': 'quota_exceeded', 'message': str(e)}
+        except Exception as e:
+            logging.error(f"Error VirusTotal: {e}")
+            return {'status': 'error', 'message': str(e)}
+
+    async def _verdict(self, sha256, content, filename, gate=None):
+        # Buscar por hash primero (más rápido)
+        status, data = await self._request('GET', f'/files/{sha256}')
+        if status == 200:
+            return self._from_stats(data['data']['attributes']['last_analysis_stats'])
+        if status == 404 and content is not None:
+            # Archivo no conocido: se sube solo si los escáneres locales lo aceptan
+            if gate is not None and not await asyncio.wrap_future(gate):
+                return {'status': 'skipped', 'message': 'Rechazado por los escáneres locales: no se sube a VirusTotal'}
+            return await self._analyze(content, filename)
+        return {'status': 'error', 'message': f'Error API: {status}'}
+
+    async def _analyze(self, content, filename):
+        if len(content) > MAX_UPLOAD_SIZE:
+            return {'status': 'too_large', 'message': 'Archivo muy grande para VirusTotal (>32MB)'}
+
+        status, data = await self._request('POST', '/files', upload=(filename, content))
+        if status != 200:
+            return {'status': 'upload_error', 'message': f'Error subiendo: {status}'}
+        analysis_id = data['data']['id']
+
+        # Cada consulta gasta cuota: el intervalo crece hasta un minuto
+        interval = self.poll_interval
+        while True:
+            await asyncio.sleep(interval)
+            status, data = await self._request('GET', f'/analyses/{analysis_id}')
+            if status != 200:
+                return {'status': 'error', 'message': f'Error API: {status}'}
+            attributes = data['data']['attributes']
+            if attributes['status'] == 'completed':
+                return self._from_stats(attributes['stats'], new=True)
+            interval = min(interval * 1.5, 60.0)
+
+    @staticmethod
+    def _from_stats(stats, new=False):
+        malicious = stats.get('malicious', 0)
+        suspicious = stats.get('suspicious', 0)
+        total_scans = sum(stats.values())
+        subject = 'NUEVO archivo' if new else 'Archivo'
+
+        if malicious > 0:
+            status, message = 'malicious', f'{subject} detectado como malicioso por {malicious}/{total_scans} motores'
+        elif suspicious > 0:
+            status, message = 'suspicious', f'{subject} marcado como sospechoso por {suspicious}/{total_scans} motores'
+        else:
+            status, message = 'clean', f'{subject} limpio según {total_scans} motores'
+        return {'status': status, 'message': message, 'details': stats}
+
+    # ========== HTTP ==========
+
+    def _take_daily(self):
+        today = datetime.now(timezone.utc).date()
+        if today != self._day:
+            self._day = today
+            self._day_count = 0
+        if self.daily_quota and self._day_count >= self.daily_quota:
+            raise QuotaExceededError(f"Cuota diaria de VirusTotal agotada ({self.daily_quota} peticiones)")
+        self._day_count += 1
+
+    async def _request(self, method, path, upload=None):
+        """(código HTTP, json) con límite de tasa y reintentos con backoff exponencial"""
+        if self._bucket is None:
+            self._bucket = TokenBucket(self.requests_per_minute / 60.0, self.requests_per_minute)
+        for attempt in range(self.max_retries + 1):
+            self._take_daily()
+            await self._bucket.acquire()
+            try:
+                status, data = await self._transport.request(method, self.base_url + path, upload)
+            except _TransientError as e:
+                error = str(e)
+            else:
+                if status not in RETRY_STATUSES:
+                    return status, data
+                error = f"HTTP {status}"
+            if attempt < self.max_retries:
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logging.warning(f"VirusTotal {method} {path}: {error}, reintento en {delay:.1f}s")
+                await asyncio.sleep(delay)
+        raise VirusTotalError(f"VirusTotal no disponible tras {self.max_retries + 1} intentos: {error}")
+
+
 class VirusTotalScanner:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, client: Optional[AsyncVirusTotalClient] = None, wait: float = None):
+        """wait: segundos que check_file_reputation() espera el veredicto antes de
+        devolverlo como pendiente"""
         self.api_key = api_key or os.getenv('VIRUSTOTAL_API_KEY')
-        self.base_url = 'https://www.virustotal.com/api/v3'
-        self.session = requests.Session()
-        self.session.headers.update({
-            'x-apikey': self.api_key,
-            'User-Agent': 'GeoportalPR-SecurityScanner/1.0'
-        })
-        
+        self.wait = wait if wait is not None else float(os.getenv('VIRUSTOTAL_WAIT', 5))
+        if client is None and self.api_key:
+            client = AsyncVirusTotalClient(
+                self.api_key,
+                base_url=os.getenv('VIRUSTOTAL_BASE_URL') or DEFAULT_BASE_URL,
+                timeout=float(os.getenv('VIRUSTOTAL_REQUEST_TIMEOUT', 30)),
+                max_wait=float(os.getenv('VIRUSTOTAL_TIMEOUT', 120)),
+                requests_per_minute=int(os.getenv('VIRUSTOTAL_REQUESTS_PER_MINUTE', 4)),
+                daily_quota=int(os.getenv('VIRUSTOTAL_DAILY_QUOTA', 500))
+            )
+        self.client = client
+
     def get_file_hash(self, file_path: str) -> str:
         """Calcular SHA256 del archivo"""
         sha256_hash = hashlib.sha256()
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
                 sha256_hash.update(chunk)
         return sha256_hash.hexdigest()
-    
-    def check_file_reputation(self, file_path: str) -> Dict:
-        """Verificar reputación del archivo por hash"""
-        # Simular tiempo de consulta para hacer visible el progreso
-        time.sleep(1.5)
-        
-        if not self.api_key:
+
+    def check_file_reputation(self, file_path: str, sha256: str = None, wait: float = None,
+                              upload_gate: Future = None) -> Dict:
+        """Verificar reputación del archivo por hash (sha256 se calcula si no se indica).
+
+        Si el veredicto no llega en wait segundos devuelve status 'pending' con el
+        concurrent.futures.Future del veredicto en 'future'. Con upload_gate un
+        archivo desconocido solo se sube si el gate se resuelve a True.
+        """
+        if self.client is None:
             return {'status': 'no_api_key', 'message': 'API key no configurada - archivo procesado localmente'}
-        
-        try:
-            file_hash = self.get_file_hash(file_path)
-            
-            # Buscar por hash primero (más rápido)
-            response = self.session.get(f'{self.base_url}/files/{file_hash}')
-            
-            if response.status_code == 200:
-                data = response.json()
-                stats = data['data']['attributes']['last_analysis_stats']
-                
-                malicious = stats.get('malicious', 0)
-                suspicious = stats.get('suspicious', 0)
-                total_scans = sum(stats.values())
-                
-                if malicious > 0:
-                    return {
-                        'status': 'malicious',
-                        'message': f'Detectado como malicioso por {malicious}/{total_scans} motores',
-                        'details': stats
-                    }
-                elif suspicious > 0:
-                    return {
-                        'status': 'suspicious',
-                        'message': f'Marcado como sospechoso por {suspicious}/{total_scans} motores',
-                        'details': stats
-                    }
-                else:
-                    return {
-                        'status': 'clean',
-                        'message': f'Archivo limpio según {total_scans} motores',
-                        'details': stats
-                    }
-            
-            elif response.status_code == 404:
-                # Archivo no conocido, enviar para análisis
-                return self.upload_file_for_analysis(file_path)
-            
-            else:
-                return {
-                    'status': 'error',
-                    'message': f'Error API: {response.status_code}'
-                }
-                
-        except Exception as e:
-            logging.error(f"Error VirusTotal: {e}")
-            return {'status': 'error', 'message': str(e)}
-    
-    def upload_file_for_analysis(self, file_path: str) -> Dict:
-        """Subir archivo para análisis (archivos nuevos)"""
+
+        # Una lectura ahora: la consulta puede esperar en la cuota más que el archivo en su ruta
+        with open(file_path, 'rb') as f:
+            content = f.read(MAX_UPLOAD_SIZE + 1)
+        if sha256 is None:
+            sha256 = self.get_file_hash(file_path) if len(content) > MAX_UPLOAD_SIZE else hashlib.sha256(content).hexdigest()
+        future = self.client.submit(sha256, content, os.path.basename(file_path), gate=upload_gate)
         try:
-            file_size = os.path.getsize(file_path)
-            
-            # VirusTotal tiene límite de 32MB para API gratuita
-            if file_size > 32 * 1024 * 1024:
-                return {
-                    'status': 'too_large',
-                    'message': 'Archivo muy grande para VirusTotal (>32MB)'
-                }
-            
-            with open(file_path, 'rb') as f:
-                files = {'file': f}
-                response = self.session.post(f'{self.base_url}/files', files=files)
-            
-            if response.status_code == 200:
-                analysis_id = response.json()['data']['id']
-                
-                # Esperar resultado (máximo 2 minutos)
-                return self.wait_for_analysis(analysis_id)
-            else:
-                return {
-                    'status': 'upload_error',
-                    'message': f'Error subiendo: {response.status_code}'
-                }
-                
-        except Exception as e:
-            return {'status': 'error', 'message': str(e)}
-    
-    def wait_for_analysis(self, analysis_id: str, max_wait: int = 120) -> Dict:
-        """Esperar resultado del análisis"""
-        start_time = time.time()
-        
-        while time.time() - start_time < max_wait:
-            try:
-                response = self.session.get(f'{self.base_url}/analyses/{analysis_id}')
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    if data['data']['attributes']['status'] == 'completed':
-                        stats = data['data']['attributes']['stats']
-                        
-                        malicious = stats.get('malicious', 0)
-                        suspicious = stats.get('suspicious', 0)
-                        total_scans = sum(stats.values())
-                        
-                        if malicious > 0:
-                            return {
-                                'status': 'malicious',
-                                'message': f'NUEVO archivo detectado como malicioso por {malicious}/{total_scans} motores',
-                                'details': stats
-                            }
-                        elif suspicious > 0:
-                            return {
-                                'status': 'suspicious',
-                                'message': f'NUEVO archivo marcado como sospechoso por {suspicious}/{total_scans} motores',
-                                'details': stats
-                            }
-                        else:
-                            return {
-                                'status': 'clean',
-                                'message': f'NUEVO archivo limpio según {total_scans} motores',
-                                'details': stats
-                            }
-                
-                time.sleep(5)  # Esperar 5 segundos antes de verificar nuevamente
-                
-            except Exception as e:
-                logging.error(f"Error esperando análisis: {e}")
-                break
-        
-        return {
-            'status': 'timeout',
-            'message': 'Timeout esperando análisis de VirusTotal'
-        }
\ No newline at end of file
+            return future.result(timeout=self.wait if wait is None else wait)
+        except FutureTimeoutError:
+            return {
+                'status': 'pending',
+                'message': 'Análisis de VirusTotal en curso',
+                'future': future
+            }
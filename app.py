@@ -1,11 +1,19 @@
-from flask import Flask, request, jsonify, send_from_directory, abort, render_template, make_response, session, redirect, url_for, flash
+from flask import Flask, request, jsonify, send_from_directory, send_file, abort, render_template, make_response, session, redirect, url_for, flash, g
 from flask_session import Session
-import os, uuid, sqlite3, hashlib, logging, time, sys
-from datetime import datetime
+import os, uuid, hashlib, hmac, logging, time, sys, json, base64, math
+from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
-import PyPDF2
-import pdfplumber
-import io
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+import db
+import scan_jobs
+from verdict_cache import VerdictCache, SCAN_VERDICT_VERSION
+from blob_store import BlobStore
+from upload_ingest import IngestedUpload, StreamingRequest
+from pdf_validator import PDFValidator, PDFSandbox, SandboxBusyError, SandboxTimeoutError
+from log_pipeline import setup_logging
+import metrics
+from request_profiler import RequestProfiler, top_functions
+from Geo import FeatureStore, FeatureLog, GeoJSONPublisher, TileCache, MAX_ZOOM, ClusterIndex
 
 # Cargar variables de entorno desde archivo .env (si existe)
 try:
@@ -21,10 +29,8 @@ except Exception as e:
 try:
     from Security.security_manager import SecurityManager
     SECURITY_AVAILABLE = True
-    print("Modulo de seguridad avanzada cargado exitosamente")
 except ImportError:
     SECURITY_AVAILABLE = False
-    print("Modulo de seguridad no disponible - usando validacion basica")
 
 # Intentar importar PIL, si no está disponible, usar validación básica
 try:
@@ -81,14 +87,18 @@ except Exception:
     # Si no es posible reconfigurar, continuar sin fallo
     pass
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/security.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Las peticiones solo encolan los registros: un hilo por worker los escribe en
+# stderr y en LOG_FILE (JSON por líneas, rotación compartida entre workers)
+setup_logging()
+
+# Métricas de este worker; con METRICS_DIR /metrics suma las de todos los workers
+metrics.REGISTRY.configure(os.getenv('METRICS_DIR'), flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', 5)))
+HTTP_REQUESTS = metrics.counter('http_requests_total', 'Peticiones HTTP por ruta, método y estado', ('route', 'method', 'status'))
+HTTP_SECONDS = metrics.histogram('http_request_duration_seconds', 'Duración de las peticiones HTTP por ruta', ('route', 'method'))
+UPLOAD_STAGE_SECONDS = metrics.histogram('upload_stage_duration_seconds', 'Duración de cada etapa de la validación de archivos', ('stage',))
+UPLOAD_VERDICTS = metrics.counter('upload_verdicts_total', 'Veredictos de archivos subidos', ('verdict', 'source'))
+GEOJSON_SECONDS = metrics.histogram('geojson_duration_seconds', 'Carga y escritura del snapshot GeoJSON y reconstrucción de /data.geojson', ('operation',))
+CACHE_REQUESTS = metrics.counter('cache_requests_total', 'Consultas a cachés por resultado (hit/miss)', ('cache', 'result'))
 
 # Inicializar SecurityManager si está disponible
 if SECURITY_AVAILABLE:
@@ -98,129 +108,290 @@ else:
     security_manager = None
     logging.warning("SecurityManager no disponible - usando validacion basica")
 
-def init_database():
-    """Initialize database - create directories and tables if they don't exist"""
-    try:
-        # Crear directorio de la base de datos si no existe
-        db_dir = os.path.dirname(DB_FILE)
-        if db_dir:
-            os.makedirs(db_dir, exist_ok=True)
-        
-        # Crear tabla si no existe
-        conn = sqlite3.connect(DB_FILE)
-        conn.execute('''CREATE TABLE IF NOT EXISTS solicitudes (
-            id TEXT PRIMARY KEY,
-            feature_id TEXT,
-            user TEXT,
-            email TEXT,
-            municipality TEXT,
-            entity TEXT,
-            text TEXT,
-            file_path TEXT,
-            created_at TEXT,
-            status TEXT DEFAULT 'new'
-        )''')
-        
-        # Verificar si necesitamos agregar las nuevas columnas (para compatibilidad con DBs existentes)
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(solicitudes)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        # Agregar columnas nuevas si no existen
-        if 'email' not in columns:
-            conn.execute('ALTER TABLE solicitudes ADD COLUMN email TEXT')
-        if 'municipality' not in columns:
-            conn.execute('ALTER TABLE solicitudes ADD COLUMN municipality TEXT')
-        if 'entity' not in columns:
-            conn.execute('ALTER TABLE solicitudes ADD COLUMN entity TEXT')
-        if 'status' not in columns:
-            conn.execute('ALTER TABLE solicitudes ADD COLUMN status TEXT DEFAULT "new"')
-        
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logging.error(f"Error inicializando base de datos: {e}")
-        return False
+# Acceso a datos: pool de conexiones persistentes por proceso
+database = db.Database(DB_FILE)
+
+# Veredictos de escaneo por SHA-256; la versión separa los obtenidos con
+# otra configuración de escáneres (p. ej. antes de configurar VirusTotal) o
+# con otras firmas locales (se recargan en caliente)
+SCAN_CONFIG_VERSION = '-'.join([
+    SCAN_VERDICT_VERSION,
+    'advanced' if SECURITY_AVAILABLE else 'basic',
+    'vt' if os.getenv('VIRUSTOTAL_API_KEY') else 'local',
+    'clamd' if os.getenv('CLAMD_SOCKET') or os.getenv('CLAMD_HOST') else 'patterns'
+])
+
+def scan_verdict_version():
+    if SECURITY_AVAILABLE and security_manager:
+        return f"{SCAN_CONFIG_VERSION}-{security_manager.clamav_scanner.signatures.digest}"
+    return SCAN_CONFIG_VERSION
+
+verdict_cache = VerdictCache(
+    database,
+    ttl=int(os.getenv('SCAN_VERDICT_TTL', 7 * 24 * 3600)),
+    max_entries=int(os.getenv('SCAN_VERDICT_MAX_ENTRIES', 10000)),
+    version=scan_verdict_version
+)
+
+# Features del mapa: data.geojson es un snapshot que se parsea una vez; los envíos
+# nuevos van al log append-only y se compactan al archivo en segundo plano
+feature_store = FeatureStore(
+    GEOJSON_FILE, FeatureLog(database),
+    observer=lambda operation, seconds: GEOJSON_SECONDS.observe(seconds, operation=operation),
+    check_interval=float(os.getenv('FEATURE_STORE_CHECK_INTERVAL', 1))
+)
+geojson_publisher = GeoJSONPublisher(feature_store, observer=lambda seconds: GEOJSON_SECONDS.observe(seconds, operation='build'))
+GEOJSON_MAX_AGE = int(os.getenv('GEOJSON_MAX_AGE', 0))
+FEATURES_BBOX_LIMIT = 5000
+tile_cache = TileCache(feature_store, max_features=FEATURES_BBOX_LIMIT)
+cluster_index = ClusterIndex(feature_store, database.feature_status_counts)
+NEARBY_MAX_RADIUS_M = 5000
+# Radio (m) para reutilizar un feature existente al recibir un envío cercano; 0 = desactivado
+FEATURE_SNAP_RADIUS_M = float(os.getenv('FEATURE_SNAP_RADIUS_M', 0))
+
+# Validación de PDFs: un solo parseo, con tope de páginas y de tiempo por documento
+pdf_validator = PDFValidator(
+    max_pages=int(os.getenv('PDF_MAX_PAGES', 50)),
+    time_budget=float(os.getenv('PDF_VALIDATION_TIMEOUT', 5))
+)
+# El parseo corre en procesos aislados con límites de memoria/CPU (0 procesos = en el worker)
+PDF_SANDBOX_WORKERS = int(os.getenv('PDF_SANDBOX_WORKERS', 2))
+pdf_sandbox = PDFSandbox(
+    pdf_validator,
+    max_workers=PDF_SANDBOX_WORKERS,
+    max_pending=int(os.getenv('PDF_SANDBOX_MAX_PENDING', 8)),
+    timeout=float(os.getenv('PDF_SANDBOX_TIMEOUT', 15)),
+    max_tasks_per_child=int(os.getenv('PDF_SANDBOX_MAX_TASKS', 50)),
+    max_memory_mb=int(os.getenv('PDF_SANDBOX_MAX_MEMORY_MB', 512)),
+    max_cpu_seconds=int(os.getenv('PDF_SANDBOX_MAX_CPU', 10))
+) if PDF_SANDBOX_WORKERS > 0 else None
 
-def get_db_connection():
-    """Get database connection, initializing if necessary"""
-    init_database()  # Asegurar que la DB existe
-    return sqlite3.connect(DB_FILE)
+@metrics.collector
+def collect_cache_metrics():
+    """Aciertos y fallos acumulados por las cachés de este worker"""
+    for cache, hits, misses in (
+        ('verdicts', verdict_cache.hits, verdict_cache.misses),
+        ('tiles', tile_cache.hits, tile_cache.misses),
+        ('geojson_build', geojson_publisher.hits, geojson_publisher.rebuilds),
+        ('comments_count', database.count_cache_hits, database.count_cache_misses),
+    ):
+        CACHE_REQUESTS.set_total(hits, cache=cache, result='hit')
+        CACHE_REQUESTS.set_total(misses, cache=cache, result='miss')
 
-def validate_pdf_with_text(file):
+def init_database():
+    """Initialize database - create directories, tables and migrations once per process"""
+    return database.init_schema()
+
+def validate_pdf_with_text(upload):
     """
     Validación ESTRICTA de PDF - Solo acepta PDFs reales con texto extraíble.
     Rechaza PDFs de imagen escaneada y archivos falsos.
+    Devuelve (válido, mensaje, cacheable); no es cacheable si falló por carga del servidor.
     """
     try:
-        file.seek(0)
-        file_content = file.read()
-        file.seek(0)
-        
-        # 1. Verificar cabecera PDF válida
-        if not file_content.startswith(b'%PDF-'):
-            return False, "🚫 NO ES UN PDF VÁLIDO: Falta cabecera %PDF-"
+        with UPLOAD_STAGE_SECONDS.time(stage='pdf_validation'):
+            if pdf_sandbox is None:
+                with upload.view() as view:
+                    is_valid, message, stats = pdf_validator.validate(view)
+            else:
+                # El archivo ya está en disco: el proceso aislado recibe la ruta, no los bytes
+                is_valid, message, stats = pdf_sandbox.validate(upload.path)
+        if 'parse_elapsed' in stats:
+            UPLOAD_STAGE_SECONDS.observe(stats['parse_elapsed'], stage='pdf_parse')
+            UPLOAD_STAGE_SECONDS.observe(stats['text_elapsed'], stage='pdf_text')
+        logging.info(
+            f"{'✅' if is_valid else '🚫'} Validación PDF: {stats['pages_scanned']}/{stats['pages']} páginas, "
+            f"{stats['chars']} caracteres, {stats['words']} palabras en {stats['elapsed']}s"
+        )
+        # Un proceso muerto también puede deberse al entorno (p. ej. no se pudo lanzar): no se recuerda
+        return is_valid, message, not stats.get('killed')
+    except (SandboxBusyError, SandboxTimeoutError) as e:
+        logging.warning(f"Validación de PDF no completada: {e}")
+        return False, "Servidor ocupado validando documentos, intente nuevamente en unos minutos", False
+    except Exception as e:
+        # Un error inesperado puede ser del validador y no del archivo: no se recuerda
+        logging.exception("Error validando PDF")
+        return False, f"🚫 ERROR VALIDANDO PDF: {str(e)}", False
+
+def scan_file_content(upload, filename, ext, progress=None):
+    """Validaciones de contenido y escaneo avanzado de validate_file_security().
+
+    Devuelve (aprobado, resultado, cacheable); cacheable es False cuando el
+    rechazo se debe a un error transitorio y no al contenido del archivo. Si el
+    veredicto de VirusTotal está pendiente devuelve (None, Deferred, False).
+    """
+    # VALIDACIÓN ESTRICTA ESPECÍFICA POR TIPO DE ARCHIVO
+    if ext == 'pdf':
+        # Usar validación PDF estricta que requiere texto extraíble
+        is_valid, message, cacheable = validate_pdf_with_text(upload)
+        if not is_valid:
+            logging.warning(f"🚫 PDF RECHAZADO: {message}")
+            return False, message, cacheable
+    
+    # 2. Primeros bytes (capturados al recibir el archivo) para detectar archivos malformados/corruptos
+    try:
+        first_bytes = upload.head
         
-        # 2. Verificar estructura básica PDF
-        if b'%%EOF' not in file_content:
-            return False, "🚫 PDF CORRUPTO: Falta marcador de fin de archivo"
+        logging.debug("Primeros bytes de %s: %s", filename, first_bytes[:10].hex(' '))
         
-        # 3. Usar PyPDF2 para validar estructura
-        try:
-            pdf_stream = io.BytesIO(file_content)
-            pdf_reader = PyPDF2.PdfReader(pdf_stream)
+        # Detectar archivos con datos binarios sospechosos en extensiones de texto
+        if ext in ['txt', 'csv'] and len(first_bytes) > 0:
+            # Verificar si hay demasiados bytes no-ASCII (posible archivo binario con extensión falsa)
+            non_ascii_count = sum(1 for byte in first_bytes if byte > 127 or (byte < 32 and byte not in [9, 10, 13]))
+            ascii_percentage = (len(first_bytes) - non_ascii_count) / len(first_bytes) if len(first_bytes) > 0 else 0
+            
+            logging.debug("%s - Bytes no-ASCII: %d/%d (%.2f%% ASCII)", filename, non_ascii_count, len(first_bytes), ascii_percentage * 100)
             
-            if len(pdf_reader.pages) == 0:
-                return False, "🚫 PDF VACÍO: No contiene páginas"
+            if non_ascii_count > len(first_bytes) * 0.3:  # Más del 30% son caracteres raros
+                logging.warning(f"ARCHIVO SOSPECHOSO: {filename} - Demasiados caracteres binarios en archivo de texto")
+                return False, f"🚫 ARCHIVO CORRUPTO: El archivo parece contener datos binarios malformados", True
+        
+        # Detectar archivos con firmas de ejecutables (magic numbers, detectadas al recibir el archivo)
+        dangerous_kinds = {
+            'exe': 'Ejecutable Windows',    # Ejecutables Windows (.exe)
+            'elf': 'Ejecutable Linux',      # Ejecutables Linux (ELF)
+            'zip': 'Archivo ZIP',           # ZIP (puede contener ejecutables)
+            'ole': 'MS Office',             # Microsoft Office (puede contener macros)
+        }
+        
+        logging.debug("🔍 Verificando firmas ejecutables para %s: %s", filename, upload.kind or 'desconocida')
+        
+        if upload.kind in dangerous_kinds:
+            desc = dangerous_kinds[upload.kind]
+            logging.warning(f"🚫 FIRMA EJECUTABLE DETECTADA en {filename}: {desc}")
+            return False, f"🚫 ARCHIVO EJECUTABLE DETECTADO: {desc} encontrado", True
+        
+        logging.debug("✅ No se detectaron firmas ejecutables en %s", filename)
                 
-        except Exception as e:
-            return False, f"🚫 PDF INVÁLIDO: Error de estructura - {str(e)}"
+    except Exception as e:
+        logging.warning(f"Error leyendo archivo {filename}: {e}")
+        return False, f"🚫 ARCHIVO CORRUPTO: No se puede leer correctamente", True
+    
+    # DESPUÉS DE VALIDACIONES BÁSICAS, PROCEDER CON ESCANEO AVANZADO
+    # Si SecurityManager está disponible, usar escaneo avanzado
+    if SECURITY_AVAILABLE and security_manager:
+        logging.info(f"ACTIVANDO ESCANEO AVANZADO - Archivo: {filename}")
         
-        # 4. VALIDACIÓN CRÍTICA: Verificar que contiene texto extraíble
         try:
-            # Reiniciar stream para pdfplumber
-            pdf_stream = io.BytesIO(file_content)
+            # Escaneo avanzado con SecurityManager sobre el archivo ya recibido en disco
+            scan_results = security_manager.scan_file(upload.path, progress=progress, sha256=upload.sha256)
+            for name, seconds in scan_results['timings'].items():
+                UPLOAD_STAGE_SECONDS.observe(seconds, stage='scanners' if name == 'total' else f'scanner_{name}')
             
-            with pdfplumber.open(pdf_stream) as pdf:
-                total_text = ""
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        total_text += page_text.strip()
-                
-                # Verificar que hay texto significativo (al menos 10 caracteres)
-                if len(total_text.strip()) < 10:
-                    return False, "🚫 PDF SIN TEXTO: Solo acepta documentos con texto, no imágenes escaneadas"
-                
-                # Verificar que no es solo espacios o caracteres especiales
-                text_words = total_text.split()
-                if len(text_words) < 3:
-                    return False, "🚫 PDF INSUFICIENTE: Debe contener al menos 3 palabras de texto"
-                
-                logging.info(f"✅ PDF VÁLIDO: {len(total_text)} caracteres, {len(text_words)} palabras extraídas")
-                print(f"✅ PDF VÁLIDO: {len(total_text)} caracteres, {len(text_words)} palabras extraídas")
-                return True, f"✅ PDF válido con {len(text_words)} palabras de texto"
-                
-        except Exception as e:
-            return False, f"🚫 ERROR EXTRAYENDO TEXTO: {str(e)} - Verifique que es un PDF válido"
+            if scan_results['final_decision'] == 'deferred':
+                # Un escáner (VirusTotal) sigue analizando: la decisión se completa cuando llegue su veredicto
+                logging.info(f"⏳ Veredicto de {scan_results['pending_stage']} pendiente para {filename}")
+                future = scan_results.pop('pending_future')
+                return None, scan_jobs.Deferred(
+                    future,
+                    lambda stage_result: advanced_scan_verdict(
+                        security_manager.complete_scan(scan_results, stage_result, filename), upload, filename, ext
+                    ),
+                    stage=scan_results['pending_stage']
+                ), False
             
-    except Exception as e:
-        return False, f"🚫 ERROR VALIDANDO PDF: {str(e)}"
+            return advanced_scan_verdict(scan_results, upload, filename, ext)
+        
+        except Exception as e:
+            # En caso de error, fallar de forma segura
+            logging.error(f"Error en escaneo avanzado: {e}")
+            return False, "Error en validación de seguridad avanzada", False
+    
+    else:
+        # Usar validación básica original si SecurityManager no está disponible
+        logging.info("Usando validación básica (SecurityManager no disponible)")
+        
+        # Validación básica de firmas de archivos
+        file_header = upload.head
+        
+        signature_valid = False
+        detected_type = ext
+        
+        for signature, file_type in FILE_SIGNATURES.items():
+            if file_header.startswith(signature):
+                detected_type = file_type
+                signature_valid = True
+                break
+        
+        if not signature_valid and ext == 'txt':
+            try:
+                file_header.decode('utf-8')
+                signature_valid = True
+                detected_type = 'txt'
+            except UnicodeDecodeError:
+                logging.warning("Archivo de texto con encoding inválido")
+                return False, "Archivo de texto con codificación inválida", True
+        
+        if not signature_valid:
+            logging.warning(f"Archivo sin firma reconocida pero extensión permitida: {ext}")
+            signature_valid = True
+        
+        # Validaciones de imagen con PIL si está disponible
+        if PIL_AVAILABLE and ext in ['png', 'jpg', 'jpeg', 'gif']:
+            try:
+                with Image.open(upload.path) as img:
+                    img.verify()
+            except Exception as e:
+                logging.warning(f"Imagen corrupta rechazada: {str(e)}")
+                return False, "Imagen corrupta o inválida", True
+        
+        logging.info(f"Archivo validado con método básico: {filename}, Hash: {upload.sha256[:16]}...")
+        
+        return True, {
+            "filename": filename, 
+            "type": detected_type, 
+            "hash": upload.sha256, 
+            "size": upload.size,
+            "security_level": "basic"
+        }, True
+
+def advanced_scan_verdict(scan_results, upload, filename, ext):
+    """(aprobado, resultado, cacheable) a partir de la decisión del SecurityManager"""
+    if scan_results['final_decision'] == 'approved':
+        logging.info(f"Archivo aprobado por SecurityManager: {filename}",
+                     extra={'sha256': upload.sha256, 'decision': 'approved'})
+        # Aprobado sin uno de los motores configurados (CLAMD_FAIL_OPEN): no se recuerda
+        degraded = any(isinstance(result, dict) and result.get('degraded') for result in scan_results.values())
+        # La copia definitiva la guarda quien pidió el escaneo (ver run_scan_job)
+        return True, {
+            "filename": filename, 
+            "type": ext, 
+            "hash": upload.sha256,
+            "scan_results": scan_results,
+            "security_level": "advanced"
+        }, not degraded
+    
+    logging.warning(f"Archivo rechazado por SecurityManager: {filename}",
+                    extra={'sha256': upload.sha256, 'decision': 'rejected', 'rejected_by': scan_results.get('rejected_by')})
+    # Solo se recuerda el rechazo si un motor detectó algo (no por errores de la API)
+    return False, f"Archivo rechazado por motivos de seguridad: {scan_results['final_decision']}", scan_results['definitive']
+
+def remember_verdict(file_hash, approved, result, cacheable):
+    UPLOAD_VERDICTS.inc(verdict='approved' if approved else 'rejected', source='scan')
+    if cacheable:
+        verdict_cache.put(file_hash, approved, result)
+    return approved, result
 
-def validate_file_security(file):
-    """Validar archivo por seguridad - versión mejorada con SecurityManager"""
+def validate_file_security(upload, progress=None):
+    """Validar archivo por seguridad - versión mejorada con SecurityManager.
+
+    upload es un IngestedUpload (archivo en disco con tamaño, SHA-256 y
+    cabecera ya calculados al recibirlo). progress(etapa, porcentaje) es
+    opcional; lo usan los jobs de /scan-file.
+    
+    Devuelve (None, scan_jobs.Deferred) si falta el veredicto de VirusTotal:
+    el Deferred produce (aprobado, resultado) cuando llega.
+    """
+    started = time.perf_counter()
     try:
-        logging.info("🔍 INICIANDO validate_file_security()")
-        print("🔍 INICIANDO validate_file_security()")
+        if progress:
+            progress('validacion', 10)
+        logging.debug("🔍 INICIANDO validate_file_security()")
         
         # Validaciones básicas primero
-        file.seek(0, 2)  # Ir al final del archivo
-        file_size = file.tell()
-        file.seek(0)  # Volver al inicio
+        file_size = upload.size
         
-        logging.info(f"🔍 Archivo: {file.filename}, Tamaño: {file_size} bytes")
-        print(f"🔍 Archivo: {file.filename}, Tamaño: {file_size} bytes")
+        logging.debug("🔍 Archivo: %s, Tamaño: %d bytes", upload.filename, file_size)
         
         if file_size > MAX_FILE_SIZE:
             logging.warning(f"Archivo rechazado por tamaño excesivo: {file_size} bytes")
@@ -231,13 +402,12 @@ def validate_file_security(file):
             return False, "Archivo vacío"
         
         # Sanitizar nombre de archivo
-        filename = secure_filename(file.filename)
+        filename = secure_filename(upload.filename)
         if not filename:
             logging.warning("Archivo rechazado por nombre inválido")
             return False, "Nombre de archivo inválido"
         
-        logging.info(f"🔍 Nombre sanitizado: {filename}")
-        print(f"🔍 Nombre sanitizado: {filename}")
+        logging.debug("🔍 Nombre sanitizado: %s", filename)
         
         # Validar extensión
         ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
@@ -254,176 +424,50 @@ def validate_file_security(file):
         
         if ext in dangerous_extensions:
             logging.warning(f"🚫 ARCHIVO EJECUTABLE RECHAZADO: {ext}")
-            print(f"🚫 ARCHIVO EJECUTABLE RECHAZADO: {ext}")
             return False, f"🚫 ARCHIVO EJECUTABLE BLOQUEADO: .{ext} no está permitido por seguridad"
         
-        # VALIDACIÓN ESTRICTA ESPECÍFICA POR TIPO DE ARCHIVO
-        if ext == 'pdf':
-            # Usar validación PDF estricta que requiere texto extraíble
-            is_valid, message = validate_pdf_with_text(file)
-            if not is_valid:
-                logging.warning(f"🚫 PDF RECHAZADO: {message}")
-                print(f"🚫 PDF RECHAZADO: {message}")
-                return False, message
-        
-        # 2. Leer primeros bytes para detectar archivos malformados/corruptos
-        file.seek(0)
-        try:
-            first_bytes = file.read(512)  # Leer primeros 512 bytes
-            file.seek(0)  # Volver al inicio
-            
-            logging.info(f"DEBUG: Primeros 10 bytes de {filename}: {[hex(b) for b in first_bytes[:10]]}")
-            
-            # Detectar archivos con datos binarios sospechosos en extensiones de texto
-            if ext in ['txt', 'csv'] and len(first_bytes) > 0:
-                # Verificar si hay demasiados bytes no-ASCII (posible archivo binario con extensión falsa)
-                non_ascii_count = sum(1 for byte in first_bytes if byte > 127 or (byte < 32 and byte not in [9, 10, 13]))
-                ascii_percentage = (len(first_bytes) - non_ascii_count) / len(first_bytes) if len(first_bytes) > 0 else 0
-                
-                logging.info(f"DEBUG: {filename} - Bytes no-ASCII: {non_ascii_count}/{len(first_bytes)} ({ascii_percentage:.2%} ASCII)")
-                
-                if non_ascii_count > len(first_bytes) * 0.3:  # Más del 30% son caracteres raros
-                    logging.warning(f"ARCHIVO SOSPECHOSO: {filename} - Demasiados caracteres binarios en archivo de texto")
-                    return False, f"🚫 ARCHIVO CORRUPTO: El archivo parece contener datos binarios malformados"
-            
-            # Detectar archivos con firmas de ejecutables (magic numbers)
-            dangerous_signatures = [
-                (b'MZ', 'Ejecutable Windows'),      # Ejecutables Windows (.exe)
-                (b'\x7fELF', 'Ejecutable Linux'),   # Ejecutables Linux (ELF)
-                (b'PK\x03\x04', 'Archivo ZIP'),    # ZIP (puede contener ejecutables)
-                (b'\xd0\xcf\x11\xe0', 'MS Office'), # Microsoft Office (puede contener macros)
-            ]
-            
-            logging.info(f"🔍 Verificando firmas ejecutables para {filename}...")
-            print(f"🔍 Verificando firmas ejecutables para {filename}...")
-            
-            for signature, desc in dangerous_signatures:
-                logging.info(f"🔍 Comparando con {desc}: {signature} vs {first_bytes[:len(signature)]}")
-                print(f"🔍 Comparando con {desc}: {signature} vs {first_bytes[:len(signature)]}")
-                
-                if first_bytes.startswith(signature):
-                    logging.warning(f"🚫 FIRMA EJECUTABLE DETECTADA en {filename}: {desc}")
-                    print(f"🚫 FIRMA EJECUTABLE DETECTADA en {filename}: {desc}")
-                    return False, f"🚫 ARCHIVO EJECUTABLE DETECTADO: {desc} encontrado"
-            
-            logging.info(f"✅ No se detectaron firmas ejecutables en {filename}")
-            print(f"✅ No se detectaron firmas ejecutables en {filename}")
-                    
-        except Exception as e:
-            logging.warning(f"Error leyendo archivo {filename}: {e}")
-            return False, f"🚫 ARCHIVO CORRUPTO: No se puede leer correctamente"
-        
-        # DESPUÉS DE VALIDACIONES BÁSICAS, PROCEDER CON ESCANEO AVANZADO
-        # Si SecurityManager está disponible, usar escaneo avanzado
-        if SECURITY_AVAILABLE and security_manager:
-            print(f"[GEOPORTAL] Activando escaneo avanzado para: {filename}")
-            logging.info(f"ACTIVANDO ESCANEO AVANZADO - Archivo: {filename}")
-            
-            # Guardar archivo temporalmente para escaneo
-            temp_filename = f"temp_{int(time.time())}_{filename}"
-            temp_path = os.path.join(UPLOAD_FOLDER, 'temp', temp_filename)
-            os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-            
-            print(f"[GEOPORTAL] Guardando {filename} temporalmente para escaneo...")
-            file.seek(0)
-            file.save(temp_path)
-            
-            try:
-                # Escaneo avanzado con SecurityManager
-                scan_results = security_manager.scan_file(temp_path)
-                
-                if scan_results['final_decision'] == 'approved':
-                    logging.info(f"Archivo aprobado por SecurityManager: {filename}")
-                    # Mover archivo de temp a uploads principales
-                    final_path = os.path.join(UPLOAD_FOLDER, filename)
-                    if os.path.exists(final_path):
-                        os.remove(final_path)
-                    os.rename(temp_path, final_path)
-                    
-                    return True, {
-                        "filename": filename, 
-                        "type": ext, 
-                        "scan_results": scan_results,
-                        "security_level": "advanced"
-                    }
-                else:
-                    logging.warning(f"Archivo rechazado por SecurityManager: {filename}")
-                    # Limpiar archivo temporal
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                    
-                    return False, f"Archivo rechazado por motivos de seguridad: {scan_results['final_decision']}"
-            
-            except Exception as e:
-                # En caso de error, limpiar y fallar de forma segura
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                logging.error(f"Error en escaneo avanzado: {e}")
-                return False, "Error en validación de seguridad avanzada"
+        UPLOAD_STAGE_SECONDS.observe(time.perf_counter() - started, stage='basic_checks')
         
-        else:
-            # Usar validación básica original si SecurityManager no está disponible
-            logging.info("Usando validación básica (SecurityManager no disponible)")
-            
-            # Validación básica de firmas de archivos
-            file_header = file.read(512)
-            file.seek(0)
-            
-            signature_valid = False
-            detected_type = ext
-            
-            for signature, file_type in FILE_SIGNATURES.items():
-                if file_header.startswith(signature):
-                    detected_type = file_type
-                    signature_valid = True
-                    break
-            
-            if not signature_valid and ext == 'txt':
-                try:
-                    file_header.decode('utf-8')
-                    signature_valid = True
-                    detected_type = 'txt'
-                except UnicodeDecodeError:
-                    logging.warning("Archivo de texto con encoding inválido")
-                    return False, "Archivo de texto con codificación inválida"
-            
-            if not signature_valid:
-                logging.warning(f"Archivo sin firma reconocida pero extensión permitida: {ext}")
-                signature_valid = True
-            
-            # Validaciones de imagen con PIL si está disponible
-            if PIL_AVAILABLE and ext in ['png', 'jpg', 'jpeg', 'gif']:
-                try:
-                    file.seek(0)
-                    with Image.open(file) as img:
-                        img.verify()
-                    file.seek(0)
-                except Exception as e:
-                    logging.warning(f"Imagen corrupta rechazada: {str(e)}")
-                    return False, "Imagen corrupta o inválida"
-            
-            # Calcular hash para logging
-            file.seek(0)
-            file_hash = hashlib.sha256(file.read()).hexdigest()
-            file.seek(0)
-            
-            logging.info(f"Archivo validado con método básico: {filename}, Hash: {file_hash[:16]}...")
-            
-            return True, {
-                "filename": filename, 
-                "type": detected_type, 
-                "hash": file_hash, 
-                "size": file_size,
-                "security_level": "basic"
-            }
+        # Veredicto ya conocido para este contenido: sin volver a escanear
+        file_hash = upload.sha256
+        with UPLOAD_STAGE_SECONDS.time(stage='verdict_cache'):
+            cached = verdict_cache.get(file_hash)
+        if cached is not None:
+            approved, result = cached
+            UPLOAD_VERDICTS.inc(verdict='approved' if approved else 'rejected', source='cache')
+            logging.info(f"✅ Veredicto en caché para {filename} ({file_hash[:16]}...): {'aprobado' if approved else 'rechazado'}")
+            if not approved:
+                return False, result
+            return True, dict(result, filename=filename, hash=file_hash, cached=True)
+        
+        approved, result, cacheable = scan_file_content(upload, filename, ext, progress)
+        if approved is None:
+            UPLOAD_VERDICTS.inc(verdict='deferred', source='scan')
+            return None, result.then(lambda approved, result, cacheable: remember_verdict(
+                file_hash, approved, result, cacheable
+            ))
+        return remember_verdict(file_hash, approved, result, cacheable)
     
     except Exception as e:
         logging.error(f"Error en validación de archivo: {str(e)}")
         return False, "Error interno en la validación del archivo"
+    finally:
+        UPLOAD_STAGE_SECONDS.observe(time.perf_counter() - started, stage='total')
 
 # Crear aplicación Flask con configuración
 app = Flask(__name__, static_folder="static", static_url_path="/static")
 
+# Los archivos subidos se escriben directo en uploads/temp mientras se calcula
+# su SHA-256, tamaño y firma (una sola pasada sobre el cuerpo de la petición)
+INGEST_FOLDER = os.path.join(UPLOAD_FOLDER, 'temp')
+os.makedirs(INGEST_FOLDER, exist_ok=True)
+StreamingRequest.ingest_folder = INGEST_FOLDER
+app.request_class = StreamingRequest
+
+# Archivos rechazados y a la espera del veredicto de VirusTotal (no se sirven por /uploads)
+QUARANTINE_FOLDER = os.path.join(UPLOAD_FOLDER, 'quarantine')
+os.makedirs(QUARANTINE_FOLDER, exist_ok=True)
+
 # Configurar Flask para producción
 app.config.update({
     'SECRET_KEY': config['SECRET_KEY'],
@@ -442,6 +486,58 @@ os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
 # Inicializar Flask-Session
 Session(app)
 
+# Perfilado por muestreo (opcional): rutas seleccionadas con PROFILING_ENABLED, o
+# cualquier petición con la cabecera X-Profile de un administrador
+request_profiler = RequestProfiler(
+    os.getenv('PROFILES_DIR', os.path.join('logs', 'profiles')),
+    enabled=os.getenv('PROFILING_ENABLED', 'false').lower() == 'true',
+    routes=[route.strip() for route in os.getenv(
+        'PROFILING_ROUTES', '/upload,/scan-file,/comment,/api/comments,/data.geojson'
+    ).split(',') if route.strip()],
+    min_duration=float(os.getenv('PROFILING_MIN_MS', 200)) / 1000,
+    max_per_minute=int(os.getenv('PROFILING_MAX_PER_MINUTE', 30)),
+    interval=float(os.getenv('PROFILING_INTERVAL_MS', 5)) / 1000,
+    max_profiles=int(os.getenv('PROFILING_MAX_FILES', 200))
+)
+
+def profiling_requested():
+    """X-Profile de un administrador con sesión, o con el valor de PROFILING_TOKEN"""
+    value = request.headers.get('X-Profile')
+    if not value:
+        return False
+    token = os.getenv('PROFILING_TOKEN')
+    return 'user_id' in session or (bool(token) and hmac.compare_digest(value, token))
+
+# Conteo y duración de peticiones por ruta (la regla, no la URL: cardinalidad acotada)
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if request.url_rule is not None:
+        g.profile = request_profiler.start(
+            'request', request.url_rule.rule,
+            {'method': request.method, 'path': request.path},
+            forced=profiling_requested()
+        )
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method)
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    g.response_status = response.status_code
+    profile = g.get('profile')
+    if profile is not None and profile.forced:
+        response.headers['X-Profile-Id'] = profile.id
+    return response
+
+@app.teardown_request
+def finish_request_profile(error=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.finish(profile, status=g.get('response_status', 500))
+
 # Crear directorios necesarios al inicializar la app
 def create_directories():
     """Crear directorios necesarios para la aplicación"""
@@ -461,6 +557,131 @@ def create_directories():
 # Crear directorios al importar el módulo
 create_directories()
 
+# Esquema y migraciones una sola vez al arrancar, no en cada petición
+init_database()
+
+# Token firmado que entrega /scan-file al aprobar un archivo; /upload lo canjea
+# en lugar de recibir el archivo otra vez
+SCAN_TOKEN_MAX_AGE = int(os.getenv('SCAN_TOKEN_MAX_AGE', 3600))
+scan_token_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='scan-token')
+
+def run_scan_job(job, progress):
+    """Ejecutar validate_file_security() sobre el archivo en staging de un job.
+
+    Si el veredicto de VirusTotal está pendiente, el archivo espera en
+    cuarentena y el job termina cuando llega (ver finish_scan_job). Los jobs de
+    /comment llevan comment_id y terminan adjuntando el archivo al comentario.
+    """
+    if 'queued_at' in job:
+        UPLOAD_STAGE_SECONDS.observe(time.time() - job['queued_at'], stage='queue_wait')
+
+    def finish(approved, result):
+        if job.get('comment_id'):
+            return attach_comment_file(job['comment_id'], job['upload'], job['path'], approved, result)
+        return finish_scan_job(job, approved, result)
+
+    try:
+        approved, result = validate_file_security(job['upload'], progress=progress)
+        if approved is None:
+            quarantine_path = os.path.join(QUARANTINE_FOLDER, os.path.basename(job['path']))
+            os.replace(job['path'], quarantine_path)
+            job['path'] = quarantine_path
+            return resume_deferred(result, finish)
+    except Exception:
+        if os.path.exists(job['path']):
+            os.remove(job['path'])
+        raise
+    return finish(approved, result)
+
+def finish_scan_job(job, approved, result):
+    """Si se aprueba, el archivo en staging (o cuarentena) pasa al blob store y el
+    resultado incluye el token para adjuntarlo en /upload; si se rechaza, queda en
+    cuarentena con el motivo."""
+    upload = job['upload']
+    try:
+        if approved:
+            ext = result['filename'].rsplit('.', 1)[1].lower()
+            blob_store.put(job['path'], upload.sha256, upload.size, ALLOWED_EXTENSIONS.get(ext))
+            # El nombre viaja en el token y se guarda en la solicitud, no en el blob.
+            # Dict nuevo: result puede venir de la caché de veredictos y el token es de este job
+            result = dict(result, scan_token=scan_token_serializer.dumps({
+                'job': job['id'],
+                'sha256': upload.sha256,
+                'filename': result['filename']
+            }))
+        else:
+            blob_store.quarantine(job['path'], upload.sha256, job['filename'], upload.size, result, 'scan-file')
+        return approved, result
+    finally:
+        if os.path.exists(job['path']):
+            os.remove(job['path'])
+
+def resume_deferred(deferred, finish):
+    """Deferred que termina con finish(aprobado, resultado) aunque falle la decisión
+    diferida (así siempre se libera el archivo en cuarentena)"""
+    def resume(value):
+        try:
+            approved, result = deferred.resume(value)
+        except Exception as e:
+            logging.error(f"Error completando validación diferida: {e}")
+            approved, result = False, "Error interno en la validación del archivo"
+        return finish(approved, result)
+    return scan_jobs.Deferred(deferred.future, resume, deferred.stage)
+
+def redeem_scan_token(token):
+    """Validar un token de escaneo; devuelve sus datos (con el blob) o un mensaje de error.
+    El token se consume después, junto al INSERT (ver insert_comment)"""
+    try:
+        data = scan_token_serializer.loads(token, max_age=SCAN_TOKEN_MAX_AGE)
+    except SignatureExpired:
+        return None, "El escaneo del archivo expiró, vuelva a adjuntarlo"
+    except BadSignature:
+        return None, "Token de escaneo inválido"
+    
+    blob = blob_store.get(data['sha256'])
+    if blob is None:
+        return None, "El archivo escaneado ya no está disponible"
+    data['blob'] = blob
+    return data, None
+
+def insert_comment(params, scan_job=None):
+    """INSERT de una solicitud; con scan_job su token se consume en la misma transacción.
+
+    Devuelve False (sin guardar nada) si el token ya se usó: un token solo adjunta
+    su archivo a una solicitud, y si el INSERT falla el token sigue disponible.
+    """
+    with database.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if scan_job is not None and not scan_queue.consume(scan_job, conn=conn):
+            return False
+        conn.execute(db.SQL_INSERT_COMMENT, params)
+    database.invalidate_counts()
+    return True
+
+# Archivos aprobados: una sola copia por contenido con conteo de referencias. Un
+# blob recién aprobado sin solicitud se conserva mientras su token siga vigente.
+blob_store = BlobStore(
+    database,
+    UPLOAD_FOLDER,
+    orphan_grace=SCAN_TOKEN_MAX_AGE + 3600,
+    quarantine_days=int(os.getenv('QUARANTINE_DAYS', 7))
+)
+blob_store.start_collector(interval=int(os.getenv('BLOB_GC_INTERVAL', 3600)))
+
+def profiled_scan_job(job, progress):
+    """run_scan_job bajo el perfilador (forzado si la petición de /scan-file lo estaba)"""
+    with request_profiler.task('scan-job', forced=job.get('profile', False), job_id=job['id'], filename=job['filename']):
+        return run_scan_job(job, progress)
+
+# Escaneos fuera del hilo de la petición: /scan-file encola y /scan-status consulta
+scan_queue = scan_jobs.ScanJobQueue(
+    database,
+    profiled_scan_job,
+    max_workers=int(os.getenv('SCAN_WORKERS', 2)),
+    max_pending=int(os.getenv('SCAN_MAX_PENDING', 20))
+)
+feature_store.start_compactor(database, interval=int(os.getenv('FEATURE_LOG_COMPACT_INTERVAL', 60)))
+
 def login_required(f):
     """Decorator to require login for protected routes"""
     from functools import wraps
@@ -529,24 +750,163 @@ def test():
     response.headers['Content-Type'] = 'text/html; charset=utf-8'
     return response
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """Métricas en formato Prometheus; con METRICS_TOKEN exige 'Authorization: Bearer <token>'"""
+    token = os.getenv('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        abort(401)
+    return app.response_class(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route("/admin")
 @login_required
 def admin_panel():
     return render_template("adminPanel.html")
 
+@app.route("/admin/profiles")
+@login_required
+def admin_profiles():
+    """Perfiles más lentos guardados; ?id= muestra las funciones con más muestras de uno"""
+    name = request.args.get('name') or None
+    profiles = request_profiler.slowest(limit=100, name=name)
+    for profile in profiles:
+        profile['date'] = datetime.fromtimestamp(profile.get('started_at', 0)).strftime('%Y-%m-%d %H:%M:%S')
+    selected = None
+    profile_id = request.args.get('id')
+    if profile_id:
+        try:
+            meta = request_profiler.ring.meta(profile_id)
+            folded = request_profiler.ring.folded(profile_id)
+        except ValueError:
+            abort(404)
+        if meta is None or folded is None:
+            abort(404)
+        samples, functions = top_functions(folded)
+        selected = {'meta': meta, 'samples': samples, 'functions': functions}
+    names = sorted({p.get('name') for p in request_profiler.ring.list() if p.get('name')})
+    return render_template(
+        "profiles.html", profiles=profiles, selected=selected, names=names, current_name=name,
+        enabled=request_profiler.enabled, routes=sorted(request_profiler.routes)
+    )
+
+@app.route("/admin/profiles/<profile_id>.folded")
+@login_required
+def admin_profile_folded(profile_id):
+    """Pilas colapsadas para flamegraph.pl o speedscope"""
+    try:
+        folded = request_profiler.ring.folded(profile_id)
+    except ValueError:
+        abort(404)
+    if folded is None:
+        abort(404)
+    response = app.response_class(folded, content_type='text/plain; charset=utf-8')
+    response.headers['Content-Disposition'] = f'attachment; filename="{profile_id}.folded"'
+    return response
+
 @app.route("/data.geojson")
 def geojson():
-    if os.path.exists(GEOJSON_FILE):
-        return send_from_directory(".", GEOJSON_FILE)
-    abort(404)
+    # Build precomprimido de snapshot + log; 304 si el cliente ya tiene esta versión
+    build = geojson_publisher.current()
+    encoding = build.select(request.accept_encodings)
+    etag = build.etags[encoding]
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(build.bodies[encoding], mimetype='application/geo+json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = GEOJSON_MAX_AGE
+    response.cache_control.must_revalidate = True
+    return response
+
+def parse_bbox(value):
+    """'minLng,minLat,maxLng,maxLat' -> tupla de floats; ValueError si es inválido"""
+    min_lng, min_lat, max_lng, max_lat = (float(v) for v in value.split(','))
+    # float() acepta 'nan' e 'inf', que el índice espacial no puede ubicar en una celda
+    if not all(math.isfinite(v) for v in (min_lng, min_lat, max_lng, max_lat)):
+        raise ValueError("bbox con valores no finitos")
+    if min_lng > max_lng or min_lat > max_lat:
+        raise ValueError("bbox invertido")
+    # Un mapa desplazado más allá del antimeridiano pide longitudes fuera de rango
+    return max(min_lng, -180.0), max(min_lat, -90.0), min(max_lng, 180.0), min(max_lat, 90.0)
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.geojson")
+def feature_tile(z, x, y):
+    """Features del tile XYZ como GeoJSON; solo se descarga lo visible.
+
+    Como /features, un tile con más de FEATURES_BBOX_LIMIT features se recorta y
+    lleva "truncated": true (zooms bajos: usar /clusters).
+    """
+    if z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        abort(404)
+
+    tile = tile_cache.get(z, x, y)
+    if request.if_none_match.contains(tile.etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(tile.body, mimetype='application/geo+json')
+    response.set_etag(tile.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = GEOJSON_MAX_AGE
+    response.cache_control.must_revalidate = True
+    return response
+
+@app.route("/features", methods=["GET"])
+def features_in_bbox():
+    """Features dentro de ?bbox=minLng,minLat,maxLng,maxLat (máximo FEATURES_BBOX_LIMIT)"""
+    try:
+        bbox = parse_bbox(request.args.get('bbox', ''))
+        limit = min(max(int(request.args.get('limit', FEATURES_BBOX_LIMIT)), 1), FEATURES_BBOX_LIMIT)
+    except (ValueError, TypeError):
+        return jsonify({"error": "bbox requerido: minLng,minLat,maxLng,maxLat"}), 400
+
+    features = feature_store.features_in_bbox(*bbox, limit=limit + 1)
+    return jsonify({
+        "type": "FeatureCollection",
+        "features": features[:limit],
+        "truncated": len(features) > limit
+    })
+
+@app.route("/features/nearby", methods=["GET"])
+def features_nearby():
+    """Features a menos de ?radius= metros (por defecto 100) de ?lat=&lng=, ordenados por distancia"""
+    try:
+        lat = float(request.args.get('lat', ''))
+        lng = float(request.args.get('lng', ''))
+        radius = float(request.args.get('radius', 100))
+        limit = min(max(int(request.args.get('limit', 100)), 1), FEATURES_BBOX_LIMIT)
+        # float() acepta 'nan' e 'inf': el índice espacial no puede ubicarlos en una celda
+        if not all(math.isfinite(v) for v in (lat, lng, radius)) or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError("coordenadas fuera de rango")
+        radius = min(max(radius, 0.0), NEARBY_MAX_RADIUS_M)
+    except (ValueError, TypeError):
+        return jsonify({"error": "Parámetros requeridos: lat, lng (radius opcional, en metros)"}), 400
+
+    features = []
+    for distance, feature in feature_store.nearby(lat, lng, radius, limit=limit):
+        properties = dict(feature.get('properties') or {})
+        properties['distance_m'] = round(distance, 2)
+        features.append({"type": "Feature", "properties": properties, "geometry": feature['geometry']})
+    return jsonify({"type": "FeatureCollection", "features": features})
+
+@app.route("/clusters", methods=["GET"])
+def feature_clusters():
+    """Clusters con conteo y estados agregados para ?z=<zoom>&bbox=minLng,minLat,maxLng,maxLat"""
+    try:
+        z = int(request.args.get('z', ''))
+        bbox = parse_bbox(request.args.get('bbox', '-180,-85,180,85'))
+    except (ValueError, TypeError):
+        return jsonify({"error": "Parámetros requeridos: z y bbox=minLng,minLat,maxLng,maxLat"}), 400
+    return jsonify(cluster_index.clusters(z, *bbox))
 
 @app.route("/comments/<feature_id>", methods=["GET"])
 def get_comments(feature_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, feature_id, user, email, municipality, entity, text, file_path, created_at FROM solicitudes WHERE feature_id = ?", (feature_id,))
-    rows = cursor.fetchall()
-    conn.close()
+    rows = database.fetch_all(db.SQL_COMMENTS_BY_FEATURE, (feature_id,))
     # Convert to dict format
     result = []
     for row in rows:
@@ -559,6 +919,7 @@ def get_comments(feature_id):
             "entity": row[5],
             "text": row[6],
             "file_path": row[7],
+            "file_name": row[9],
             "created_at": row[8]
         })
     return jsonify(result)
@@ -584,75 +945,154 @@ def post_comment():
         return jsonify({"error":"Comentarios son requeridos"}), 400
 
     file_path = ""
-    if 'file' in request.files:
-        f = request.files['file']
-        if f.filename:
-            # Validar archivo por seguridad
-            is_valid, validation_result = validate_file_security(f)
-            
-            if not is_valid:
-                # Log intento malicioso
-                client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-                logging.warning(f"Intento de subida maliciosa desde IP {client_ip}: {validation_result}")
-                return jsonify({"error": f"Archivo rechazado: {validation_result}"}), 400
-            
-            # Archivo válido - proceder con la subida
-            file_info = validation_result
-            safe_filename = file_info['filename']
-            file_ext = safe_filename.rsplit('.', 1)[1].lower()
-            
-            # Generar nombre único pero conservando la extensión original
-            unique_name = f"{uuid.uuid4().hex}.{file_ext}"
-            save_path = os.path.join(app.config["UPLOAD_FOLDER"], unique_name)
-            
-            # Guardar archivo
-            f.seek(0)  # Asegurar que estamos al inicio del archivo
-            f.save(save_path)
-            file_path = save_path
-            
-            # Log subida exitosa
-            client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-            logging.info(f"Archivo subido exitosamente desde IP {client_ip}: {safe_filename} -> {unique_name}")
+    file_name = None
+    scan_job = None
+    upload = None
+    scan_token = request.form.get("scan_token", "").strip()
+    if scan_token:
+        # Archivo ya escaneado en /scan-file
+        token_data, token_error = redeem_scan_token(scan_token)
+        if token_error:
+            return jsonify({"error": token_error}), 400
+        file_path = token_data['blob']['path']
+        file_name = token_data.get('filename')
+        scan_job = token_data['job']
+    elif 'file' in request.files and request.files['file'].filename:
+        # El archivo queda en staging y se escanea en el pool: el comentario se guarda
+        # ya y el archivo se adjunta cuando termine la validación
+        upload = IngestedUpload.from_file_storage(request.files['file'], INGEST_FOLDER)
+        filename = secure_filename(upload.filename)
+        ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+        if ext not in ALLOWED_EXTENSIONS or not 0 < upload.size <= MAX_FILE_SIZE:
+            # Rechazos baratos antes de guardar el comentario
+            os.remove(upload.path)
+            return jsonify({"error": "Archivo rechazado: tipo o tamaño no permitido"}), 400
+        staging_path = os.path.join(INGEST_FOLDER, f"comment_{uuid.uuid4().hex}")
+        os.replace(upload.path, staging_path)
+        upload.path = staging_path
 
     comment_id = uuid.uuid4().hex
     created_at = datetime.utcnow().isoformat()
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""INSERT INTO solicitudes 
-                      (id, feature_id, user, email, municipality, entity, text, file_path, created_at) 
-                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                   (comment_id, feature_id, user, email, municipality, entity, text, file_path, created_at))
-    conn.commit()
-    conn.close()
+    if not insert_comment(
+            (comment_id, feature_id, user, email, municipality, entity, text, file_path, file_name, created_at),
+            scan_job):
+        return jsonify({"error": "El archivo escaneado ya fue utilizado"}), 400
+
+    if upload is not None:
+        # El comentario debe existir antes de encolar: el escaneo puede terminar enseguida
+        try:
+            job_id = scan_queue.submit(upload.filename, path=upload.path, upload=upload, comment_id=comment_id)
+        except scan_jobs.QueueFullError as e:
+            database.execute(db.SQL_DELETE_COMMENT, (comment_id,))
+            database.invalidate_counts()
+            os.remove(upload.path)
+            logging.warning(f"Cola de escaneo llena: {e}")
+            return jsonify({"error": "Servidor ocupado, intente nuevamente en unos segundos"}), 503
+        cluster_index.refresh_statuses([feature_id])
+        client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+        logging.info(f"Archivo del comentario {comment_id} encolado desde IP {client_ip}: {upload.filename} ({job_id})")
+        return jsonify({
+            "status": "ok",
+            "comment_id": comment_id,
+            "file_status": "pending",
+            "job_id": job_id,
+            "status_url": url_for('scan_status', job_id=job_id)
+        })
 
+    cluster_index.refresh_statuses([feature_id])
     return jsonify({"status":"ok","comment_id":comment_id})
 
+def store_approved_upload(upload, file_info, path=None):
+    """Mover un archivo aprobado al blob store; devuelve la ruta para solicitudes.file_path"""
+    ext = file_info['filename'].rsplit('.', 1)[1].lower()
+    return blob_store.put(path or upload.path, upload.sha256, upload.size, ALLOWED_EXTENSIONS.get(ext))
+
+def attach_comment_file(comment_id, upload, path, approved, result):
+    """Veredicto de un archivo de /comment: adjuntarlo si se aprobó o dejarlo en cuarentena"""
+    try:
+        if not approved:
+            logging.warning(f"Intento de subida maliciosa en el comentario {comment_id}: {result}")
+            blob_store.quarantine(path, upload.sha256, upload.filename, upload.size, result, 'comment')
+            return approved, result
+        file_path = store_approved_upload(upload, result, path=path)
+        # El trigger de file_path suma la referencia al blob
+        database.execute(db.SQL_SET_COMMENT_FILE, (file_path, result['filename'], comment_id))
+        logging.info(f"Archivo adjuntado al comentario {comment_id}: {file_path}")
+        return approved, result
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Paginación del panel de admin
+COMMENTS_PAGE_SIZE = 50
+COMMENTS_PAGE_MAX = 500
+
+def encode_cursor(created_at, comment_id):
+    """Cursor opaco con la última fila de la página: (created_at, id)"""
+    raw = json.dumps([created_at, comment_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    created_at, comment_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return str(created_at), str(comment_id)
+
+def parse_comment_filters(args):
+    """Convertir los parámetros de la URL en filtros para db.Database; ValueError si son inválidos"""
+    filters = {}
+    for name in ('status', 'user', 'municipality', 'entity'):
+        value = args.get(name, '').strip()
+        if value:
+            filters[name] = value
+
+    date_from = args.get('date_from', '').strip()
+    if date_from:
+        filters['date_from'] = datetime.fromisoformat(date_from).isoformat()
+
+    date_to = args.get('date_to', '').strip()
+    if date_to:
+        end = datetime.fromisoformat(date_to)
+        # Una fecha sin hora incluye el día completo
+        if len(date_to) == 10:
+            end += timedelta(days=1)
+        filters['date_to'] = end.isoformat()
+
+    # bbox y ubicación (títulos de features, que no están en SQLite) se resuelven a feature_ids
+    feature_ids = None
+    bbox = args.get('bbox', '').strip()
+    if bbox:
+        feature_ids = set(feature_store.ids_in_bbox(*parse_bbox(bbox)))
+    location = args.get('location', '').strip()
+    if location:
+        matching = set(feature_store.ids_matching_title(location))
+        feature_ids = matching if feature_ids is None else feature_ids & matching
+    if feature_ids is not None:
+        filters['feature_ids'] = json.dumps(sorted(feature_ids))
+
+    return filters
+
 @app.route('/api/comments', methods=["GET"])
 def get_all_comments():
-    """Obtener todos los comentarios para el panel de admin"""
-    import json
-    
-    # Cargar datos GeoJSON para obtener los títulos y coordenadas
-    feature_data = {}
-    if os.path.exists(GEOJSON_FILE):
-        with open(GEOJSON_FILE, 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
-            for feature in geojson_data.get('features', []):
-                feature_uid = feature.get('properties', {}).get('feature_uid')
-                title = feature.get('properties', {}).get('title', 'Sin título')
-                coordinates = feature.get('geometry', {}).get('coordinates', [])
-                if feature_uid:
-                    feature_data[feature_uid] = {
-                        'title': title,
-                        'coordinates': coordinates  # [lng, lat]
-                    }
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, feature_id, user, email, municipality, entity, text, file_path, created_at, status FROM solicitudes ORDER BY created_at DESC")
-    rows = cursor.fetchall()
-    conn.close()
+    """Página de comentarios para el panel de admin (keyset sobre created_at, id).
+
+    Parámetros: limit, cursor, status, user (subcadena), municipality, entity,
+    location (subcadena del título del feature), date_from, date_to,
+    bbox=minLng,minLat,maxLng,maxLat
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', COMMENTS_PAGE_SIZE)), 1), COMMENTS_PAGE_MAX)
+        filters = parse_comment_filters(request.args)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "Parámetros de consulta inválidos"}), 400
+
+    # Se pide una fila extra para saber si existe una página siguiente
+    rows = database.fetch_comments_page(filters, after=after, limit=limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    feature_data = feature_store.get_many(row[1] for row in rows)
     
     result = []
     for row in rows:
@@ -671,13 +1111,33 @@ def get_all_comments():
             "entity": row[5],
             "text": row[6],
             "file_path": row[7],
+            "file_name": row[10],
             "created_at": row[8],
             "coordinates": coordinates,  # [lng, lat]
             "lat": coordinates[1] if len(coordinates) >= 2 else None,
             "lng": coordinates[0] if len(coordinates) >= 2 else None,
             "status": row[9] if row[9] else "new"  # Usar status de la base de datos o "new" por defecto
         })
-    return jsonify(result)
+
+    return jsonify({
+        "items": result,
+        "next_cursor": encode_cursor(rows[-1][8], rows[-1][0]) if has_more else None,
+        "limit": limit
+    })
+
+@app.route('/api/comments/count', methods=["GET"])
+def count_comments():
+    """Total de comentarios (mismos filtros que /api/comments) y desglose por estado"""
+    try:
+        filters = parse_comment_filters(request.args)
+    except (ValueError, TypeError):
+        return jsonify({"error": "Parámetros de consulta inválidos"}), 400
+
+    total, by_status = database.count_comments(filters)
+    response = {"total": total}
+    if by_status is not None:
+        response["by_status"] = by_status
+    return jsonify(response)
 
 @app.route('/api/comments/<comment_id>/status', methods=["PUT"])
 def update_comment_status(comment_id):
@@ -692,40 +1152,30 @@ def update_comment_status(comment_id):
 def delete_comment(comment_id):
     """Eliminar un comentario/solicitud por ID"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Primero obtener información del archivo asociado antes de eliminar
-        cursor.execute("SELECT file_path FROM solicitudes WHERE id = ?", (comment_id,))
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            return jsonify({"status": "error", "message": "Solicitud no encontrada"}), 404
-        
-        file_path = result[0]
-        
-        # Eliminar el registro de la base de datos
-        cursor.execute("DELETE FROM solicitudes WHERE id = ?", (comment_id,))
-        
-        if cursor.rowcount == 0:
-            conn.close()
-            return jsonify({"status": "error", "message": "No se pudo eliminar la solicitud"}), 400
-        
-        conn.commit()
-        conn.close()
+        with database.connection() as conn:
+            # Primero obtener información del archivo asociado antes de eliminar
+            result = conn.execute(db.SQL_COMMENT_FILE, (comment_id,)).fetchone()
+            
+            if not result:
+                return jsonify({"status": "error", "message": "Solicitud no encontrada"}), 404
+            
+            file_path, feature_id = result[0], result[1]
+            
+            # Eliminar el registro de la base de datos
+            if conn.execute(db.SQL_DELETE_COMMENT, (comment_id,)).rowcount == 0:
+                return jsonify({"status": "error", "message": "No se pudo eliminar la solicitud"}), 400
+        database.invalidate_counts()
         
-        # Eliminar archivo asociado si existe
+        # Liberar el archivo asociado: un blob solo se borra si ya nadie lo referencia
         if file_path:
-            full_file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_path)
             try:
-                if os.path.exists(full_file_path):
-                    os.remove(full_file_path)
-                    logging.info(f"Archivo eliminado: {full_file_path}")
+                if not blob_store.release(file_path):
+                    remove_legacy_upload(file_path)
             except OSError as e:
-                logging.error(f"Error eliminando archivo {full_file_path}: {e}")
+                logging.error(f"Error eliminando archivo {file_path}: {e}")
                 # No fallar la operación si no se puede eliminar el archivo
         
+        cluster_index.refresh_statuses([feature_id])
         logging.info(f"Solicitud eliminada: {comment_id}")
         return jsonify({"status": "ok", "message": "Solicitud eliminada correctamente"})
         
@@ -733,10 +1183,52 @@ def delete_comment(comment_id):
         logging.error(f"Error eliminando solicitud {comment_id}: {e}")
         return jsonify({"status": "error", "message": "Error interno del servidor"}), 500
 
-@app.route('/uploads/<filename>')
+def remove_legacy_upload(file_path):
+    """Borrar un archivo guardado antes del blob store (file_path ya incluye UPLOAD_FOLDER)"""
+    upload_root = os.path.realpath(app.config['UPLOAD_FOLDER'])
+    full_file_path = os.path.realpath(file_path)
+    if os.path.dirname(full_file_path) != upload_root:
+        logging.warning(f"Ruta de archivo fuera de {upload_root}, no se elimina: {file_path}")
+        return
+    if os.path.exists(full_file_path):
+        os.remove(full_file_path)
+        logging.info(f"Archivo eliminado: {full_file_path}")
+
+BLOB_EXTENSIONS = {content_type: ext for ext, content_type in ALLOWED_EXTENSIONS.items()}
+
+def send_blob(blob, download_name=None):
+    """Enviar un blob; sin nombre de la solicitud se usa uno neutro (el contenido puede
+    ser de varios usuarios y el blob no sabe quién lo subió)"""
+    if not download_name:
+        ext = BLOB_EXTENSIONS.get(blob['content_type'])
+        download_name = f"{blob['sha256'][:16]}.{ext}" if ext else blob['sha256'][:16]
+    return send_file(blob['path'], mimetype=blob['content_type'], download_name=download_name, max_age=31536000)
+
+@app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
+    # Blobs aprobados (safe/ab/cd/<sha256>) con su tipo; nunca temp/ ni quarantine/
+    parts = filename.split('/')
+    if len(parts) == 4 and parts[0] == 'safe':
+        blob = blob_store.get(parts[3])
+        if blob is None:
+            abort(404)
+        return send_blob(blob)
+    if len(parts) > 1:
+        abort(404)
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+@app.route('/api/comments/<comment_id>/file')
+def comment_file(comment_id):
+    """Adjunto de una solicitud con el nombre con que la subió su autor"""
+    row = database.fetch_one(db.SQL_COMMENT_ATTACHMENT, (comment_id,))
+    if row is None or not row[0]:
+        abort(404)
+    blob = blob_store.get(os.path.basename(row[0]))
+    if blob is None or blob['path'] != row[0]:
+        # Archivo anterior al blob store: se guardó con su propio nombre
+        return uploaded_file(os.path.basename(row[0]))
+    return send_blob(blob, row[1])
+
 # Ruta explícita para CSS (debug)
 @app.route('/static/styles.css')
 def css_file():
@@ -755,7 +1247,7 @@ def favicon():
 # Ruta para escanear archivo ANTES de envío
 @app.route('/scan-file', methods=['POST'])
 def scan_file():
-    """Escanea un archivo por seguridad ANTES de procesar la solicitud"""
+    """Encola el escaneo de seguridad de un archivo y devuelve el id del job (202)"""
     logging.info("🔍 Endpoint /scan-file llamado")
     try:
         # Verificar que se recibió un archivo
@@ -770,34 +1262,59 @@ def scan_file():
             logging.warning("Archivo sin nombre")
             return jsonify({"status": "error", "error": "No se seleccionó archivo"}), 400
         
-        # Validar archivo
-        logging.info("Iniciando validación de seguridad...")
-        is_valid, result = validate_file_security(file)
-        logging.info(f"Resultado validación: {is_valid}, {result}")
-        
-        if is_valid:
-            return jsonify({
-                "status": "ok", 
-                "message": "Archivo escaneado exitosamente",
-                "scan_results": result,
-                "file_data": {
-                    "filename": result["filename"],
-                    "type": result["type"],
-                    "security_level": result["security_level"]
-                }
-            })
-        else:
-            return jsonify({"status": "error", "error": result}), 400
+        # El archivo ya está en disco: se renombra a staging (sin copiarlo) y la
+        # validación completa corre en el pool de escaneo
+        upload = IngestedUpload.from_file_storage(file, INGEST_FOLDER)
+        staging_path = os.path.join(INGEST_FOLDER, f"job_{uuid.uuid4().hex}")
+        os.replace(upload.path, staging_path)
+        upload.path = staging_path
+        
+        try:
+            profile = g.get('profile')
+            job_id = scan_queue.submit(file.filename, path=staging_path, upload=upload,
+                                       profile=profile is not None and profile.forced)
+        except scan_jobs.QueueFullError as e:
+            os.remove(staging_path)
+            logging.warning(f"Cola de escaneo llena: {e}")
+            return jsonify({"status": "error", "error": "Servidor ocupado, intente nuevamente en unos segundos"}), 503
+        
+        logging.info(f"Escaneo encolado: {job_id}")
+        return jsonify({
+            "status": "queued",
+            "job_id": job_id,
+            "status_url": url_for('scan_status', job_id=job_id)
+        }), 202
             
     except Exception as e:
         logging.error(f"Error escaneando archivo: {str(e)}")
         return jsonify({"status": "error", "error": f"Error interno: {str(e)}"}), 500
 
+@app.route('/scan-status/<job_id>', methods=['GET'])
+def scan_status(job_id):
+    """Etapa y progreso de un escaneo; al terminar incluye el resultado"""
+    job = scan_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "error": "Escaneo no encontrado"}), 404
+    
+    if job['status'] == 'approved':
+        result = job['result']
+        job['message'] = "Archivo escaneado exitosamente"
+        # Los archivos de /comment ya quedaron adjuntos: no tienen token
+        job['scan_token'] = result.get("scan_token")
+        job['file_data'] = {
+            "filename": result["filename"],
+            "type": result["type"],
+            "security_level": result["security_level"]
+        }
+    elif job['status'] == 'rejected':
+        job['error'] = job['result']
+    return jsonify(job)
+
 # Ruta para manejar el envío del formulario público
 @app.route('/upload', methods=['POST'])
 def upload_request():
     """Recibe la solicitud del formulario con lat/lng y datos del usuario.
-    - Guarda archivo (opcional) con validación de seguridad
+    - Adjunta el archivo (opcional) ya escaneado en /scan-file mediante su token
     - Inserta registro en SQLite
     - Anexa punto al GeoJSON para visualizarlo en el mapa
     """
@@ -827,29 +1344,34 @@ def upload_request():
         try:
             lat_f = float(lat)
             lng_f = float(lng)
+            # float() acepta 'nan' e 'inf': no se pueden indexar ni servir en el GeoJSON
+            if not (math.isfinite(lat_f) and math.isfinite(lng_f)) or not (-90 <= lat_f <= 90 and -180 <= lng_f <= 180):
+                raise ValueError("coordenadas fuera de rango")
         except ValueError:
             return jsonify({"error": "Coordenadas inválidas"}), 400
 
-        # Manejo de archivo (opcional) - archivo ya fue escaneado en /scan-file
+        # Manejo de archivo (opcional) - archivo ya fue escaneado y guardado en /scan-file
         saved_file_path = ''
+        saved_file_name = None
+        scan_job = None
         security_info = None
         
-        if 'file' in request.files:
-            f = request.files['file']
-            if f and f.filename:
-                # El archivo ya fue validado en /scan-file, solo guardarlo
-                safe_filename = secure_filename(f.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                safe_filename = f"{timestamp}_{safe_filename}"
-                file_path = os.path.join(UPLOAD_FOLDER, safe_filename)
-                f.save(file_path)
-                saved_file_path = file_path
-                
-                security_info = {
-                    'security_level': 'pre-scanned',
-                    'scanned': True,
-                    'filename': safe_filename
-                }
+        scan_token = request.form.get('scan_token', '').strip()
+        if scan_token:
+            token_data, token_error = redeem_scan_token(scan_token)
+            if token_error:
+                return jsonify({"error": token_error}), 400
+            saved_file_path = token_data['blob']['path']
+            saved_file_name = token_data.get('filename')
+            scan_job = token_data['job']
+            security_info = {
+                'security_level': 'pre-scanned',
+                'scanned': True,
+                'filename': saved_file_name
+            }
+        elif request.files.get('file') and request.files['file'].filename:
+            # Los archivos solo se aceptan a través de /scan-file
+            return jsonify({"error": "El archivo debe escanearse antes de enviar la solicitud"}), 400
 
         # Preparar IDs y timestamp
         comment_id = uuid.uuid4().hex
@@ -857,52 +1379,45 @@ def upload_request():
         feature_id = f"point-{feature_hash}"
         created_at = datetime.utcnow().isoformat()
 
-        # Guardar en SQLite
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO solicitudes (id, feature_id, user, email, municipality, entity, text, file_path, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (comment_id, feature_id, name, email, municipality, entity, comments, saved_file_path, created_at)
-        )
-        conn.commit()
-        conn.close()
+        # Reutilizar un feature existente si el envío cae dentro del radio de snapping
+        snapped = None
+        if FEATURE_SNAP_RADIUS_M > 0:
+            snapped = feature_store.nearest_feature_uid(lat_f, lng_f, FEATURE_SNAP_RADIUS_M)
+            if snapped:
+                feature_id = snapped[0]
 
-        # Anexar al GeoJSON para visualización (no bloqueante)
-        try:
-            import json
-            geojson_path = GEOJSON_FILE
-            if not os.path.exists(geojson_path):
-                base = {"type": "FeatureCollection", "features": []}
-            else:
-                with open(geojson_path, 'r', encoding='utf-8') as f:
-                    base = json.load(f)
-                    if base.get('type') != 'FeatureCollection':
-                        base = {"type": "FeatureCollection", "features": []}
-
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "feature_uid": feature_id,
-                    "title": entity or municipality or name,
-                    "name": name,
-                    "municipality": municipality,
-                    "entity": entity,
-                    "comments": comments,
-                    "timestamp": created_at
-                },
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [lng_f, lat_f]
+        # Guardar en SQLite (el token de escaneo se consume en la misma transacción)
+        if not insert_comment(
+                (comment_id, feature_id, name, email, municipality, entity, comments, saved_file_path, saved_file_name, created_at),
+                scan_job):
+            return jsonify({"error": "El archivo escaneado ya fue utilizado"}), 400
+
+        # Anexar al GeoJSON para visualización (no bloqueante); un envío
+        # reasignado a un feature existente no crea un punto nuevo
+        if not snapped:
+            try:
+                feature = {
+                    "type": "Feature",
+                    "properties": {
+                        "feature_uid": feature_id,
+                        "title": entity or municipality or name,
+                        "name": name,
+                        "municipality": municipality,
+                        "entity": entity,
+                        "comments": comments,
+                        "timestamp": created_at
+                    },
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": [lng_f, lat_f]
+                    }
                 }
-            }
-            base.setdefault('features', []).append(feature)
-            with open(geojson_path, 'w', encoding='utf-8') as f:
-                json.dump(base, f, ensure_ascii=False, indent=2)
-        except Exception as geo_err:
-            logging.warning(f"No se pudo escribir en GeoJSON: {geo_err}")
+                feature_store.append(feature)
+            except Exception as geo_err:
+                logging.warning(f"No se pudo escribir en GeoJSON: {geo_err}")
+        else:
+            # El feature ya está en los clusters: actualizar sus contadores por estado, como en /comment
+            cluster_index.refresh_statuses([feature_id])
 
         # Crear respuesta con información de seguridad
         response_data = {
@@ -912,6 +1427,8 @@ def upload_request():
             "lat": lat_f,
             "lng": lng_f
         }
+        if snapped:
+            response_data["snapped"] = {"feature_id": feature_id, "distance_m": round(snapped[1], 2)}
         
         # Agregar información de seguridad si se escaneó un archivo
         if security_info:
@@ -0,0 +1,23 @@
+"""
+Punto de entrada ASGI - Geoportal Puerto Rico
+La app es WSGI y en producción corre en gunicorn con workers gthread
+(gunicorn_config.py). Con asgiref (en requirements.txt) se puede servir desde un servidor
+ASGI, p. ej.:
+
+    pip install uvicorn
+    uvicorn asgi:application --workers 2
+
+Las vistas corren en el pool de hilos de asgiref; escaneos y VirusTotal siguen
+en sus propios pools, fuera de la petición.
+"""
+
+# Antes de importar app: sin asgiref se falla sin arrancar pools, cachés ni la base
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    raise ImportError("asgiref no está instalado: pip install -r requirements.txt "
+                      "(o usar gunicorn -c gunicorn_config.py app:app)")
+
+from app import app
+
+application = WsgiToAsgi(app)
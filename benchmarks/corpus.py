@@ -0,0 +1,217 @@
+"""
+Corpus sintético para benchmarks/suite.py
+Genera, de forma determinista (misma semilla = mismos bytes):
+- PDFs con N páginas y una densidad de texto (reportlab)
+- data.geojson con N features puntuales dentro de Puerto Rico
+- una base de solicitudes con N filas que apuntan a esos features
+
+Los archivos se guardan en un directorio de caché y solo se generan si no
+existen; la suite trabaja sobre copias para no modificarlos.
+
+    python benchmarks/corpus.py --features 1000000 --rows 1000000
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from load_test import PR_BBOX
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.corpus')
+SEED = 2024
+
+# Líneas de texto por página
+DENSITIES = {
+    'empty': 0,         # sin texto (como un escaneo): la validación lo rechaza
+    'sparse': 6,
+    'dense': 58,
+}
+
+MUNICIPALITIES = (
+    'San Juan', 'Bayamón', 'Carolina', 'Ponce', 'Caguas', 'Guaynabo', 'Arecibo', 'Toa Baja',
+    'Mayagüez', 'Trujillo Alto', 'Aguadilla', 'Humacao', 'Vega Baja', 'Fajardo', 'Cayey', 'Yauco',
+)
+ENTITIES = ('Residente', 'Comerciante', 'Organización comunitaria', 'Agencia', 'Escuela')
+STATUSES = ('new', 'pending', 'resolved')
+STATUS_WEIGHTS = (0.5, 0.3, 0.2)
+WORDS = (
+    'mapa', 'solicitud', 'municipio', 'permiso', 'terreno', 'agua', 'carretera', 'escuela',
+    'puente', 'drenaje', 'alumbrado', 'parque', 'acera', 'vecinos', 'inundación', 'reparación',
+)
+
+# Fecha fija: el corpus no depende del día en que se genera
+BASE_DATE = datetime(2024, 1, 1)
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def corpus_path(directory, name):
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+# ========== PDFs ==========
+
+def make_pdf(pages, density, seed=SEED):
+    """Bytes de un PDF de `pages` páginas con DENSITIES[density] líneas por página"""
+    from reportlab.pdfgen import canvas
+
+    lines = DENSITIES[density]
+    rng = random.Random(f"{seed}-{pages}-{density}")
+    buf = io.BytesIO()
+    # invariant: sin fecha ni id aleatorio, el archivo es idéntico en cada generación
+    pdf = canvas.Canvas(buf, invariant=1)
+    for page in range(pages):
+        if page:
+            pdf.showPage()
+        for line in range(lines):
+            pdf.drawString(72, 760 - line * 12, _sentence(rng, 12))
+    if lines == 0:
+        # Solo un rectángulo: sin texto extraíble
+        pdf.rect(72, 400, 200, 200, fill=1)
+    pdf.save()
+    return buf.getvalue()
+
+
+def pdf_file(directory, pages, density, seed=SEED):
+    path = corpus_path(directory, f"doc-{pages}p-{density}.pdf")
+    if not os.path.exists(path):
+        _write_atomic(path, make_pdf(pages, density, seed))
+    return path
+
+
+# ========== GEOJSON ==========
+
+def write_geojson(path, count, seed=SEED):
+    """FeatureCollection con `count` puntos; se escribe feature por feature (1M cabe sin problema)"""
+    rng = random.Random(f"{seed}-geojson")
+    min_lng, min_lat, max_lng, max_lat = PR_BBOX
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for i in range(count):
+            feature = {
+                "type": "Feature",
+                "properties": {
+                    "feature_uid": feature_uid(i),
+                    "title": f"{rng.choice(MUNICIPALITIES)} {i}",
+                    "description": _sentence(rng, 8),
+                },
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [round(rng.uniform(min_lng, max_lng), 6), round(rng.uniform(min_lat, max_lat), 6)],
+                },
+            }
+            f.write(('' if i == 0 else ',\n') + json.dumps(feature, ensure_ascii=False))
+        f.write('\n]}\n')
+    os.replace(tmp_path, path)
+
+
+def feature_uid(index):
+    return f"bench-{index:07d}"
+
+
+def geojson_file(directory, count, seed=SEED):
+    path = corpus_path(directory, f"features-{count}.geojson")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        write_geojson(path, count, seed)
+        print(f"  corpus: {count} features en {time.perf_counter() - started:.1f}s -> {path}", file=sys.stderr)
+    return path
+
+
+# ========== SOLICITUDES ==========
+
+def solicitud_rows(count, features, seed=SEED, batch=10000):
+    """Lotes de filas de solicitudes con fechas crecientes en dos años"""
+    rng = random.Random(f"{seed}-solicitudes")
+    span = timedelta(days=730).total_seconds()
+    rows = []
+    for i in range(count):
+        created_at = BASE_DATE + timedelta(seconds=span * i / max(count, 1) + rng.random())
+        municipality = rng.choice(MUNICIPALITIES)
+        rows.append((
+            f"{rng.getrandbits(128):032x}",
+            feature_uid(rng.randrange(features)) if features else None,
+            f"usuario{rng.randrange(5000)}",
+            f"usuario{rng.randrange(5000)}@example.com",
+            municipality,
+            rng.choice(ENTITIES),
+            _sentence(rng, rng.randint(5, 40)),
+            None,
+            created_at.isoformat(),
+            rng.choices(STATUSES, STATUS_WEIGHTS)[0],
+        ))
+        if len(rows) >= batch:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+def fill_solicitudes(db_file, count, features, seed=SEED):
+    """Base con el esquema actual (migraciones de db.py) y `count` solicitudes"""
+    database = db.Database(db_file, pool_size=1)
+    if not database.init_schema():
+        raise RuntimeError(f"No se pudo crear el esquema en {db_file}")
+    with database.connection() as conn:
+        for rows in solicitud_rows(count, features, seed):
+            conn.executemany(
+                'INSERT INTO solicitudes (id, feature_id, user, email, municipality, entity, text, file_path, created_at, status) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            conn.commit()
+        conn.execute('ANALYZE')
+        # Todo en el archivo principal: la copia de la suite no necesita el -wal
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    database.pool.close_all()
+
+
+def solicitudes_file(directory, count, features, seed=SEED):
+    path = corpus_path(directory, f"solicitudes-{count}-{features}.db")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        tmp_path = f"{path}.tmp"
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(tmp_path + suffix):
+                os.remove(tmp_path + suffix)
+        fill_solicitudes(tmp_path, count, features, seed)
+        os.replace(tmp_path, path)
+        print(f"  corpus: {count} solicitudes en {time.perf_counter() - started:.1f}s -> {path}", file=sys.stderr)
+    return path
+
+
+def _write_atomic(path, data):
+    with open(f"{path}.tmp", 'wb') as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dir', default=os.getenv('BENCH_CORPUS_DIR', DEFAULT_DIR))
+    parser.add_argument('--features', type=int, default=1000)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--pages', default='1,10,50', help='páginas de los PDFs, separadas por coma')
+    args = parser.parse_args(argv)
+
+    for pages in (int(p) for p in args.pages.split(',')):
+        for density in DENSITIES:
+            print(pdf_file(args.dir, pages, density))
+    print(geojson_file(args.dir, args.features))
+    print(solicitudes_file(args.dir, args.rows, args.features))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+"""
+Prueba de carga - visitantes del mapa durante una ráfaga de subidas
+Cada visitante es un hilo con su propia conexión keep-alive que recorre las
+vistas del mapa (/data.geojson, tiles, /features, /clusters, /features/nearby).
+Mientras tanto, los que suben envían archivos a /scan-file a una velocidad
+limitada (como un cliente móvil) y consultan /scan-status hasta el veredicto.
+
+Modo --sweep: duplica los visitantes hasta que el p95 del mapa supera --p95 ms
+o los errores superan el 1 %, y reporta cuántos visitantes se sostuvieron.
+Para comparar configuraciones de gunicorn:
+
+    gunicorn -w 2 -k sync --timeout 120 app:app                  # configuración anterior
+    gunicorn -c gunicorn_config.py app:app                       # gthread
+    python benchmarks/load_test.py --url http://127.0.0.1:10000 --sweep
+
+Solo usa la biblioteca estándar (reportlab, si está, para generar los PDFs).
+"""
+
+import os
+import io
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+# Puerto Rico
+PR_BBOX = (-67.3, 17.9, -65.2, 18.6)
+NONCE_LENGTH = 32
+
+
+# ========== CLIENTE ==========
+
+class Client:
+    """Conexión HTTP keep-alive de un hilo; se reabre si el servidor la cierra"""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.https = parts.scheme == 'https'
+        self.timeout = timeout
+        self.conn = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, self.port, timeout=self.timeout)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def request(self, method, path, body=None, headers=None, rate=None):
+        """(status, cuerpo); rate limita el envío del cuerpo en bytes/s"""
+        for attempt in range(2):
+            if self.conn is None:
+                self._connect()
+            try:
+                if rate:
+                    self._send_throttled(method, path, body, headers or {}, rate)
+                else:
+                    self.conn.request(method, path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+                data = response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.close()
+                return response.status, data
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # Conexión keep-alive cerrada por el servidor: reintentar una vez con una nueva
+                self.close()
+                if attempt:
+                    raise
+
+    def _send_throttled(self, method, path, body, headers, rate):
+        self.conn.putrequest(method, path)
+        for name, value in headers.items():
+            self.conn.putheader(name, value)
+        self.conn.putheader('Content-Length', str(len(body)))
+        self.conn.endheaders()
+        chunk = max(int(rate / 10), 1024)
+        started = time.perf_counter()
+        for offset in range(0, len(body), chunk):
+            self.conn.send(body[offset:offset + chunk])
+            ahead = (offset + chunk) / rate - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+# ========== CARGA ==========
+
+def tile_for(lng, lat, z):
+    n = 2 ** z
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return x, y
+
+
+def viewer_paths(rng):
+    """Petición aleatoria de alguien navegando el mapa de Puerto Rico"""
+    min_lng, min_lat, max_lng, max_lat = PR_BBOX
+    lng = rng.uniform(min_lng, max_lng)
+    lat = rng.uniform(min_lat, max_lat)
+    kind = rng.choice(('geojson', 'tile', 'features', 'clusters', 'nearby'))
+    if kind == 'geojson':
+        return kind, '/data.geojson'
+    if kind == 'tile':
+        z = rng.randint(8, 12)
+        x, y = tile_for(lng, lat, z)
+        return kind, f'/tiles/{z}/{x}/{y}.geojson'
+    half = rng.uniform(0.05, 0.5)
+    bbox = f'{lng - half:.4f},{lat - half / 2:.4f},{lng + half:.4f},{lat + half / 2:.4f}'
+    if kind == 'features':
+        return kind, f'/features?bbox={bbox}&limit=200'
+    if kind == 'clusters':
+        return kind, f'/clusters?z={rng.randint(8, 14)}&bbox={bbox}'
+    return kind, f'/features/nearby?lat={lat:.5f}&lng={lng:.5f}&radius=2000'
+
+
+def make_document(size):
+    """(nombre, bytes, offset del nonce): un PDF con texto si hay reportlab, si no un .txt.
+
+    Cada subida reemplaza el nonce (mismo largo, el xref sigue válido) para que
+    el contenido sea distinto y no lo resuelva la caché de veredictos.
+    """
+    placeholder = 'N' * NONCE_LENGTH
+    try:
+        from reportlab.pdfgen import canvas
+    except ImportError:
+        words = ('mapa', 'solicitud', 'municipio', 'permiso', 'terreno', 'agua', 'carretera', 'escuela')
+        rng = random.Random(0)
+        text = placeholder + '\n'
+        while len(text) < size:
+            text += ' '.join(rng.choice(words) for _ in range(12)) + '\n'
+        return 'carga.txt', text.encode('ascii'), 0
+
+    buf = io.BytesIO()
+    pdf = canvas.Canvas(buf, pageCompression=0)
+    rng = random.Random(0)
+    pdf.drawString(72, 780, f'Documento de prueba de carga {placeholder}')
+    # Sin compresión, una página de 58 líneas de 90 caracteres ocupa unos 6 KB
+    for page in range(max(1, size // 6000)):
+        if page:
+            pdf.showPage()
+        for line in range(58):
+            pdf.drawString(72, 760 - line * 12, ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz ') for _ in range(90)))
+    pdf.save()
+    data = buf.getvalue()
+    return 'carga.pdf', data, data.index(placeholder.encode('ascii'))
+
+
+def multipart(field, filename, content):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode('ascii') + content + f'\r\n--{boundary}--\r\n'.encode('ascii')
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+class Recorder:
+    """Latencias por tipo de petición; cada hilo agrega a su propia lista"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds, ok):
+        with self._lock:
+            if ok:
+                self.samples.setdefault(kind, []).append(seconds)
+            else:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, kinds=None):
+        latencies = sorted(s for kind, values in self.samples.items() if kinds is None or kind in kinds for s in values)
+        errors = sum(n for kind, n in self.errors.items() if kinds is None or kind in kinds)
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+        }
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(math.ceil(p / 100.0 * len(sorted_values))) - 1)
+    return round(sorted_values[max(index, 0)] * 1000, 1)
+
+
+VIEWER_KINDS = ('geojson', 'tile', 'features', 'clusters', 'nearby')
+
+
+def run_viewer(args, recorder, stop, seed):
+    rng = random.Random(seed)
+    client = Client(args.url, args.timeout)
+    while not stop.is_set():
+        kind, path = viewer_paths(rng)
+        started = time.perf_counter()
+        try:
+            status, _ = client.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+            ok = status < 400
+        except OSError:
+            client.close()
+            ok = False
+        recorder.add(kind, time.perf_counter() - started, ok)
+        if args.think:
+            stop.wait(rng.uniform(0, 2 * args.think))
+    client.close()
+
+
+def run_uploader(args, recorder, stop, document, seed):
+    rng = random.Random(seed)
+    filename, content, nonce_at = document
+    client = Client(args.url, args.timeout)
+    while not stop.is_set():
+        nonce = uuid.UUID(int=rng.getrandbits(128)).hex.encode('ascii')
+        data = content[:nonce_at] + nonce + content[nonce_at + NONCE_LENGTH:]
+        body, headers = multipart('file', filename, data)
+        started = time.perf_counter()
+        try:
+            status, raw = client.request('POST', '/scan-file', body=body, headers=headers, rate=args.upload_rate * 1024)
+            recorder.add('scan-file', time.perf_counter() - started, status == 202)
+            if status == 503:
+                recorder.add('busy', 0, False)
+            if status != 202:
+                stop.wait(1.0)
+                continue
+            status_url = json.loads(raw)['status_url']
+            while not stop.is_set():
+                status, raw = client.request('GET', status_url)
+                job = json.loads(raw) if status == 200 else {'status': 'error'}
+                if job['status'] not in ('queued', 'running'):
+                    recorder.add('verdict', time.perf_counter() - started, job['status'] in ('approved', 'rejected'))
+                    break
+                stop.wait(0.5)
+        except (OSError, ValueError, KeyError):
+            client.close()
+            recorder.add('scan-file', time.perf_counter() - started, False)
+            stop.wait(1.0)
+    client.close()
+
+
+def run_level(args, viewers, document):
+    """Una corrida de args.duration segundos con `viewers` visitantes y args.uploaders subidas"""
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_uploader, args=(args, recorder, stop, document, i), daemon=True)
+               for i in range(args.uploaders)]
+    # Las subidas arrancan primero: los visitantes se miden durante la ráfaga
+    for thread in threads:
+        thread.start()
+    time.sleep(min(1.0, args.duration / 10))
+    viewer_threads = [threading.Thread(target=run_viewer, args=(args, recorder, stop, 1000 + i), daemon=True)
+                      for i in range(viewers)]
+    for thread in viewer_threads:
+        thread.start()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    stop.set()
+    elapsed = time.perf_counter() - started
+    for thread in threads + viewer_threads:
+        thread.join(timeout=args.timeout)
+
+    result = {
+        'viewers': viewers,
+        'uploaders': args.uploaders,
+        'duration_s': round(elapsed, 1),
+        'map': recorder.summary(VIEWER_KINDS),
+        'by_kind': {kind: recorder.summary((kind,)) for kind in VIEWER_KINDS},
+        'uploads': recorder.summary(('scan-file',)),
+        'verdicts': recorder.summary(('verdict',)),
+        'busy': recorder.errors.get('busy', 0),
+    }
+    result['map']['rps'] = round(result['map']['requests'] / elapsed, 1)
+    return result
+
+
+def sustained(result, p95_target):
+    current = result['map']
+    total = current['requests'] + current['errors']
+    return (total > 0 and current['p95_ms'] is not None and current['p95_ms'] <= p95_target
+            and current['errors'] <= total * 0.01)
+
+
+def print_level(result):
+    current = result['map']
+    print(f"visitantes={result['viewers']:4d}  mapa: {current['rps']:7.1f} req/s  "
+          f"p50={current['p50_ms']} ms  p95={current['p95_ms']} ms  errores={current['errors']}  |  "
+          f"subidas: {result['uploads']['requests']} (p95 {result['uploads']['p95_ms']} ms)  "
+          f"veredictos: {result['verdicts']['requests']}  ocupado: {result['busy']}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default=os.getenv('LOAD_TEST_URL', 'http://127.0.0.1:10000'))
+    parser.add_argument('--viewers', type=int, default=10, help='visitantes del mapa (inicio del barrido)')
+    parser.add_argument('--uploaders', type=int, default=4, help='subidas simultáneas durante la prueba')
+    parser.add_argument('--duration', type=float, default=20, help='segundos por nivel')
+    parser.add_argument('--think', type=float, default=0.0, help='pausa media entre peticiones de un visitante (s)')
+    parser.add_argument('--upload-size', type=int, default=256, help='tamaño del archivo subido (KB)')
+    parser.add_argument('--upload-rate', type=float, default=64, help='velocidad de envío de cada subida (KB/s)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--sweep', action='store_true', help='duplicar visitantes hasta superar el p95 objetivo')
+    parser.add_argument('--max-viewers', type=int, default=512)
+    parser.add_argument('--p95', type=float, default=500, help='p95 objetivo del mapa en ms (--sweep)')
+    parser.add_argument('--json', help='guardar los resultados en este archivo')
+    args = parser.parse_args(argv)
+
+    document = make_document(args.upload_size * 1024)
+    print(f"Objetivo {args.url}: {args.uploaders} subidas de {len(document[1]) // 1024} KB a "
+          f"{args.upload_rate:g} KB/s ({document[0]})", flush=True)
+
+    levels = []
+    viewers = args.viewers
+    while True:
+        result = run_level(args, viewers, document)
+        levels.append(result)
+        print_level(result)
+        if not args.sweep or not sustained(result, args.p95) or viewers * 2 > args.max_viewers:
+            break
+        viewers *= 2
+
+    report = {'url': args.url, 'p95_target_ms': args.p95, 'levels': levels}
+    if args.sweep:
+        ok = [level['viewers'] for level in levels if sustained(level, args.p95)]
+        report['max_sustained_viewers'] = max(ok) if ok else 0
+        print(f"Máximo de visitantes con p95 <= {args.p95:g} ms durante la ráfaga: {report['max_sustained_viewers']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
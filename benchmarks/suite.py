@@ -0,0 +1,586 @@
+"""
+Benchmarks - validación de PDFs, escaneo, subidas y datos del mapa
+Mide las rutas calientes contra el cliente de pruebas de Flask (y llamando
+directo a validate_pdf_with_text() y SecurityManager.scan_file()) sobre un
+corpus sintético y determinista (benchmarks/corpus.py), y guarda los
+resultados en JSON para compararlos entre commits:
+
+    python benchmarks/suite.py run --scale small --out base.json
+    python benchmarks/suite.py run --scale small,medium --out nuevo.json
+    python benchmarks/suite.py compare base.json nuevo.json --threshold 0.10
+
+Escalas (features del GeoJSON / filas de solicitudes):
+    small 1k / 10k, medium 100k / 100k, large 1M / 1M
+
+Cada escala corre en un proceso aparte sobre copias del corpus (la app se
+configura por variables de entorno al importarse). compare marca como
+regresión un benchmark cuya mediana crece más que --threshold y sale con
+código 1, para usarlo en CI.
+
+Grupos: pdf, scan, map, comments, upload (--groups). Sin VirusTotal ni clamd,
+PDFs validados en el proceso (PDF_SANDBOX_WORKERS=0) y sin caché de conteos,
+salvo que se indique otra cosa en el entorno.
+"""
+
+import io
+import gc
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import corpus
+from load_test import PR_BBOX, percentile
+
+SCALES = {
+    'small': {'features': 1_000, 'rows': 10_000},
+    'medium': {'features': 100_000, 'rows': 100_000},
+    'large': {'features': 1_000_000, 'rows': 1_000_000},
+}
+GROUPS = ('pdf', 'scan', 'map', 'comments', 'upload')
+# Sin depender del tamaño del corpus: solo se miden en la primera escala
+SCALE_INDEPENDENT = ('pdf', 'scan', 'upload')
+RESULTS_VERSION = 1
+
+
+class BenchmarkError(Exception):
+    """Respuesta inesperada durante un benchmark (el resultado no sería comparable)"""
+
+
+# ========== MEDICIÓN ==========
+
+def measure(fn, setup=None, budget=5.0, min_runs=5, max_runs=200, warmup=1):
+    """Tiempos (s) de fn(setup()) hasta max_runs o agotar budget, con al menos min_runs.
+
+    setup() corre fuera de la medición; fn devuelve opcionalmente un dict de
+    datos del último resultado (estado, tamaño...) que se guarda con los tiempos.
+    """
+    info = None
+    for _ in range(warmup):
+        info = fn(setup() if setup else None)
+    gc.collect()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_runs and (len(samples) < min_runs or time.perf_counter() - started < budget):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        info = fn(arg)
+        samples.append(time.perf_counter() - t0)
+    return samples, info
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        'runs': len(samples),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p95_ms': percentile(ordered, 95),
+        'stdev_ms': round(statistics.stdev(ordered) * 1000, 3) if len(ordered) > 1 else 0.0,
+    }
+
+
+class Runner:
+    def __init__(self, budget, min_runs, max_runs):
+        self.budget = budget
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.results = {}
+
+    def bench(self, group, label, params, fn, setup=None, **limits):
+        name = f"{group}.{label}"
+        if params:
+            name += '[' + ','.join(f"{k}={v}" for k, v in params.items()) + ']'
+        entry = {'group': group, 'params': params}
+        try:
+            samples, info = measure(
+                fn, setup,
+                budget=limits.get('budget', self.budget),
+                min_runs=limits.get('min_runs', self.min_runs),
+                max_runs=limits.get('max_runs', self.max_runs)
+            )
+            entry.update(summarize(samples))
+            if info:
+                entry['info'] = info
+            print(f"  {name:<60} mediana {entry['median_ms']:>10.3f} ms  p95 {entry['p95_ms']:>9} ms  ({entry['runs']} runs)",
+                  file=sys.stderr)
+        except Exception as e:
+            entry['error'] = f"{type(e).__name__}: {e}"
+            print(f"  {name:<60} ERROR {entry['error']}", file=sys.stderr)
+        self.results[name] = entry
+
+    def skip(self, group, label, reason):
+        self.results[f"{group}.{label}"] = {'group': group, 'params': {}, 'skipped': reason}
+        print(f"  {group}.{label:<54} omitido: {reason}", file=sys.stderr)
+
+
+def expect_status(response, *statuses):
+    if response.status_code not in statuses:
+        raise BenchmarkError(f"{response.request.path} -> {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def rotating(items):
+    """Función que devuelve el siguiente elemento en cada llamada (setup de measure)"""
+    state = {'i': -1}
+
+    def next_item():
+        state['i'] = (state['i'] + 1) % len(items)
+        return items[state['i']]
+    return next_item
+
+
+def random_points(count, seed):
+    rng = random.Random(seed)
+    min_lng, min_lat, max_lng, max_lat = PR_BBOX
+    return [(rng.uniform(min_lng, max_lng), rng.uniform(min_lat, max_lat)) for _ in range(count)]
+
+
+# ========== BENCHMARKS ==========
+
+def bench_pdf(runner, app, corpus_dir, pages_list):
+    from upload_ingest import IngestedUpload
+
+    for pages in pages_list:
+        for density in corpus.DENSITIES:
+            upload = IngestedUpload.from_path(corpus.pdf_file(corpus_dir, pages, density), 'documento.pdf')
+            # Solo el PDF sin texto se rechaza: un veredicto distinto mediría la ruta de error
+            expected = density != 'empty'
+
+            def run(_, upload=upload, density=density, expected=expected):
+                valid, message, _cacheable = app.validate_pdf_with_text(upload)
+                if valid != expected:
+                    raise BenchmarkError(f"PDF {density} {'rechazado' if expected else 'aceptado'}: {message}")
+                return {'valid': valid, 'bytes': upload.size}
+            runner.bench('pdf', 'validate_pdf_with_text', {'pages': pages, 'text': density}, run)
+
+
+def bench_scan(runner, app, corpus_dir, pages_list):
+    if app.security_manager is None:
+        runner.skip('scan', 'SecurityManager.scan_file', 'SecurityManager no disponible')
+        return
+    from upload_ingest import IngestedUpload
+
+    for pages in pages_list:
+        upload = IngestedUpload.from_path(corpus.pdf_file(corpus_dir, pages, 'dense'), 'documento.pdf')
+
+        def run(_, upload=upload):
+            results = app.security_manager.scan_file(upload.path, sha256=upload.sha256)
+            return {'decision': results['final_decision'], 'bytes': upload.size}
+        runner.bench('scan', 'SecurityManager.scan_file', {'pages': pages}, run)
+
+
+def bench_map(runner, app, features):
+    from Geo import FeatureStore, TileCache
+    from Geo.delivery import GeoJSONBuild
+    from Geo.tiles import tile_for
+
+    client = app.app.test_client()
+    params = {'features': features}
+    # Las corridas grandes tardan segundos: pocas repeticiones bastan
+    heavy = {'min_runs': 3} if features >= 100_000 else {}
+
+    runner.bench('map', 'load', params, lambda _: {'version': FeatureStore(app.GEOJSON_FILE).current_version()}, **heavy)
+
+    def build(_):
+        result = GeoJSONBuild(*app.feature_store.versioned_collection())
+        return {k: len(v) for k, v in result.bodies.items()}
+    runner.bench('map', 'geojson_build', params, build, **heavy)
+
+    def data_geojson(_):
+        response = expect_status(client.get('/data.geojson', headers={'Accept-Encoding': 'gzip'}), 200)
+        return {'bytes': len(response.data), 'encoding': response.headers.get('Content-Encoding', 'identity')}
+    runner.bench('map', 'data_geojson', params, data_geojson)
+
+    points = random_points(64, 'map')
+    for z in (10, 14):
+        tile_list = [tile_for(lng, lat, z) for lng, lat in points]
+        tiles = rotating(tile_list)
+
+        def cold_tile():
+            # Caché nueva: cada petición construye su tile
+            app.tile_cache = TileCache(app.feature_store)
+            return tiles()
+
+        def tile(xy, z=z):
+            response = expect_status(client.get(f'/tiles/{z}/{xy[0]}/{xy[1]}.geojson'), 200)
+            return {'bytes': len(response.data)}
+        runner.bench('map', 'tile_cold', dict(params, z=z), tile, setup=cold_tile)
+        app.tile_cache = TileCache(app.feature_store)
+        for xy in tile_list:
+            tile(xy)
+        runner.bench('map', 'tile_cached', dict(params, z=z), tile, setup=tiles)
+
+    boxes = rotating([f"{lng:.4f},{lat:.4f},{lng + 0.1:.4f},{lat + 0.1:.4f}" for lng, lat in points])
+
+    def features_bbox(bbox):
+        response = expect_status(client.get(f'/features?bbox={bbox}&limit=500'), 200)
+        return {'features': len(response.json['features'])}
+    runner.bench('map', 'features_bbox', params, features_bbox, setup=boxes)
+
+    centers = rotating(points)
+
+    def nearby(point):
+        lng, lat = point
+        response = expect_status(client.get(f'/features/nearby?lat={lat:.5f}&lng={lng:.5f}&radius=2000'), 200)
+        return {'features': len(response.json['features'])}
+    runner.bench('map', 'nearby', params, nearby, setup=centers)
+
+    island = ','.join(str(v) for v in PR_BBOX)
+    for z, bbox in ((8, lambda: island), (13, boxes)):
+        def clusters(bbox, z=z):
+            response = expect_status(client.get(f'/clusters?z={z}&bbox={bbox}'), 200)
+            return {'clusters': len(response.json['features'])}
+        runner.bench('map', 'clusters', dict(params, z=z), clusters, setup=bbox)
+
+
+def bench_comments(runner, app, rows, features):
+    client = app.app.test_client()
+    params = {'rows': rows}
+
+    def get(path):
+        def run(_):
+            response = expect_status(client.get(path), 200)
+            body = response.json
+            return {'items': len(body['items'])} if 'items' in body else body
+        return run
+
+    runner.bench('comments', 'get_all_comments', params, get('/api/comments?limit=50'))
+
+    # Página a mitad de la tabla a partir de un cursor keyset
+    middle = app.database.fetch_one(
+        'SELECT created_at, id FROM solicitudes ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?', (rows // 2,)
+    )
+    if middle:
+        runner.bench('comments', 'get_all_comments.deep_page', params,
+                     get(f'/api/comments?limit=50&cursor={app.encode_cursor(middle[0], middle[1])}'))
+
+    filters = {
+        'status': 'status=pending',
+        'status_municipality': 'status=new&municipality=Ponce',
+        'dates': 'date_from=2024-06-01&date_to=2024-06-30',
+        'bbox': 'bbox=-66.15,18.35,-66.00,18.47',
+    }
+    for label, query in filters.items():
+        runner.bench('comments', f'get_all_comments.{label}', params, get(f'/api/comments?limit=50&{query}'))
+
+    runner.bench('comments', 'count', params, get('/api/comments/count'))
+    runner.bench('comments', 'count.status_municipality', params,
+                 get(f"/api/comments/count?{filters['status_municipality']}"))
+
+    if features:
+        feature_ids = rotating([corpus.feature_uid(i) for i in random.Random('comments').sample(range(features), min(features, 64))])
+
+        def by_feature(feature_id):
+            response = expect_status(client.get(f'/comments/{feature_id}'), 200)
+            return {'comments': len(response.json) if isinstance(response.json, list) else None}
+        runner.bench('comments', 'by_feature', params, by_feature, setup=feature_ids)
+
+
+def bench_upload(runner, app, corpus_dir, pages_list, features):
+    client = app.app.test_client()
+
+    def wait(status_url):
+        while True:
+            job = client.get(status_url).json
+            if job['status'] not in ('queued', 'running'):
+                return job
+            time.sleep(0.002)
+
+    for pages in pages_list:
+        with open(corpus.pdf_file(corpus_dir, pages, 'dense'), 'rb') as f:
+            document = f.read()
+
+        def unique():
+            # Comentario tras %%EOF: contenido nuevo en cada subida, sin pasar por la caché de veredictos
+            return io.BytesIO(document + f"%bench-{uuid.uuid4().hex}\n".encode('ascii'))
+
+        def scan_file(body):
+            response = expect_status(client.post('/scan-file', data={'file': (body, 'documento.pdf')}), 202)
+            job = wait(response.json['status_url'])
+            if job['status'] != 'approved':
+                raise BenchmarkError(f"escaneo {job['status']}: {job.get('error')}")
+            return {'status': job['status'], 'bytes': len(document)}
+        runner.bench('upload', 'scan_file', {'pages': pages}, scan_file, setup=unique)
+
+        def comment(body):
+            response = expect_status(client.post('/comment', data={
+                'feature_id': corpus.feature_uid(0) if features else 'bench', 'user': 'bench', 'email': 'bench@example.com',
+                'municipality': 'Ponce', 'text': 'Solicitud de prueba de rendimiento',
+                'file': (body, 'documento.pdf')
+            }), 200, 201, 202)
+            job = wait(response.json['status_url'])
+            if job['status'] != 'approved':
+                raise BenchmarkError(f"escaneo {job['status']}: {job.get('error')}")
+            return {'status': job['status'], 'bytes': len(document)}
+        runner.bench('upload', 'comment', {'pages': pages}, comment, setup=unique)
+
+
+# ========== PROCESO POR ESCALA ==========
+
+def prepare_environment(workdir, geojson_path, db_path):
+    """Copias del corpus en workdir y variables de entorno de la app (antes de importarla)"""
+    os.makedirs(os.path.join(workdir, 'database'), exist_ok=True)
+    shutil.copyfile(geojson_path, os.path.join(workdir, 'data.geojson'))
+    shutil.copyfile(db_path, os.path.join(workdir, 'database', 'solicitudes.db'))
+
+    os.environ.update({
+        'GEOJSON_FILE': os.path.join(workdir, 'data.geojson'),
+        'DATABASE_URL': os.path.join(workdir, 'database', 'solicitudes.db'),
+        'USERS_DATABASE_URL': os.path.join(workdir, 'database', 'usuarios.db'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'LOG_FILE': os.path.join(workdir, 'logs', 'bench.log'),
+        'PROFILES_DIR': os.path.join(workdir, 'logs', 'profiles'),
+        'METRICS_DIR': '',
+        'PROFILING_ENABLED': 'false',
+        # Resultados reproducibles: sin servicios externos
+        'VIRUSTOTAL_API_KEY': '',
+        'CLAMD_SOCKET': '',
+        'CLAMD_HOST': '',
+    })
+    for name, value in (('LOG_LEVEL', 'WARNING'), ('PDF_SANDBOX_WORKERS', '0'), ('COMMENTS_COUNT_CACHE_TTL', '0')):
+        os.environ.setdefault(name, value)
+
+
+def run_worker(args):
+    corpus_dir = args.corpus
+    pages_list = [int(p) for p in args.pages.split(',')]
+    groups = [g for g in args.groups.split(',') if g]
+    geojson_path = corpus.geojson_file(corpus_dir, args.features)
+    db_path = corpus.solicitudes_file(corpus_dir, args.rows, args.features)
+    for pages in pages_list:
+        for density in corpus.DENSITIES:
+            corpus.pdf_file(corpus_dir, pages, density)
+
+    workdir = tempfile.mkdtemp(prefix='geoportal-bench-')
+    try:
+        prepare_environment(workdir, geojson_path, db_path)
+        os.chdir(workdir)
+        import app
+
+        runner = Runner(args.budget, args.min_runs, args.max_runs)
+        print(f"Escala features={args.features} filas={args.rows}: {', '.join(groups)}", file=sys.stderr)
+        if 'pdf' in groups:
+            bench_pdf(runner, app, corpus_dir, pages_list)
+        if 'scan' in groups:
+            bench_scan(runner, app, corpus_dir, [pages_list[0], pages_list[-1]])
+        if 'map' in groups:
+            bench_map(runner, app, args.features)
+        if 'comments' in groups:
+            bench_comments(runner, app, args.rows, args.features)
+        # Al final: las subidas agregan solicitudes y archivos
+        if 'upload' in groups:
+            bench_upload(runner, app, corpus_dir, [pages_list[0], pages_list[-1]], args.features)
+
+        env = {name: os.environ.get(name) for name in ('PDF_SANDBOX_WORKERS', 'COMMENTS_COUNT_CACHE_TTL', 'PDF_MAX_PAGES')}
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({
+                'features': args.features, 'rows': args.rows, 'env': env,
+                'security': 'advanced' if app.security_manager is not None else 'basic',
+                'max_rss_mb': max_rss_mb(), 'results': runner.results
+            }, f, ensure_ascii=False)
+    finally:
+        os.chdir(BENCH_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    # Hilos de fondo de la app (escaneos, compactación): no esperar a que terminen
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(0)
+
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(args):
+    scales = []
+    for name in args.scale.split(','):
+        if name not in SCALES:
+            raise SystemExit(f"Escala desconocida: {name} (disponibles: {', '.join(SCALES)})")
+        scale = dict(SCALES[name], name=name)
+        if args.features is not None:
+            scale['features'] = args.features
+        if args.rows is not None:
+            scale['rows'] = args.rows
+        scales.append(scale)
+
+    groups = [g for g in args.groups.split(',') if g]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        raise SystemExit(f"Grupos desconocidos: {', '.join(sorted(unknown))} (disponibles: {', '.join(GROUPS)})")
+
+    report = {
+        'version': RESULTS_VERSION,
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'scales': [],
+        },
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='geoportal-bench-out-') as tmp:
+        for index, scale in enumerate(scales):
+            scale_groups = [g for g in groups if index == 0 or g not in SCALE_INDEPENDENT]
+            if not scale_groups:
+                continue
+            out = os.path.join(tmp, f"{index}.json")
+            command = [
+                sys.executable, os.path.abspath(__file__), 'worker',
+                '--features', str(scale['features']), '--rows', str(scale['rows']),
+                '--groups', ','.join(scale_groups), '--pages', args.pages, '--corpus', args.corpus,
+                '--budget', str(args.budget), '--min-runs', str(args.min_runs), '--max-runs', str(args.max_runs),
+                '--out', out,
+            ]
+            if subprocess.run(command).returncode != 0 or not os.path.exists(out):
+                raise SystemExit(f"La escala {scale['name']} falló")
+            with open(out, 'r', encoding='utf-8') as f:
+                partial = json.load(f)
+            results = partial.pop('results')
+            report['meta']['scales'].append(dict(partial, name=scale['name'], groups=scale_groups))
+            report['results'].update(results)
+
+    out = args.out or os.path.join(BENCH_DIR, 'results', f"{datetime.now():%Y%m%d-%H%M%S}-{report['meta']['commit'] or 'local'}.json")
+    if os.path.dirname(out):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    errors = [name for name, entry in report['results'].items() if 'error' in entry]
+    print(f"\n{len(report['results'])} benchmarks guardados en {out}" + (f"; con error: {', '.join(errors)}" if errors else ''))
+    return report
+
+
+# ========== COMPARACIÓN ==========
+
+def compare(base, new, threshold=0.10, min_delta_ms=0.05):
+    """Filas (nombre, base_ms, nuevo_ms, cambio, estado) comparando medianas.
+
+    Estado: 'regresión' si la mediana crece más que threshold (y más de
+    min_delta_ms, para no marcar ruido de microsegundos), 'mejora' en el caso
+    inverso, 'nuevo'/'eliminado'/'error' si falta en uno de los dos lados.
+    """
+    rows = []
+    base_results, new_results = base['results'], new['results']
+    for name in sorted(set(base_results) | set(new_results)):
+        before, after = base_results.get(name), new_results.get(name)
+        if before is None or after is None:
+            rows.append((name, None, None, None, 'nuevo' if before is None else 'eliminado'))
+            continue
+        if 'median_ms' not in before or 'median_ms' not in after:
+            rows.append((name, before.get('median_ms'), after.get('median_ms'), None,
+                         'error' if 'error' in after else 'omitido'))
+            continue
+        old_ms, new_ms = before['median_ms'], after['median_ms']
+        change = (new_ms - old_ms) / old_ms if old_ms else 0.0
+        if change > threshold and new_ms - old_ms > min_delta_ms:
+            status = 'regresión'
+        elif change < -threshold / (1 + threshold) and old_ms - new_ms > min_delta_ms:
+            status = 'mejora'
+        else:
+            status = 'igual'
+        rows.append((name, old_ms, new_ms, change, status))
+    return rows
+
+
+def run_compare(args):
+    with open(args.base, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    for key in ('python', 'platform', 'cpus'):
+        if base['meta'].get(key) != new['meta'].get(key):
+            print(f"⚠️ {key} distinto: {base['meta'].get(key)} vs {new['meta'].get(key)}")
+    print(f"Base {base['meta'].get('commit')} ({base['meta'].get('created_at')}) -> "
+          f"nuevo {new['meta'].get('commit')} ({new['meta'].get('created_at')}), umbral {args.threshold:.0%}\n")
+
+    rows = compare(base, new, args.threshold, args.min_delta_ms)
+    marks = {'regresión': '❌', 'mejora': '✅', 'error': '❌'}
+    for name, old_ms, new_ms, change, status in rows:
+        old_text = f"{old_ms:.3f}" if old_ms is not None else '-'
+        new_text = f"{new_ms:.3f}" if new_ms is not None else '-'
+        change_text = f"{change:+.1%}" if change is not None else ''
+        print(f"{marks.get(status, '  ')} {name:<62} {old_text:>11} {new_text:>11} ms {change_text:>8}  {status}")
+
+    regressions = [row[0] for row in rows if row[4] in ('regresión', 'error')]
+    if regressions:
+        print(f"\n❌ {len(regressions)} regresiones por encima del {args.threshold:.0%}")
+        return 1
+    print("\n✅ Sin regresiones")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_run_options(p):
+        p.add_argument('--groups', default=','.join(GROUPS), help=f"grupos a medir ({', '.join(GROUPS)})")
+        p.add_argument('--pages', default='1,10,50', help='páginas de los PDFs, separadas por coma')
+        p.add_argument('--corpus', default=os.getenv('BENCH_CORPUS_DIR', corpus.DEFAULT_DIR),
+                       help='caché del corpus generado')
+        p.add_argument('--budget', type=float, default=5.0, help='segundos por benchmark (aprox.)')
+        p.add_argument('--min-runs', type=int, default=5)
+        p.add_argument('--max-runs', type=int, default=200)
+
+    run = commands.add_parser('run', help='correr la suite y guardar los resultados en JSON')
+    run.add_argument('--scale', default='small', help=f"escalas separadas por coma ({', '.join(SCALES)})")
+    run.add_argument('--features', type=int, help='features del GeoJSON (reemplaza los de la escala)')
+    run.add_argument('--rows', type=int, help='filas de solicitudes (reemplaza las de la escala)')
+    run.add_argument('--out', help='archivo de resultados (por defecto benchmarks/results/<fecha>-<commit>.json)')
+    add_run_options(run)
+
+    worker = commands.add_parser('worker', help=argparse.SUPPRESS)
+    worker.add_argument('--features', type=int, required=True)
+    worker.add_argument('--rows', type=int, required=True)
+    worker.add_argument('--out', required=True)
+    add_run_options(worker)
+
+    cmp = commands.add_parser('compare', help='comparar dos resultados y marcar regresiones')
+    cmp.add_argument('base')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=0.10, help='crecimiento de la mediana tolerado (0.10 = 10%%)')
+    cmp.add_argument('--min-delta-ms', type=float, default=0.05, help='diferencia absoluta mínima para marcar')
+
+    args = parser.parse_args(argv)
+    if args.command == 'worker':
+        run_worker(args)
+    elif args.command == 'run':
+        run_suite(args)
+    else:
+        return run_compare(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Blob Store - Archivos aprobados por contenido (SHA-256)
+Cada archivo aprobado se guarda una sola vez en safe/ab/cd/<sha256>; las
+solicitudes lo referencian por su ruta en solicitudes.file_path (el nombre
+original va en solicitudes.file_name: el blob solo describe el contenido, que
+pueden compartir varios usuarios) y los triggers de la migración 6 mantienen
+blobs.refcount. Un blob sin referencias se borra al eliminar la última
+solicitud o, si es reciente (puede haber un token de escaneo sin canjear), en
+la recolección periódica.
+
+Los archivos rechazados se guardan en quarantine/<sha256> con sus metadatos en
+quarantine_files hasta que vencen.
+
+Las transacciones solo tocan filas; los archivos se mueven o borran después del
+COMMIT. Para borrar, el archivo se renombra primero y se restaura si entretanto
+otro proceso volvió a registrar el mismo contenido.
+"""
+
+import os
+import time
+import logging
+import threading
+
+SQL_PUT_BLOB = (
+    "INSERT INTO blobs (sha256, path, size, content_type, refcount, stored_at) "
+    "VALUES (?, ?, ?, ?, 0, ?) "
+    "ON CONFLICT(sha256) DO UPDATE SET stored_at = excluded.stored_at"
+)
+SQL_GET_BLOB = "SELECT sha256, path, size, content_type, refcount FROM blobs WHERE sha256 = ?"
+SQL_BLOB_EXISTS = "SELECT 1 FROM blobs WHERE sha256 = ?"
+SQL_ORPHAN_BLOBS = "SELECT sha256 FROM blobs WHERE refcount <= 0 AND stored_at < ?"
+SQL_ORPHAN_BLOB_BY_PATH = "SELECT sha256 FROM blobs WHERE path = ? AND refcount <= 0 AND stored_at < ?"
+# stored_at < ?: un put() confirmado después de elegir el huérfano lo vuelve a proteger
+SQL_DELETE_BLOB = "DELETE FROM blobs WHERE sha256 = ? AND refcount <= 0 AND stored_at < ?"
+SQL_QUARANTINE = (
+    "INSERT INTO quarantine_files (sha256, filename, size, reason, source, created_at) VALUES (?, ?, ?, ?, ?, ?)"
+)
+SQL_EXPIRED_QUARANTINE = "SELECT sha256 FROM quarantine_files WHERE created_at < ?"
+SQL_PURGE_QUARANTINE = "DELETE FROM quarantine_files WHERE created_at < ?"
+SQL_QUARANTINE_REFERENCED = "SELECT 1 FROM quarantine_files WHERE sha256 = ? LIMIT 1"
+
+
+class BlobStore:
+    def __init__(self, database, upload_folder, orphan_grace=7200, quarantine_days=7):
+        """orphan_grace debe superar la vigencia del token de escaneo: un blob recién
+        aprobado aún no tiene solicitud que lo referencie."""
+        self.database = database
+        self.upload_folder = upload_folder
+        self.safe_folder = os.path.join(upload_folder, 'safe')
+        self.quarantine_folder = os.path.join(upload_folder, 'quarantine')
+        self.orphan_grace = orphan_grace
+        self.quarantine_days = quarantine_days
+        self._collector = None
+        self._lock = threading.Lock()
+        os.makedirs(self.safe_folder, exist_ok=True)
+        os.makedirs(self.quarantine_folder, exist_ok=True)
+
+    def path_for(self, sha256):
+        """Ruta del blob (la misma que guarda solicitudes.file_path)"""
+        return os.path.join(self.safe_folder, sha256[:2], sha256[2:4], sha256)
+
+    # ========== BLOBS ==========
+
+    def put(self, source_path, sha256, size, content_type):
+        """Mover source_path al blob de su contenido; si ya existe se descarta la copia.
+
+        Devuelve la ruta del blob. La fila (con stored_at renovado, que la aparta de
+        la recolección) se confirma antes de colocar el archivo.
+        """
+        path = self.path_for(sha256)
+        with self.database.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(SQL_PUT_BLOB, (sha256, path, size, content_type, time.time()))
+        if os.path.exists(path):
+            os.remove(source_path)
+            logging.info(f"♻️ Blob {sha256[:16]}... ya almacenado: copia descartada")
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(source_path, path)
+        return path
+
+    def get(self, sha256):
+        """Metadatos del blob como dict, o None si no existe"""
+        row = self.database.fetch_one(SQL_GET_BLOB, (sha256,))
+        if row is None or not os.path.exists(row[1]):
+            return None
+        return {'sha256': row[0], 'path': row[1], 'size': row[2], 'content_type': row[3], 'refcount': row[4]}
+
+    def release(self, path):
+        """Tras eliminar una solicitud: borrar su blob si ya nadie lo referencia.
+
+        Devuelve False si path no es un blob (archivo de versiones anteriores).
+        """
+        if not os.path.normpath(path).startswith(os.path.normpath(self.safe_folder) + os.sep):
+            return False
+        cutoff = time.time() - self.orphan_grace
+        with self.database.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(SQL_ORPHAN_BLOB_BY_PATH, (path, cutoff)).fetchone()
+            deleted = row is not None and conn.execute(SQL_DELETE_BLOB, (row[0], cutoff)).rowcount > 0
+        if deleted:
+            self._remove_blob_file(row[0])
+        return True
+
+    def _remove_blob_file(self, sha256):
+        """Borrar el archivo de un blob cuya fila ya se eliminó (fuera de la transacción)"""
+        removed = self._unlink_unreferenced(
+            self.path_for(sha256),
+            lambda: self.database.fetch_one(SQL_BLOB_EXISTS, (sha256,)) is not None
+        )
+        if removed:
+            logging.info(f"🗑️ Blob sin referencias eliminado: {sha256[:16]}...")
+        return removed
+
+    @staticmethod
+    def _unlink_unreferenced(path, referenced):
+        """Borrar path salvo que referenced() indique que se volvió a registrar.
+
+        El archivo se aparta con un rename antes de comprobarlo: un put() que lo
+        vio existir confirmó su fila antes, así que la comprobación lo encuentra y
+        el archivo se restaura; si no lo vio, coloca su propia copia.
+        """
+        doomed = f"{path}.{os.getpid()}-{threading.get_ident()}.gc"
+        try:
+            os.rename(path, doomed)
+        except FileNotFoundError:
+            return False
+        if referenced():
+            os.replace(doomed, path)
+            return False
+        os.remove(doomed)
+        return True
+
+    # ========== CUARENTENA ==========
+
+    def quarantine(self, source_path, sha256, filename, size, reason, source):
+        """Guardar un archivo rechazado en quarantine/<sha256> con sus metadatos"""
+        path = os.path.join(self.quarantine_folder, sha256)
+        with self.database.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(SQL_QUARANTINE, (sha256, filename, size, str(reason), source, time.time()))
+        if os.path.exists(path):
+            os.remove(source_path)
+        else:
+            os.replace(source_path, path)
+        logging.warning(f"☣️ Archivo en cuarentena: {filename} ({sha256[:16]}...) - {reason}")
+        return path
+
+    # ========== RECOLECCIÓN ==========
+
+    def collect_garbage(self):
+        """Borrar blobs huérfanos, cuarentena vencida y archivos en espera abandonados"""
+        now = time.time()
+        removed = 0
+        cutoff = now - self.orphan_grace
+        with self.database.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            orphans = [sha256 for (sha256,) in conn.execute(SQL_ORPHAN_BLOBS, (cutoff,)).fetchall()
+                       if conn.execute(SQL_DELETE_BLOB, (sha256, cutoff)).rowcount]
+        for sha256 in orphans:
+            removed += self._remove_blob_file(sha256)
+
+        expires = now - self.quarantine_days * 86400
+        with self.database.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = {row[0] for row in conn.execute(SQL_EXPIRED_QUARANTINE, (expires,)).fetchall()}
+            conn.execute(SQL_PURGE_QUARANTINE, (expires,))
+        for sha256 in expired:
+            removed += self._unlink_unreferenced(
+                os.path.join(self.quarantine_folder, sha256),
+                lambda: self.database.fetch_one(SQL_QUARANTINE_REFERENCED, (sha256,)) is not None
+            )
+
+        # Archivos en espera de un veredicto diferido cuyo proceso terminó antes de recibirlo
+        for name in os.listdir(self.quarantine_folder):
+            path = os.path.join(self.quarantine_folder, name)
+            if name.startswith(('job_', 'comment_')) and os.path.getmtime(path) < now - 86400:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def start_collector(self, interval=3600):
+        """Hilo en segundo plano que recolecta periódicamente (un solo worker a la vez)"""
+        if interval <= 0:
+            return
+        with self._lock:
+            if self._collector is not None and self._collector.is_alive():
+                return
+            owner = f"{os.getpid()}-{id(self)}"
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        if self.database.try_acquire_lease('blob_gc', owner, ttl=interval * 2):
+                            removed = self.collect_garbage()
+                            if removed:
+                                logging.info(f"Recolección de archivos: {removed} eliminados")
+                    except Exception as e:
+                        logging.warning(f"Error en la recolección de archivos: {e}")
+
+            self._collector = threading.Thread(target=run, name='blob-collector', daemon=True)
+            self._collector.start()
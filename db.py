@@ -0,0 +1,593 @@
+"""
+Capa de acceso a datos SQLite para el Geoportal
+- El esquema se crea/migra una sola vez al arrancar el proceso
+- Cada proceso (worker de gunicorn) mantiene un pool de conexiones persistentes
+- Las conexiones usan WAL y pragmas ajustados para lecturas concurrentes
+"""
+
+import os
+import re
+import sys
+import json
+import queue
+import sqlite3
+import logging
+import threading
+import time
+import functools
+from contextlib import contextmanager
+
+import metrics
+
+DB_QUERY_SECONDS = metrics.histogram(
+    'db_query_duration_seconds', 'Duración de consultas SQLite (préstamo de conexión incluido)', ('query',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+_QUERY_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(\w+)', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=512)
+def query_label(sql):
+    """'select solicitudes', 'insert scan_jobs'... (etiqueta de cardinalidad acotada)"""
+    verb = sql.split(None, 1)[0].lower() if sql.strip() else 'sql'
+    table = _QUERY_TABLE.search(sql)
+    return f"{verb} {table.group(1)}" if table else verb
+
+# Pragmas aplicados a cada conexión nueva del pool
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",      # Seguro con WAL y mucho más rápido que FULL
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8192",        # ~8MB de caché de páginas por conexión
+    "PRAGMA mmap_size = 67108864",      # 64MB de lectura mapeada en memoria
+)
+
+# Consultas frecuentes; sqlite3 mantiene las sentencias preparadas en caché
+# por conexión, así que reutilizar el mismo texto SQL evita recompilarlas.
+SQL_COMMENTS_BY_FEATURE = (
+    "SELECT id, feature_id, user, email, municipality, entity, text, file_path, created_at, file_name "
+    "FROM solicitudes WHERE feature_id = ?"
+)
+SQL_COMMENTS_PAGE = (
+    "SELECT id, feature_id, user, email, municipality, entity, text, file_path, created_at, status, file_name "
+    "FROM solicitudes"
+)
+SQL_COMMENTS_COUNT = "SELECT COUNT(*) FROM solicitudes"
+SQL_STATUS_COUNTS = "SELECT status, total FROM solicitudes_counts"
+SQL_INSERT_COMMENT = (
+    "INSERT INTO solicitudes (id, feature_id, user, email, municipality, entity, text, file_path, file_name, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_COMMENT_FILE = "SELECT file_path, feature_id FROM solicitudes WHERE id = ?"
+SQL_SET_COMMENT_FILE = "UPDATE solicitudes SET file_path = ?, file_name = ? WHERE id = ?"
+SQL_COMMENT_ATTACHMENT = "SELECT file_path, file_name FROM solicitudes WHERE id = ?"
+SQL_FEATURE_STATUS_COUNTS = (
+    "SELECT feature_id, status, COUNT(*) FROM solicitudes{where} GROUP BY feature_id, status"
+)
+SQL_DELETE_COMMENT = "DELETE FROM solicitudes WHERE id = ?"
+SQL_ACQUIRE_LEASE = (
+    "INSERT INTO maintenance_leases (name, owner, expires_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+    "WHERE maintenance_leases.expires_at < ? OR maintenance_leases.owner = excluded.owner"
+)
+
+# Filtros aceptados por fetch_comments_page()/count_comments() -> condición SQL
+COMMENT_FILTERS = {
+    'status': "status = ?",
+    # Subcadena sin distinguir mayúsculas (también en letras acentuadas)
+    'user': "instr(casefold(user), casefold(?)) > 0",
+    'municipality': "municipality = ?",
+    'entity': "entity = ?",
+    'date_from': "created_at >= ?",
+    'date_to': "created_at < ?",
+    'feature_ids': "feature_id IN (SELECT value FROM json_each(?))",
+}
+
+# Página filtrada por bbox: con pocos features se busca por feature_id y se ordenan
+# solo esas filas; con muchos, ordenar saldría caro y se recorre el índice
+# (created_at, id) en orden descartando por pertenencia (el + descarta el índice
+# de feature_id para ese término)
+BBOX_SORT_MAX_FEATURES = 200
+SQL_FEATURE_IDS_IN_DATE_ORDER = "+feature_id IN (SELECT value FROM json_each(?))"
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+class ConnectionPool:
+    """Pool de conexiones SQLite de larga vida, seguro entre hilos y tras fork"""
+
+    def __init__(self, db_file, size=4, timeout=10.0):
+        self.db_file = db_file
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.size)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row
+        # lower() de SQLite solo convierte ASCII
+        conn.create_function('casefold', 1, _casefold, deterministic=True)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        # Las conexiones heredadas de un fork no se pueden reutilizar en el hijo
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class Database:
+    """Punto de acceso único a la base de datos de solicitudes"""
+
+    def __init__(self, db_file, pool_size=None):
+        self.db_file = db_file
+        self.pool = ConnectionPool(db_file, size=pool_size or int(os.getenv('DB_POOL_SIZE', 4)))
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        # Conteos filtrados recientes: {filtros: (expira, foto de solicitudes_counts, total)}
+        self._count_cache = {}
+        self.count_cache_hits = 0
+        self.count_cache_misses = 0
+        self._count_cache_ttl = float(os.getenv('COMMENTS_COUNT_CACHE_TTL', 30))
+
+    def init_schema(self):
+        """Crear directorio, activar WAL y crear/migrar tablas (una vez por proceso)"""
+        if self._initialized:
+            return True
+        with self._init_lock:
+            if self._initialized:
+                return True
+            try:
+                db_dir = os.path.dirname(self.db_file)
+                if db_dir:
+                    os.makedirs(db_dir, exist_ok=True)
+
+                with self.connection() as conn:
+                    # journal_mode es persistente en el archivo: basta con fijarlo una vez
+                    conn.execute("PRAGMA journal_mode = WAL")
+                    migrate(conn)
+
+                self._initialized = True
+                return True
+            except Exception as e:
+                logging.error(f"Error inicializando base de datos: {e}")
+                return False
+
+    @contextmanager
+    def connection(self):
+        """Préstamo de una conexión del pool; commit al salir o rollback si hay error"""
+        conn = self.pool.acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.pool.release(conn)
+
+    def fetch_all(self, sql, params=()):
+        with DB_QUERY_SECONDS.time(query=query_label(sql)), self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def fetch_one(self, sql, params=()):
+        with DB_QUERY_SECONDS.time(query=query_label(sql)), self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def execute(self, sql, params=()):
+        """Ejecutar una sentencia de escritura y devolver el número de filas afectadas"""
+        with DB_QUERY_SECONDS.time(query=query_label(sql)), self.connection() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def try_acquire_lease(self, name, owner, ttl):
+        """Tomar (o renovar) un lease con nombre para tareas que solo debe hacer un worker"""
+        now = time.time()
+        return self.execute(SQL_ACQUIRE_LEASE, (name, owner, now + ttl, now)) == 1
+
+    def feature_status_counts(self, feature_ids=None):
+        """{feature_id: {status: n}} de todas las solicitudes o solo de los features indicados"""
+        if feature_ids is None:
+            rows = self.fetch_all(SQL_FEATURE_STATUS_COUNTS.format(where=''))
+        else:
+            rows = self.fetch_all(
+                SQL_FEATURE_STATUS_COUNTS.format(where=" WHERE " + COMMENT_FILTERS['feature_ids']),
+                (json.dumps(list(feature_ids)),)
+            )
+        counts = {}
+        for feature_id, status, total in rows:
+            counts.setdefault(feature_id, {})[status or 'new'] = total
+        return counts
+
+    def fetch_comments_page(self, filters=None, after=None, limit=50):
+        """Página de solicitudes ordenada por (created_at, id) descendente.
+
+        `after` es la tupla (created_at, id) de la última fila de la página
+        anterior (paginación keyset: cada página es una búsqueda por índice,
+        sin OFFSET).
+        """
+        conditions = COMMENT_FILTERS
+        if filters and 'feature_ids' in filters and \
+                len(json.loads(filters['feature_ids'])) > BBOX_SORT_MAX_FEATURES:
+            conditions = dict(COMMENT_FILTERS, feature_ids=SQL_FEATURE_IDS_IN_DATE_ORDER)
+        where, params = _comment_filters_sql(filters, conditions)
+        if after:
+            where.append("(created_at, id) < (?, ?)")
+            params.extend(after)
+        sql = SQL_COMMENTS_PAGE
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+        return self.fetch_all(sql, params)
+
+    def count_comments(self, filters=None):
+        """Total de solicitudes; sin filtros sale de solicitudes_counts (mantenida por triggers).
+
+        Los conteos filtrados se recuerdan COMMENTS_COUNT_CACHE_TTL segundos junto con
+        la foto de solicitudes_counts: cualquier INSERT, DELETE o cambio de estado (de
+        este o de otro worker) cambia esa foto y descarta la entrada.
+        """
+        by_status = {row[0]: row[1] for row in self.fetch_all(SQL_STATUS_COUNTS)}
+        if not filters:
+            return sum(by_status.values()), by_status
+
+        key = tuple(sorted(filters.items()))
+        snapshot = tuple(sorted(by_status.items()))
+        cached = self._count_cache.get(key)
+        now = time.monotonic()
+        if cached and cached[0] > now and cached[1] == snapshot:
+            self.count_cache_hits += 1
+            return cached[2], None
+        self.count_cache_misses += 1
+
+        where, params = _comment_filters_sql(filters)
+        total = self.fetch_one(SQL_COMMENTS_COUNT + " WHERE " + " AND ".join(where), params)[0]
+        if len(self._count_cache) > 256:
+            self._count_cache.clear()
+        self._count_cache[key] = (now + self._count_cache_ttl, snapshot, total)
+        return total, None
+
+    def invalidate_counts(self):
+        """Olvidar los conteos filtrados (tras escribir en solicitudes desde este proceso)"""
+        self._count_cache.clear()
+
+
+def _comment_filters_sql(filters, conditions=COMMENT_FILTERS):
+    where, params = [], []
+    for name, value in (filters or {}).items():
+        where.append(conditions[name])
+        params.append(value)
+    return where, params
+
+
+# ========== MIGRACIONES ==========
+# Cada migración se aplica una sola vez y en orden; la versión aplicada se guarda
+# en PRAGMA user_version. Para cambiar el esquema, agregar una función nueva al
+# final de MIGRATIONS (nunca modificar una migración ya publicada).
+
+def _migration_001_base_schema(conn):
+    """Tabla solicitudes; incluye columnas agregadas antes del sistema de migraciones"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS solicitudes (
+        id TEXT PRIMARY KEY,
+        feature_id TEXT,
+        user TEXT,
+        email TEXT,
+        municipality TEXT,
+        entity TEXT,
+        text TEXT,
+        file_path TEXT,
+        created_at TEXT,
+        status TEXT DEFAULT 'new',
+        file_name TEXT
+    )''')
+
+    # Bases de datos creadas por versiones anteriores pueden no tener estas columnas
+    columns = [column[1] for column in conn.execute("PRAGMA table_info(solicitudes)").fetchall()]
+    for column, ddl in (
+        ('email', 'email TEXT'),
+        ('municipality', 'municipality TEXT'),
+        ('entity', 'entity TEXT'),
+        ('status', "status TEXT DEFAULT 'new'"),
+        ('file_name', 'file_name TEXT'),
+    ):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE solicitudes ADD COLUMN {ddl}')
+
+
+def _migration_002_solicitudes_indexes(conn):
+    """Índices (…, created_at, id) para paginación keyset y filtros del panel de admin,
+    (feature_id, status) para los contadores del mapa y contador por estado"""
+    # Normalizar estados nulos para que el filtro por estado pueda usar el índice
+    conn.execute("UPDATE solicitudes SET status = 'new' WHERE status IS NULL")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_solicitudes_created_id ON solicitudes(created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_solicitudes_status_created_id ON solicitudes(status, created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_solicitudes_municipality_created_id ON solicitudes(municipality, created_at, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_solicitudes_entity_created_id ON solicitudes(entity, created_at, id)')
+    # Sirve también para buscar por feature_id; los contadores por feature y estado
+    # se agrupan recorriendo el índice, sin ordenar
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_solicitudes_feature_status ON solicitudes(feature_id, status)')
+
+    # Contador por estado compartido entre workers; los triggers lo mantienen exacto
+    conn.execute('''CREATE TABLE IF NOT EXISTS solicitudes_counts (
+        status TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0
+    )''')
+    conn.execute('''INSERT OR REPLACE INTO solicitudes_counts (status, total)
+        SELECT COALESCE(status, 'new'), COUNT(*) FROM solicitudes GROUP BY COALESCE(status, 'new')''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_solicitudes_count_insert
+        AFTER INSERT ON solicitudes BEGIN
+            INSERT INTO solicitudes_counts (status, total) VALUES (COALESCE(NEW.status, 'new'), 1)
+            ON CONFLICT(status) DO UPDATE SET total = total + 1;
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_solicitudes_count_delete
+        AFTER DELETE ON solicitudes BEGIN
+            UPDATE solicitudes_counts SET total = total - 1 WHERE status = COALESCE(OLD.status, 'new');
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_solicitudes_count_status
+        AFTER UPDATE OF status ON solicitudes
+        WHEN COALESCE(OLD.status, 'new') <> COALESCE(NEW.status, 'new') BEGIN
+            UPDATE solicitudes_counts SET total = total - 1 WHERE status = COALESCE(OLD.status, 'new');
+            INSERT INTO solicitudes_counts (status, total) VALUES (COALESCE(NEW.status, 'new'), 1)
+            ON CONFLICT(status) DO UPDATE SET total = total + 1;
+        END''')
+    conn.execute('ANALYZE solicitudes')
+
+
+def _migration_003_feature_log(conn):
+    """Log append-only de features del mapa y leases de mantenimiento entre workers"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS feature_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        feature_uid TEXT,
+        feature TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS maintenance_leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )''')
+
+
+def _migration_004_scan_jobs(conn):
+    """Estado de los escaneos en segundo plano, visible desde todos los workers"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS scan_jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        stage TEXT,
+        progress INTEGER DEFAULT 0,
+        filename TEXT,
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_scan_jobs_created_at ON scan_jobs(created_at)')
+
+
+def _migration_005_scan_verdicts(conn):
+    """Caché de veredictos de escaneo por SHA-256, compartida entre workers"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS scan_verdicts (
+        sha256 TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        approved INTEGER NOT NULL,
+        result TEXT,
+        created_at REAL NOT NULL,
+        last_hit REAL NOT NULL,
+        hits INTEGER DEFAULT 0
+    )''')
+    # Expulsión LRU: los de last_hit más antiguo primero
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_scan_verdicts_last_hit ON scan_verdicts(last_hit)')
+
+
+def _migration_006_blob_store(conn):
+    """Blobs por SHA-256 con conteo de referencias desde solicitudes.file_path y cuarentena.
+
+    El nombre original del archivo vive en cada solicitud (file_name): el blob solo
+    guarda metadatos del contenido, que pueden compartir varios usuarios.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS blobs (
+        sha256 TEXT PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        size INTEGER NOT NULL,
+        content_type TEXT,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        stored_at REAL NOT NULL
+    )''')
+    # Recolección de huérfanos: solo se recorren los blobs sin referencias
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_orphans ON blobs(stored_at) WHERE refcount <= 0')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_blobs_ref_insert
+        AFTER INSERT ON solicitudes WHEN NEW.file_path <> '' BEGIN
+            UPDATE blobs SET refcount = refcount + 1 WHERE path = NEW.file_path;
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_blobs_ref_delete
+        AFTER DELETE ON solicitudes WHEN OLD.file_path <> '' BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE path = OLD.file_path;
+        END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_blobs_ref_update
+        AFTER UPDATE OF file_path ON solicitudes
+        WHEN COALESCE(OLD.file_path, '') <> COALESCE(NEW.file_path, '') BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE path = OLD.file_path;
+            UPDATE blobs SET refcount = refcount + 1 WHERE path = NEW.file_path;
+        END''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS quarantine_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sha256 TEXT NOT NULL,
+        filename TEXT,
+        size INTEGER,
+        reason TEXT,
+        source TEXT,
+        created_at REAL NOT NULL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_quarantine_files_created_at ON quarantine_files(created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_quarantine_files_sha256 ON quarantine_files(sha256)')
+
+
+MIGRATIONS = [
+    _migration_001_base_schema,
+    _migration_002_solicitudes_indexes,
+    _migration_003_feature_log,
+    _migration_004_scan_jobs,
+    _migration_005_scan_verdicts,
+    _migration_006_blob_store,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Aplicar las migraciones pendientes; seguro si varios workers arrancan a la vez"""
+    if schema_version(conn) >= len(MIGRATIONS):
+        return
+
+    # BEGIN IMMEDIATE toma el lock de escritura: el segundo worker espera y al
+    # entrar vuelve a leer la versión, que ya estará actualizada.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current = schema_version(conn)
+        for version, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            logging.info(f"Migración {version} aplicada: {migration.__doc__}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# ========== VERIFICACIÓN DEL PLAN DE CONSULTAS ==========
+# Consultas calientes de app.py con parámetros de ejemplo. Todas deben resolverse
+# con un índice: sin SCAN completo de la tabla y sin ordenar en un B-tree temporal.
+HOT_QUERIES = {
+    'comments_by_feature': (SQL_COMMENTS_BY_FEATURE, ('feat-001',)),
+    'comments_first_page': (SQL_COMMENTS_PAGE + " ORDER BY created_at DESC, id DESC LIMIT ?", (50,)),
+    'comments_next_page': (
+        SQL_COMMENTS_PAGE + " WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+        ('2025-01-01T00:00:00', 'abc', 50)
+    ),
+    'comments_by_status_page': (
+        SQL_COMMENTS_PAGE + " WHERE status = ? AND (created_at, id) < (?, ?)"
+        " ORDER BY created_at DESC, id DESC LIMIT ?",
+        ('new', '2025-01-01T00:00:00', 'abc', 50)
+    ),
+    'comments_by_municipality_page': (
+        SQL_COMMENTS_PAGE + " WHERE municipality = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+        ('San Juan', 50)
+    ),
+    'comments_by_entity_page': (
+        SQL_COMMENTS_PAGE + " WHERE entity = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+        ('Residente', 50)
+    ),
+    # Búsqueda parcial: sin índice posible, recorre (created_at, id) en orden hasta llenar la página
+    'comments_by_user_page': (
+        SQL_COMMENTS_PAGE + " WHERE " + COMMENT_FILTERS['user'] + " ORDER BY created_at DESC, id DESC LIMIT ?",
+        ('usuario1', 50)
+    ),
+    'comments_count_by_entity': (SQL_COMMENTS_COUNT + " WHERE " + COMMENT_FILTERS['entity'], ('Residente',)),
+    'comments_bbox_page': (
+        SQL_COMMENTS_PAGE + " WHERE " + SQL_FEATURE_IDS_IN_DATE_ORDER + " ORDER BY created_at DESC, id DESC LIMIT ?",
+        (json.dumps([f'feat-{i:03d}' for i in range(BBOX_SORT_MAX_FEATURES + 1)]), 50)
+    ),
+    'feature_status_counts': (
+        SQL_FEATURE_STATUS_COUNTS.format(where=" WHERE " + COMMENT_FILTERS['feature_ids']),
+        (json.dumps(['feat-001', 'feat-002']),)
+    ),
+    'feature_status_counts_all': (SQL_FEATURE_STATUS_COUNTS.format(where=''), ()),
+    'feature_log_tail': ("SELECT seq, feature FROM feature_log WHERE seq > ? ORDER BY seq", (0,)),
+    'comment_file': (SQL_COMMENT_FILE, ('abc',)),
+    'delete_comment': (SQL_DELETE_COMMENT, ('abc',)),
+    'scan_verdict': (
+        "SELECT approved, result, created_at, last_hit FROM scan_verdicts "
+        "WHERE sha256 = ? AND version = ? AND created_at > ?",
+        ('0' * 64, '1', 0.0)
+    ),
+    'scan_verdicts_lru': ("SELECT sha256 FROM scan_verdicts ORDER BY last_hit LIMIT ?", (100,)),
+    'blob_by_path': ("UPDATE blobs SET refcount = refcount + 1 WHERE path = ?", ('uploads/safe/00/00/' + '0' * 64,)),
+    'blob_orphans': ("SELECT sha256 FROM blobs WHERE refcount <= 0 AND stored_at < ?", (0.0,)),
+    'quarantine_expired': ("SELECT sha256 FROM quarantine_files WHERE created_at < ?", (0.0,)),
+}
+
+
+def explain(conn, sql, params=()):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def check_query_plans(conn):
+    """Devolver {nombre: plan} para las consultas calientes que no usan índice"""
+    problems = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = explain(conn, sql, params)
+        for detail in plan:
+            # Recorrer json_each es recorrer la lista de parámetros, no una tabla
+            full_scan = detail.startswith('SCAN') and 'USING' not in detail and 'VIRTUAL TABLE' not in detail
+            if full_scan or 'TEMP B-TREE' in detail:
+                problems[name] = plan
+                break
+    return problems
+
+
+def main():
+    """Uso: python db.py [migrate|check-plans] [ruta_db]"""
+    if len(sys.argv) < 2 or sys.argv[1] not in ('migrate', 'check-plans'):
+        print(main.__doc__)
+        sys.exit(1)
+
+    db_file = sys.argv[2] if len(sys.argv) > 2 else \
+        os.getenv('DATABASE_URL', 'database/solicitudes.db').replace('sqlite:///', '')
+    database = Database(db_file)
+    if not database.init_schema():
+        sys.exit(1)
+
+    with database.connection() as conn:
+        print(f"Esquema en versión {schema_version(conn)}")
+        if sys.argv[1] == 'check-plans':
+            for name, (sql, params) in HOT_QUERIES.items():
+                print(f"  {name}: {' | '.join(explain(conn, sql, params))}")
+            problems = check_query_plans(conn)
+            if problems:
+                print(f"❌ Consultas sin índice: {', '.join(problems)}")
+                sys.exit(1)
+            print("✅ Todas las consultas calientes usan índices")
+
+
+if __name__ == '__main__':
+    main()
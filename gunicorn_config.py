@@ -1,15 +1,69 @@
 """
 Configuración de Gunicorn para Render
+Workers gthread: cada proceso atiende varias peticiones a la vez con hilos. El
+trabajo lento (escaneos, PDFs, VirusTotal) corre fuera del hilo de la petición
+en los pools de la app, así que un hilo solo se ocupa mientras recibe o envía
+datos y el resto sigue sirviendo el mapa.
 """
 import os
 
+import metrics
+
 # Bind to PORT environment variable (Render provides this)
 bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
 
+
+def available_cpus():
+    """CPUs asignadas al proceso (respeta cpusets del contenedor)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
 # Worker configuration
-workers = 2
-worker_class = 'sync'
-timeout = 120
+# Cada worker tiene sus propios pools de escaneo y procesos del sandbox de PDF:
+# se limita el número de procesos y la concurrencia se obtiene con hilos
+cpus = available_cpus()
+workers = int(os.getenv('GUNICORN_WORKERS') or min(cpus + 1, int(os.getenv('GUNICORN_MAX_WORKERS', 4))))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+# Conexiones abiertas por worker (incluye keep-alive en espera)
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Con gthread el latido no depende de las peticiones en curso: solo detecta workers colgados
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+# Sin preload: los hilos de fondo (escaneos, compactación, recolección) arrancan en cada worker
+preload_app = False
+
+# El latido del worker en memoria y no en el disco del contenedor
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Una conexión SQLite en reposo por hilo, más las de los hilos de fondo
+os.environ.setdefault('DB_POOL_SIZE', str(threads + 4))
+
+# Métricas: cada worker vuelca las suyas en METRICS_DIR y /metrics las suma
+os.environ.setdefault('METRICS_DIR', os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else '/tmp', 'geoportal-metrics'))
+
+
+def on_starting(server):
+    """Los archivos de métricas de una ejecución anterior no se suman a esta"""
+    directory = os.environ['METRICS_DIR']
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(directory, name))
+
+
+def child_exit(server, worker):
+    """El archivo de métricas de un worker terminado pasa al acumulado (dead.json):
+    no se pierden sus contadores y un worker nuevo con el mismo PID no los pisa"""
+    try:
+        metrics.mark_process_dead(worker.pid, os.environ['METRICS_DIR'])
+    except Exception as e:
+        server.log.warning(f"No se pudieron archivar las métricas del worker {worker.pid}: {e}")
 
 # Logging
 accesslog = '-'
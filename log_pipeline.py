@@ -0,0 +1,276 @@
+"""
+Log Pipeline - Logging asíncrono y estructurado
+Los hilos de las peticiones solo encolan el registro (QueueHandler); un hilo
+QueueListener por proceso lo formatea y lo escribe en stderr y en un archivo
+JSON por líneas con rotación por tamaño. Los workers de gunicorn comparten el
+archivo: escritura y rotación van bajo un flock y cada proceso reabre el
+archivo si otro lo rotó.
+
+Los registros DEBUG se muestrean por punto de llamada (1 de cada N) para que
+el ruido de diagnóstico no sature la cola; si la cola se llena, los registros
+se descartan en lugar de bloquear la petición y se avisa cuántos se perdieron.
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    # Windows: sin flock, la rotación es segura con un solo proceso
+    FCNTL_AVAILABLE = False
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Atributos propios de LogRecord; el resto son campos de extra={...}
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'sampled'}
+
+
+class JSONFormatter(logging.Formatter):
+    """Un objeto JSON por línea con los campos de extra={...} del registro"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+            'where': f"{record.module}:{record.lineno}",
+        }
+        if getattr(record, 'sampled', 1) > 1:
+            entry['sampled'] = record.sampled
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar 1 de cada `every` registros por punto de llamada hasta `level`.
+
+    El registro que pasa lleva record.sampled = every para poder reescalar conteos.
+    """
+
+    def __init__(self, every=10, level=logging.DEBUG):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self.level = level
+        self._counts = {}
+
+    def filter(self, record):
+        if self.every == 1 or record.levelno > self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        # Sin lock: una carrera solo desplaza qué registro de la serie se conserva
+        count = self._counts.get(key, 0)
+        self._counts[key] = count + 1
+        if count % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta registros con la cola llena en lugar de esperar"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Mensaje resuelto en este hilo (los args pueden cambiar después), pero el
+        # formato final (texto o JSON) lo aplica cada handler del listener
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            try:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f"Cola de logs llena: {self.dropped} registros descartados", 'dropped': self.dropped
+                }))
+                self.dropped = 0
+            except queue.Full:
+                pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ProcessSafeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler que varios procesos pueden compartir.
+
+    Cada escritura toma un flock sobre <archivo>.lock, reabre el archivo si otro
+    proceso lo rotó y rota si la escritura superaría maxBytes.
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding='utf-8'):
+        super().__init__(filename, mode='a', maxBytes=maxBytes, backupCount=backupCount, encoding=encoding)
+        self._lock_file = open(self.baseFilename + '.lock', 'a') if FCNTL_AVAILABLE else None
+        self._pid = os.getpid()
+
+    def _after_fork(self):
+        # Un flock pertenece al descriptor abierto, que el hijo comparte con el padre
+        # tras un fork: sin uno propio ambos "tendrían" el lock a la vez
+        self._pid = os.getpid()
+        self._lock_file.close()
+        self._lock_file = open(self.baseFilename + '.lock', 'a')
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = self._open()
+
+    @contextmanager
+    def _interprocess_lock(self):
+        if self._lock_file is None:
+            yield
+            return
+        if self._pid != os.getpid():
+            self._after_fork()
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            self.stream = self._open()
+            return
+        try:
+            current = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self.stream.fileno()).st_ino:
+            self.stream.close()
+            self.stream = self._open()
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            with self._interprocess_lock():
+                self._reopen_if_rotated()
+                self.stream.seek(0, os.SEEK_END)
+                if self.maxBytes and self.stream.tell() + len(msg.encode(self.encoding or 'utf-8')) > self.maxBytes:
+                    self.doRollover()
+                self.stream.write(msg)
+                self.stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        super().close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class LogPipeline:
+    """QueueHandler en el logger raíz + QueueListener con los handlers reales"""
+
+    def __init__(self, handlers, level=logging.INFO, queue_size=10000, debug_sample=10):
+        self.handlers = handlers
+        self.level = level
+        self.queue_size = queue_size
+        self.sampler = SamplingFilter(debug_sample)
+        self.queue_handler = None
+        self.listener = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            log_queue = queue.Queue(maxsize=self.queue_size)
+            queue_handler = NonBlockingQueueHandler(log_queue)
+            queue_handler.addFilter(self.sampler)
+
+            root = logging.getLogger()
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            root.addHandler(queue_handler)
+            root.setLevel(self.level)
+
+            self.listener = logging.handlers.QueueListener(log_queue, *self.handlers, respect_handler_level=True)
+            self.listener.start()
+            self.queue_handler = queue_handler
+        return self
+
+    def stop(self):
+        """Vaciar la cola y detener el listener (al salir del proceso)"""
+        with self._lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+
+    def _after_fork(self):
+        # El hilo del listener no sobrevive al fork: el hijo arranca el suyo con una cola nueva
+        self._lock = threading.Lock()
+        self.listener = None
+        self.start()
+
+
+_pipeline = None
+
+
+def setup_logging(log_file=None, level=None, stream_format=None):
+    """Configurar el pipeline de logging del proceso (idempotente).
+
+    log_file recibe JSON por líneas (LOG_FILE, por defecto logs/security.log);
+    stderr usa texto o JSON según LOG_FORMAT. Devuelve el LogPipeline.
+    """
+    global _pipeline
+    if _pipeline is not None:
+        return _pipeline
+
+    level = level or os.getenv('LOG_LEVEL', 'INFO').upper()
+    log_file = log_file or os.getenv('LOG_FILE', 'logs/security.log')
+    stream_format = stream_format or os.getenv('LOG_FORMAT', 'text')
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JSONFormatter() if stream_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    handlers = [stream_handler]
+
+    try:
+        if os.path.dirname(log_file):
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        file_handler = ProcessSafeRotatingFileHandler(
+            log_file,
+            maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+            backupCount=int(os.getenv('LOG_BACKUP_COUNT', 5))
+        )
+        file_handler.setFormatter(JSONFormatter())
+        handlers.append(file_handler)
+    except OSError as e:
+        sys.stderr.write(f"No se pudo abrir el archivo de logs {log_file}: {e}\n")
+
+    _pipeline = LogPipeline(
+        handlers,
+        level=level,
+        queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+        debug_sample=int(os.getenv('LOG_DEBUG_SAMPLE', 10))
+    ).start()
+    atexit.register(_pipeline.stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_pipeline._after_fork)
+    return _pipeline
@@ -0,0 +1,305 @@
+"""
+Metrics - Métricas en formato Prometheus compartidas entre workers
+Cada proceso acumula contadores e histogramas en memoria (sin E/S en la
+petición) y un hilo los vuelca cada METRICS_FLUSH_INTERVAL segundos a
+METRICS_DIR/<pid>.json con escritura atómica. /metrics suma los archivos de
+todos los procesos. Cuando un worker termina, el master de gunicorn suma su
+archivo a dead.json y lo borra (mark_process_dead): los contadores no
+retroceden al reiniciar un worker y un PID reutilizado empieza de cero.
+
+Sin METRICS_DIR cada proceso solo reporta sus propios valores.
+"""
+
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+DEAD_FILE = 'dead.json'      # Totales acumulados de los procesos que ya terminaron
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, help, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}       # tupla de valores de etiquetas -> valor
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}, recibió {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            self.registry._dirty = True
+
+    def set_total(self, value, **labels):
+        """Fijar el total acumulado del proceso (para collectors que leen contadores propios)"""
+        key = self._key(labels)
+        with self.registry._lock:
+            if self._values.get(key) != value:
+                self._values[key] = value
+                self.registry._dirty = True
+
+    @staticmethod
+    def merge(current, value):
+        return (current or 0) + value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Conteos por bucket sin acumular (el último es +Inf) y la suma al final
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+            self.registry._dirty = True
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def merge(current, value):
+        if current is None:
+            return list(value)
+        return [a + b for a, b in zip(current, value)]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.directory = None
+        self.flush_interval = 5.0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if existing.kind != metric.kind or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Métrica {metric.name} ya registrada con otra definición")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def collector(self, fn):
+        """fn() se llama antes de cada volcado o lectura (p. ej. para copiar hits/misses de una caché)"""
+        self.collectors.append(fn)
+        return fn
+
+    # ========== MULTIPROCESO ==========
+
+    def configure(self, directory=None, flush_interval=5.0):
+        """Activar el volcado a directory/<pid>.json para sumar entre procesos"""
+        self.flush_interval = flush_interval
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._start_flusher()
+        atexit.register(self.flush)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_flusher(self):
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    if self._dirty:
+                        self.flush()
+                except Exception as e:
+                    logging.warning(f"No se pudieron volcar las métricas: {e}")
+
+        self._flusher = threading.Thread(target=run, name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def _after_fork(self):
+        # Los valores heredados son del padre (ya están en su archivo): el hijo empieza en cero
+        self._lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric._values = {}
+        self._dirty = False
+        if self.directory:
+            self._start_flusher()
+
+    def _run_collectors(self):
+        for fn in self.collectors:
+            try:
+                fn()
+            except Exception as e:
+                logging.warning(f"Error en collector de métricas {getattr(fn, '__name__', fn)}: {e}")
+
+    def snapshot(self):
+        """{nombre: [[etiquetas, valor], ...]} de este proceso"""
+        self._run_collectors()
+        with self._lock:
+            self._dirty = False
+            return {
+                name: [[list(key), value if metric.kind == 'counter' else list(value)]
+                       for key, value in metric._values.items()]
+                for name, metric in self.metrics.items()
+            }
+
+    def flush(self):
+        if not self.directory:
+            return
+        data = {'pid': os.getpid(), 'written_at': time.time(), 'metrics': self.snapshot()}
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """{nombre: {etiquetas: valor}} sumado entre todos los procesos"""
+        if not self.directory:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                        snapshots.append(json.load(f)['metrics'])
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning(f"Archivo de métricas ilegible {name}: {e}")
+
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                values = merged[name]
+                for labels, value in series:
+                    key = tuple(labels)
+                    values[key] = metric.merge(values.get(key), value)
+        return merged
+
+    # ========== FORMATO ==========
+
+    def render(self):
+        """Texto en el formato de exposición de Prometheus"""
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key in sorted(values):
+                labels = list(zip(metric.labelnames, key))
+                value = values[key]
+                if metric.kind == 'counter':
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def mark_process_dead(pid, directory):
+    """Sumar directory/<pid>.json de un proceso terminado a dead.json y borrarlo.
+
+    Lo llama solo el master de gunicorn (child_exit), así que dead.json tiene un
+    único escritor.
+    """
+    path = os.path.join(directory, f"{pid}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            finished = json.load(f)['metrics']
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Archivo de métricas ilegible del proceso {pid}: {e}")
+        os.remove(path)
+        return
+
+    dead_path = os.path.join(directory, DEAD_FILE)
+    try:
+        with open(dead_path, 'r', encoding='utf-8') as f:
+            totals = json.load(f)['metrics']
+    except (OSError, ValueError, KeyError):
+        totals = {}
+
+    for name, series in finished.items():
+        values = {tuple(labels): value for labels, value in totals.get(name, [])}
+        for labels, value in series:
+            key = tuple(labels)
+            # Los histogramas se guardan como lista (buckets + suma), los contadores como número
+            merge = Histogram.merge if isinstance(value, list) else Counter.merge
+            values[key] = merge(values.get(key), value)
+        totals[name] = [[list(key), value] for key, value in values.items()]
+
+    tmp_path = f"{dead_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'pid': None, 'written_at': time.time(), 'metrics': totals}, f, separators=(',', ':'))
+    # Primero el acumulado y después el borrado: un /metrics intermedio cuenta de más, nunca de menos
+    os.replace(tmp_path, dead_path)
+    os.remove(path)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+# Registro por defecto del proceso
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+collector = REGISTRY.collector
@@ -0,0 +1,310 @@
+"""
+PDF Validator - Validación de PDFs en una sola pasada
+El PDF se parsea una vez con PyPDF2 y el texto se extrae página por página
+solo hasta alcanzar el mínimo exigido; el número de páginas revisadas y el
+tiempo por documento están acotados.
+
+PDFSandbox ejecuta la validación en procesos aparte con límites de memoria y
+CPU: un PDF malicioso mata su proceso, no al worker de gunicorn ni a las demás
+validaciones en curso. Los procesos ejecutan este mismo archivo como script
+(`python pdf_validator.py`), que no tiene efectos al importarse: nunca se
+vuelve a importar app.py en el hijo, aunque el servidor se lance con `python app.py`.
+"""
+
+import io
+import os
+import sys
+import time
+import pickle
+import logging
+import threading
+import subprocess
+
+import PyPDF2
+
+# resource solo existe en Unix: en otros sistemas el sandbox funciona sin límites
+try:
+    import resource
+    RESOURCE_LIMITS_AVAILABLE = True
+except ImportError:
+    RESOURCE_LIMITS_AVAILABLE = False
+
+EOF_CHUNK_BYTES = 65536     # %%EOF se busca desde el final, por bloques
+
+
+class PDFValidator:
+    def __init__(self, min_chars=10, min_words=3, max_pages=50, time_budget=5.0):
+        """max_pages y time_budget limitan el trabajo por documento; el tiempo
+        se comprueba entre páginas (una página no se interrumpe a medias)."""
+        self.min_chars = min_chars
+        self.min_words = min_words
+        self.max_pages = max_pages
+        self.time_budget = time_budget
+
+    def validate(self, stream):
+        """(válido, mensaje, estadísticas) para un stream binario con posición 0"""
+        started = time.perf_counter()
+        stats = {'pages': 0, 'pages_scanned': 0, 'chars': 0, 'words': 0, 'elapsed': 0.0, 'early_stop': False,
+                 'parse_elapsed': 0.0, 'text_elapsed': 0.0}
+        text_started = None
+
+        def finish(valid, message):
+            now = time.perf_counter()
+            stats['elapsed'] = round(now - started, 4)
+            if text_started is not None:
+                stats['text_elapsed'] = round(now - text_started, 4)
+            return valid, message, stats
+
+        # 1. Cabecera y marcador de fin sin cargar el archivo completo en memoria
+        stream.seek(0)
+        if not stream.read(5).startswith(b'%PDF-'):
+            return finish(False, "🚫 NO ES UN PDF VÁLIDO: Falta cabecera %PDF-")
+        if not _has_eof_marker(stream):
+            return finish(False, "🚫 PDF CORRUPTO: Falta marcador de fin de archivo")
+        stream.seek(0)
+
+        # 2. Estructura: un solo parseo, las páginas se cargan bajo demanda
+        parse_started = time.perf_counter()
+        try:
+            reader = PyPDF2.PdfReader(stream)
+            stats['pages'] = len(reader.pages)
+        except Exception as e:
+            return finish(False, f"🚫 PDF INVÁLIDO: Error de estructura - {str(e)}")
+        finally:
+            stats['parse_elapsed'] = round(time.perf_counter() - parse_started, 4)
+        if stats['pages'] == 0:
+            return finish(False, "🚫 PDF VACÍO: No contiene páginas")
+
+        # 3. Texto extraíble: parar en cuanto se alcanza el mínimo
+        text_started = time.perf_counter()
+        try:
+            for page in reader.pages:
+                if stats['pages_scanned'] >= self.max_pages:
+                    break
+                if time.perf_counter() - started > self.time_budget:
+                    logging.warning(f"Validación PDF: presupuesto de {self.time_budget}s agotado "
+                                    f"tras {stats['pages_scanned']} páginas")
+                    break
+                stats['pages_scanned'] += 1
+                text = (page.extract_text() or '').strip()
+                if text:
+                    stats['chars'] += len(text)
+                    stats['words'] += len(text.split())
+                if stats['chars'] >= self.min_chars and stats['words'] >= self.min_words:
+                    stats['early_stop'] = stats['pages_scanned'] < stats['pages']
+                    return finish(True, f"✅ PDF válido con {stats['words']} palabras de texto")
+        except Exception as e:
+            return finish(False, f"🚫 ERROR EXTRAYENDO TEXTO: {str(e)} - Verifique que es un PDF válido")
+
+        if stats['chars'] < self.min_chars:
+            return finish(False, "🚫 PDF SIN TEXTO: Solo acepta documentos con texto, no imágenes escaneadas")
+        return finish(False, f"🚫 PDF INSUFICIENTE: Debe contener al menos {self.min_words} palabras de texto")
+
+
+def _has_eof_marker(stream):
+    """%%EOF en cualquier parte del archivo (como PyPDF2), leyendo desde el final:
+    en un PDF normal basta el último bloque"""
+    # mmap.seek devuelve None (IngestedUpload.view): la posición se lee con tell()
+    stream.seek(0, 2)
+    end = stream.tell()
+    tail = b''
+    while end > 0:
+        start = max(0, end - EOF_CHUNK_BYTES)
+        stream.seek(start)
+        # Se conservan 4 bytes del bloque siguiente por si el marcador queda partido
+        chunk = stream.read(end - start) + tail[:4]
+        if b'%%EOF' in chunk:
+            return True
+        tail = chunk
+        end = start
+    return False
+
+
+class SandboxBusyError(Exception):
+    """Todos los procesos de validación están ocupados y la cola está llena"""
+
+
+class SandboxTimeoutError(Exception):
+    """La validación superó el tiempo máximo y su proceso fue terminado"""
+
+
+def _limit_process(max_memory_mb):
+    """Al arrancar cada proceso de validación: tope de memoria virtual"""
+    if RESOURCE_LIMITS_AVAILABLE and max_memory_mb:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _validate_in_sandbox(source, settings, max_cpu_seconds):
+    """Tarea del proceso de validación: source es una ruta o los bytes del PDF"""
+    if RESOURCE_LIMITS_AVAILABLE and max_cpu_seconds:
+        # RLIMIT_CPU es acumulado por proceso: el límite blando se mueve en cada job
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (int(usage.ru_utime + usage.ru_stime) + max_cpu_seconds, hard))
+
+    validator = PDFValidator(**settings)
+    stream = io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+    with stream:
+        return validator.validate(stream)
+
+
+def _serve(max_memory_mb):
+    """Bucle del proceso de validación: tareas por stdin y respuestas por stdout (pickle)"""
+    tasks, responses = sys.stdin.buffer, sys.stdout.buffer
+    sys.stdout = sys.stderr     # Nada más puede escribir en el canal de respuestas
+    _limit_process(max_memory_mb)
+    while True:
+        try:
+            source, settings, max_cpu_seconds = pickle.load(tasks)
+        except EOFError:
+            return
+        try:
+            response = ('ok', _validate_in_sandbox(source, settings, max_cpu_seconds))
+        except MemoryError:
+            response = ('limit', None)
+        except Exception as e:
+            response = ('error', f"{type(e).__name__}: {e}")
+        pickle.dump(response, responses)
+        responses.flush()
+
+
+class _SandboxProcess:
+    """Un proceso de validación; se mata solo a él si su tarea se pasa de tiempo"""
+
+    def __init__(self, max_memory_mb):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(max_memory_mb or 0)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        self.tasks = 0
+        self.timed_out = False
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, task, timeout):
+        """Respuesta de la tarea o None si el proceso murió (timed_out indica si lo mató el plazo)"""
+        self.tasks += 1
+        watchdog = threading.Timer(timeout, self._expire)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            pickle.dump(task, self.process.stdin)
+            self.process.stdin.flush()
+            return pickle.load(self.process.stdout)
+        except (EOFError, pickle.UnpicklingError):
+            return None
+        finally:
+            watchdog.cancel()
+
+    def _expire(self):
+        self.timed_out = True
+        self.process.kill()
+
+    def close(self):
+        if self.alive():
+            # Sin más tareas (EOF en stdin) el proceso termina solo
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=1)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        if self.process.returncode is None:
+            self.process.wait()
+
+
+class PDFSandbox:
+    def __init__(self, validator, max_workers=2, max_pending=8, timeout=15.0, queue_wait=5.0,
+                 max_tasks_per_child=50, max_memory_mb=512, max_cpu_seconds=10):
+        """max_pending acota las validaciones en curso + en espera por worker web;
+        cada proceso se recicla tras max_tasks_per_child validaciones. timeout se
+        cuenta desde que un proceso toma la validación, sin la espera en cola."""
+        self.settings = {
+            'min_chars': validator.min_chars,
+            'min_words': validator.min_words,
+            'max_pages': validator.max_pages,
+            'time_budget': validator.time_budget,
+        }
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.queue_wait = queue_wait
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_memory_mb = max_memory_mb
+        self.max_cpu_seconds = max_cpu_seconds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._workers = threading.BoundedSemaphore(max_workers)
+        self._idle = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        """Un proceso libre o uno nuevo (se lanzan en el primer uso: uno por worker de gunicorn)"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Los procesos del padre no son nuestros tras un fork
+                self._pid = os.getpid()
+                self._idle = []
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.close()
+        return _SandboxProcess(self.max_memory_mb)
+
+    def _checkin(self, worker):
+        if worker.tasks >= self.max_tasks_per_child or not worker.alive():
+            worker.close()
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    def validate(self, source):
+        """(válido, mensaje, estadísticas) validando en un proceso aparte; source es ruta o bytes.
+
+        Lanza SandboxBusyError o SandboxTimeoutError cuando el rechazo se debe a
+        la carga del servidor y no al contenido del archivo.
+        """
+        if not self._slots.acquire(timeout=self.queue_wait):
+            raise SandboxBusyError(f"{self.max_workers} procesos de validación ocupados")
+        try:
+            with self._workers:
+                # Un proceso libre puede haber muerto sin que se note hasta escribirle:
+                # en ese caso se reintenta una vez con uno nuevo
+                for attempt in range(2):
+                    worker = None
+                    try:
+                        worker = self._checkout()
+                        response = worker.run((source, self.settings, self.max_cpu_seconds), self.timeout)
+                    except OSError as e:
+                        logging.warning(f"Proceso de validación de PDF no disponible (intento {attempt + 1}): {e}")
+                        if worker is not None:
+                            worker.close()
+                        continue
+                    if response is None:
+                        worker.close()
+                        if worker.timed_out:
+                            raise SandboxTimeoutError(f"Validación de PDF cancelada tras {self.timeout}s")
+                        logging.warning("Proceso de validación de PDF terminado por sus límites")
+                        break
+                    self._checkin(worker)
+                    status, value = response
+                    if status == 'ok':
+                        return value
+                    if status == 'limit':
+                        break
+                    raise RuntimeError(value)
+            stats = {'pages': 0, 'pages_scanned': 0, 'chars': 0, 'words': 0, 'elapsed': 0.0,
+                     'early_stop': False, 'killed': True}
+            return False, "🚫 PDF DEMASIADO COMPLEJO: Excede los límites de memoria o CPU permitidos", stats
+        finally:
+            self._slots.release()
+
+
+if __name__ == '__main__':
+    _serve(int(sys.argv[1]))
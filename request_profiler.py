@@ -0,0 +1,263 @@
+"""
+Request Profiler - Perfilado por muestreo de peticiones y jobs de escaneo
+Un hilo por proceso toma muestras de la pila (sys._current_frames) de los hilos
+que se están perfilando cada `interval` segundos; el código perfilado no se
+instrumenta, así que el costo es el mismo con una petición perfilada o con
+diez. Cada perfil se guarda como pilas colapsadas ("a;b;c N", el formato de
+flamegraph.pl y speedscope) más un .json con sus metadatos, en un anillo
+acotado de archivos compartido por los workers.
+
+Perfiles que se inician:
+- Con PROFILING_ENABLED, las rutas de PROFILING_ROUTES y los jobs de escaneo,
+  con un tope por minuto; solo se guardan los que superan PROFILING_MIN_MS.
+- Con la cabecera X-Profile de un administrador: siempre se guardan.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+MAX_DEPTH = 128
+
+
+def collapse(frame):
+    """Pila del frame como 'raíz;...;hoja' con función (archivo:línea de definición)"""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(name.replace(';', ':') for name in names)
+
+
+class Profile:
+    __slots__ = ('id', 'kind', 'name', 'detail', 'forced', 'thread_id', 'started', 'started_at', 'stacks', 'samples')
+
+    def __init__(self, kind, name, detail=None, forced=False):
+        self.id = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+        self.kind = kind                # 'request' o 'task'
+        self.name = name                # ruta (regla) o nombre del job
+        self.detail = detail or {}
+        self.forced = forced
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.stacks = Counter()
+        self.samples = 0
+
+
+class StackSampler:
+    """Hilo que muestrea las pilas de los hilos registrados"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self._targets[profile.thread_id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, profile):
+        with self._lock:
+            if self._targets.get(profile.thread_id) is profile:
+                del self._targets[profile.thread_id]
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                targets = list(self._targets.values())
+                if not targets:
+                    self._wake.clear()
+            if not targets:
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            for profile in targets:
+                frame = frames.get(profile.thread_id)
+                if frame is not None and profile.thread_id != own:
+                    profile.stacks[collapse(frame)] += 1
+                    profile.samples += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class ProfileRing:
+    """Perfiles en disco: <id>.folded + <id>.json, como mucho max_profiles (se borran los más viejos)"""
+
+    def __init__(self, directory, max_profiles=200):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, profile_id, extension):
+        # Los ids son '<ms>-<hex>': cualquier otra cosa no es un perfil
+        if not profile_id or any(c not in '0123456789abcdef-' for c in profile_id):
+            raise ValueError(f"Id de perfil inválido: {profile_id!r}")
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def save(self, profile, meta):
+        folded = ''.join(f"{stack} {count}\n" for stack, count in profile.stacks.most_common())
+        for extension, content in (('folded', folded), ('json', json.dumps(meta, ensure_ascii=False))):
+            path = self._path(profile.id, extension)
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+        self._trim()
+
+    def _trim(self):
+        # Los ids empiezan con el timestamp: el orden por nombre es el orden de llegada
+        ids = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for profile_id in ids[:max(0, len(ids) - self.max_profiles)]:
+            for extension in ('json', 'folded'):
+                try:
+                    os.remove(self._path(profile_id, extension))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        """Metadatos de los perfiles guardados"""
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                # Borrado por otro worker mientras se listaba
+                continue
+        return profiles
+
+    def folded(self, profile_id):
+        """Contenido de las pilas colapsadas, o None si el perfil ya no existe"""
+        try:
+            with open(self._path(profile_id, 'folded'), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def meta(self, profile_id):
+        try:
+            with open(self._path(profile_id, 'json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+class RequestProfiler:
+    def __init__(self, directory, enabled=False, routes=(), min_duration=0.2, max_per_minute=30,
+                 max_concurrent=4, interval=0.005, max_profiles=200):
+        self.enabled = enabled
+        self.routes = frozenset(routes)
+        self.min_duration = min_duration
+        self.max_per_minute = max_per_minute
+        self.max_concurrent = max_concurrent
+        self.ring = ProfileRing(directory, max_profiles)
+        self.sampler = StackSampler(interval)
+        self._lock = threading.Lock()
+        self._window = (0, 0)           # (minuto, perfiles iniciados en ese minuto)
+        self._active = 0
+
+    def _admit(self, forced):
+        """Respetar el tope por minuto y de perfiles simultáneos (los forzados solo el simultáneo)"""
+        minute = int(time.time() // 60)
+        with self._lock:
+            if self._active >= self.max_concurrent:
+                return False
+            window_minute, started = self._window
+            if window_minute != minute:
+                started = 0
+            if not forced and started >= self.max_per_minute:
+                return False
+            self._window = (minute, started + 1)
+            self._active += 1
+            return True
+
+    def start(self, kind, name, detail=None, forced=False):
+        """Profile en curso para el hilo actual, o None si no corresponde perfilar"""
+        if not forced and not (self.enabled and (kind == 'task' or name in self.routes)):
+            return None
+        if not self._admit(forced):
+            return None
+        profile = Profile(kind, name, detail, forced)
+        self.sampler.add(profile)
+        return profile
+
+    def finish(self, profile, **extra):
+        """Detener el muestreo y guardar el perfil si es forzado o superó min_duration"""
+        if profile is None:
+            return None
+        self.sampler.remove(profile)
+        with self._lock:
+            self._active -= 1
+        duration = time.perf_counter() - profile.started
+        if not profile.forced and duration < self.min_duration:
+            return None
+
+        meta = dict(
+            profile.detail,
+            id=profile.id,
+            kind=profile.kind,
+            name=profile.name,
+            forced=profile.forced,
+            duration_ms=round(duration * 1000, 1),
+            samples=profile.samples,
+            started_at=profile.started_at,
+            pid=os.getpid(),
+            **extra
+        )
+        try:
+            self.ring.save(profile, meta)
+        except OSError as e:
+            logging.warning(f"No se pudo guardar el perfil {profile.id}: {e}")
+            return None
+        logging.info(f"🔥 Perfil {profile.id} guardado: {profile.name} en {meta['duration_ms']} ms ({profile.samples} muestras)")
+        return meta
+
+    @contextmanager
+    def task(self, name, forced=False, **detail):
+        """Perfilar un bloque fuera de una petición (p. ej. un job de escaneo)"""
+        profile = self.start('task', name, detail, forced)
+        try:
+            yield profile
+        finally:
+            self.finish(profile)
+
+    def slowest(self, limit=50, name=None):
+        """Perfiles guardados de mayor a menor duración"""
+        profiles = [p for p in self.ring.list() if name is None or p.get('name') == name]
+        profiles.sort(key=lambda p: p.get('duration_ms', 0), reverse=True)
+        return profiles[:limit]
+
+
+def top_functions(folded, limit=25):
+    """[(función, muestras propias, muestras totales)] a partir de pilas colapsadas"""
+    own = Counter()
+    total = Counter()
+    samples = 0
+    for line in folded.splitlines():
+        stack, _, count = line.rpartition(' ')
+        if not stack:
+            continue
+        count = int(count)
+        samples += count
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return samples, [(frame, count, total[frame]) for frame, count in own.most_common(limit)]
@@ -0,0 +1,185 @@
+"""
+Scan Jobs - Cola de escaneos en segundo plano
+/scan-file encola el archivo y responde de inmediato con un job id; un pool de
+hilos ejecuta la validación y va guardando etapa y progreso en SQLite, de modo
+que /scan-status/<id> responde desde cualquier worker de gunicorn.
+Un runner puede devolver un Deferred (p. ej. veredicto de VirusTotal en curso):
+el job sigue en su etapa sin ocupar un hilo y termina cuando llega el resultado.
+"""
+
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SQL_INSERT_JOB = (
+    "INSERT INTO scan_jobs (id, status, stage, progress, filename, created_at, updated_at) "
+    "VALUES (?, 'queued', 'queued', 0, ?, ?, ?)"
+)
+SQL_UPDATE_PROGRESS = "UPDATE scan_jobs SET status = 'running', stage = ?, progress = ?, updated_at = ? WHERE id = ?"
+SQL_FINISH_JOB = (
+    "UPDATE scan_jobs SET status = ?, stage = 'done', progress = 100, result = ?, error = ?, updated_at = ? "
+    "WHERE id = ?"
+)
+SQL_GET_JOB = (
+    "SELECT id, status, stage, progress, filename, result, error, created_at, updated_at "
+    "FROM scan_jobs WHERE id = ?"
+)
+SQL_CONSUME_JOB = "UPDATE scan_jobs SET status = 'consumed', updated_at = ? WHERE id = ? AND status = 'approved'"
+SQL_PURGE_JOBS = "DELETE FROM scan_jobs WHERE created_at < ?"
+
+
+class QueueFullError(Exception):
+    """No hay capacidad para encolar más escaneos en este worker"""
+
+
+class Deferred:
+    """Resultado pendiente: resume(valor del future) -> (aprobado, resultado).
+
+    future es un concurrent.futures.Future; stage es la etapa que muestra el job
+    mientras espera.
+    """
+
+    def __init__(self, future, resume, stage='pending'):
+        self.future = future
+        self.resume = resume
+        self.stage = stage
+
+    def then(self, fn):
+        """Nuevo Deferred que aplica fn(aprobado, resultado) al resultado de este"""
+        return Deferred(self.future, lambda value: fn(*self.resume(value)), self.stage)
+
+
+class ScanJobQueue:
+    def __init__(self, database, runner, max_workers=2, max_pending=20, job_ttl=24 * 3600, stale_after=600):
+        """runner(job, progress) -> (aprobado, resultado) o Deferred se ejecuta en un hilo del pool"""
+        self.database = database
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self.stale_after = stale_after
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _get_executor(self):
+        # Se crea en el primer uso: así cada worker de gunicorn tiene su propio pool
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='scan-job')
+        return self._executor
+
+    def submit(self, filename, **job):
+        """Encolar un escaneo; devuelve el job id o lanza QueueFullError"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f"{self._pending} escaneos pendientes")
+            self._pending += 1
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            self.database.execute(SQL_INSERT_JOB, (job_id, filename, now, now))
+            job.update(id=job_id, filename=filename, queued_at=now)
+            self._get_executor().submit(self._run, job)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+        self._purge_old(now)
+        return job_id
+
+    def _run(self, job):
+        job_id = job['id']
+
+        def progress(stage, percent):
+            self.database.execute(SQL_UPDATE_PROGRESS, (stage, int(percent), time.time(), job_id))
+
+        try:
+            outcome = self.runner(job, progress)
+            if isinstance(outcome, Deferred):
+                progress(outcome.stage, 80)
+                logging.info(f"Escaneo {job_id} en espera: {outcome.stage}")
+                self.when_ready(outcome, lambda approved, result: self._finish(job_id, approved, result),
+                                lambda e: self._fail(job_id, e))
+            else:
+                self._finish(job_id, *outcome)
+        except Exception as e:
+            self._fail(job_id, e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _finish(self, job_id, approved, result):
+        status = 'approved' if approved else 'rejected'
+        self.database.execute(SQL_FINISH_JOB, (status, json.dumps(result, default=str), None, time.time(), job_id))
+        logging.info(f"Escaneo {job_id} terminado: {status}")
+
+    def _fail(self, job_id, error):
+        logging.error(f"Error en escaneo {job_id}: {error}")
+        self.database.execute(SQL_FINISH_JOB, ('error', None, str(error), time.time(), job_id))
+
+    def when_ready(self, deferred, callback=None, on_error=None):
+        """Ejecutar deferred.resume en un hilo del pool cuando termine su future.
+
+        callback(aprobado, resultado) recibe lo que devuelve; on_error(excepción)
+        se llama si falla.
+        """
+        def resume(future):
+            try:
+                approved, result = deferred.resume(future.result())
+                if callback:
+                    callback(approved, result)
+            except Exception as e:
+                if on_error:
+                    on_error(e)
+                else:
+                    logging.error(f"Error completando resultado diferido: {e}")
+
+        # El future puede completarse en otro hilo (p. ej. el event loop de VirusTotal):
+        # ahí solo se encola la continuación
+        deferred.future.add_done_callback(lambda future: self._get_executor().submit(resume, future))
+
+    def get(self, job_id):
+        """Estado del job como dict, o None si no existe"""
+        row = self.database.fetch_one(SQL_GET_JOB, (job_id,))
+        if row is None:
+            return None
+
+        job = {
+            "job_id": row[0],
+            "status": row[1],
+            "stage": row[2],
+            "progress": row[3],
+            "filename": row[4],
+            "result": json.loads(row[5]) if row[5] else None,
+            "error": row[6],
+        }
+        # Un job que no avanza (p. ej. el worker que lo ejecutaba se reinició) se da por fallido
+        if job['status'] in ('queued', 'running') and time.time() - row[8] > self.stale_after:
+            job['status'] = 'error'
+            job['error'] = 'El escaneo no respondió a tiempo'
+        return job
+
+    def consume(self, job_id, conn=None):
+        """Marcar un job aprobado como usado; False si no existe, no está aprobado o ya se usó.
+
+        Con conn el UPDATE va en la transacción de quien llama (p. ej. junto al
+        INSERT de la solicitud que usa el archivo).
+        """
+        if conn is not None:
+            return conn.execute(SQL_CONSUME_JOB, (time.time(), job_id)).rowcount == 1
+        return self.database.execute(SQL_CONSUME_JOB, (time.time(), job_id)) == 1
+
+    def _purge_old(self, now):
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        try:
+            self.database.execute(SQL_PURGE_JOBS, (now - self.job_ttl,))
+        except Exception as e:
+            logging.warning(f"No se pudieron purgar jobs de escaneo antiguos: {e}")
@@ -819,25 +819,20 @@ async function handleFormSubmission() {
         return;
       }
       
-      updateSecurityStep('step-upload', 'completed', '✅');
+      // Pasos 2-4: el escaneo corre en el servidor; consultar su estado real
+      const job = await pollScanJob(scanResult.status_url);
       
-      // Paso 2: Escaneo ClamAV
-      updateSecurityStep('step-clamav', 'active', '🔄');
-      await new Promise(resolve => setTimeout(resolve, 1500));
-      updateSecurityStep('step-clamav', 'completed', '✅');
-      
-      // Paso 3: Verificación VirusTotal
-      updateSecurityStep('step-virustotal', 'active', '🔄');
-      await new Promise(resolve => setTimeout(resolve, 2000));
-      updateSecurityStep('step-virustotal', 'completed', '✅');
-      
-      // Paso 4: Validación final
-      updateSecurityStep('step-final', 'active', '🔄');
-      await new Promise(resolve => setTimeout(resolve, 1000));
-      updateSecurityStep('step-final', 'completed', '✅');
+      if (job.status !== 'approved') {
+        const failedStep = SCAN_STAGE_STEPS[job.stage] || 'step-final';
+        updateSecurityStep(failedStep, 'error', '❌');
+        showNotification(job.error || 'Archivo rechazado por el escaneo de seguridad', 'error');
+        hideSecurityProgress();
+        return;
+      }
       
-      // Agregar el nombre del archivo escaneado al formulario
-      formData.append('scanned_filename', scanResult.filename);
+      // El archivo ya quedó guardado en el servidor: enviar solo su token de escaneo
+      formData.delete('file');
+      formData.append('scan_token', job.scan_token);
       
     } catch (error) {
       updateSecurityStep('step-upload', 'error', '❌');
@@ -870,6 +865,43 @@ async function handleFormSubmission() {
   }
 }
 
+// Etapa del job de escaneo -> paso del indicador de progreso
+const SCAN_STAGE_STEPS = {
+  validacion: 'step-upload',
+  clamav: 'step-clamav',
+  virustotal: 'step-virustotal',
+  final: 'step-final'
+};
+const SCAN_POLL_INTERVAL = 500;
+
+async function pollScanJob(statusUrl) {
+  const order = Object.values(SCAN_STAGE_STEPS);
+  
+  while (true) {
+    const response = await fetch(statusUrl);
+    const job = await response.json();
+    
+    if (!response.ok) {
+      return { status: 'error', error: job.error || 'Error consultando el escaneo' };
+    }
+    
+    // Marcar como completados los pasos anteriores a la etapa actual
+    const current = job.status === 'approved' ? order.length : order.indexOf(SCAN_STAGE_STEPS[job.stage]);
+    order.forEach((stepId, i) => {
+      if (i < current) {
+        updateSecurityStep(stepId, 'completed', '✅');
+      } else if (i === current && job.status === 'running') {
+        updateSecurityStep(stepId, 'active', '🔄');
+      }
+    });
+    
+    if (job.status !== 'queued' && job.status !== 'running') {
+      return job;
+    }
+    await new Promise(resolve => setTimeout(resolve, SCAN_POLL_INTERVAL));
+  }
+}
+
 function showSecurityProgress() {
   const progressDiv = document.getElementById('securityProgress');
   if (progressDiv) {
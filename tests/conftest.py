@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos de la app están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py importado en un directorio de trabajo temporal: base, uploads y logs
+    propios. PDFs validados en el proceso (sin sandbox), como con PDF_SANDBOX_WORKERS=0"""
+    os.chdir(tmp_path_factory.mktemp('app'))
+    os.environ['PDF_SANDBOX_WORKERS'] = '0'
+    for name in ('VIRUSTOTAL_API_KEY', 'CLAMD_SOCKET', 'CLAMD_HOST', 'METRICS_DIR'):
+        os.environ.pop(name, None)
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
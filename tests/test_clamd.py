@@ -0,0 +1,231 @@
+"""Cliente clamd contra un servidor local que habla el protocolo de clamd (IDSESSION + INSTREAM)"""
+
+import select
+import struct
+import socket
+import threading
+import socketserver
+
+import pytest
+
+from Security.clamd import ClamdClient, ClamdError, CHUNK_SIZE
+from Security.scanner import ClamAVScanner
+
+EICAR = b'X5O!P%@AP[4\\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*'
+
+
+class FakeClamd(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeClamdHandler)
+        self.connections = 0
+        self.commands = []
+        self.streams = []           # bytes recibidos por INSTREAM
+        self.drop_next = 0          # conexiones a cortar al recibir su primer comando
+        self.reverse_replies = False    # contestar en orden inverso los comandos encadenados
+        self.open = []
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def close_sessions(self):
+        """Cerrar las sesiones abiertas, como hace clamd al vencer IdleTimeout"""
+        with self.lock:
+            sessions, self.open = self.open, []
+        for sock in sessions:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class FakeClamdHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.buffer = b''
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.open.append(self.request)
+            self.drop = self.server.drop_next > 0
+            self.server.drop_next -= self.drop
+
+    def _read(self, size):
+        while len(self.buffer) < size:
+            data = self.request.recv(65536)
+            if not data:
+                raise EOFError
+            self.buffer += data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def _command(self):
+        while b'\0' not in self.buffer:
+            data = self.request.recv(65536)
+            if not data:
+                raise EOFError
+            self.buffer += data
+        command, self.buffer = self.buffer.split(b'\0', 1)
+        return command[1:]      # sin el prefijo 'z'
+
+    def _more_commands(self):
+        """¿Hay otro comando encadenado esperando?"""
+        return bool(self.buffer) or bool(select.select([self.request], [], [], 0.05)[0])
+
+    def handle(self):
+        request_id = 0
+        replies = []
+        try:
+            if self._command() != b'IDSESSION':
+                return
+            while True:
+                command = self._command()
+                with self.server.lock:
+                    self.server.commands.append(command)
+                if command == b'END' or self.drop:
+                    return
+                request_id += 1
+                if command == b'PING':
+                    reply = 'PONG'
+                elif command == b'INSTREAM':
+                    data = b''
+                    while True:
+                        size, = struct.unpack('!L', self._read(4))
+                        if not size:
+                            break
+                        data += self._read(size)
+                    with self.server.lock:
+                        self.server.streams.append(data)
+                    reply = 'stream: Eicar-Test-Signature FOUND' if EICAR in data else 'stream: OK'
+                else:
+                    reply = 'UNKNOWN COMMAND ERROR'
+                replies.append(f"{request_id}: {reply}".encode() + b'\0')
+                if not (self.server.reverse_replies and self._more_commands()):
+                    self.request.sendall(b''.join(reversed(replies)))
+                    replies = []
+        except (EOFError, OSError):
+            pass
+
+
+@pytest.fixture
+def server():
+    server = FakeClamd()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    client = ClamdClient(host='127.0.0.1', port=server.port, timeout=5.0)
+    yield client
+    client.close()
+
+
+def test_ping(client):
+    assert client.ping() is True
+
+
+def unused_port():
+    # Un puerto recién liberado: nadie escucha
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_ping_without_server():
+    assert ClamdClient(host='127.0.0.1', port=unused_port(), timeout=1.0).ping() is False
+
+
+def test_scan_stream_in_chunks(tmp_path, server, client):
+    clean = tmp_path / 'limpio.pdf'
+    clean.write_bytes(b'%PDF-1.4 ' + b'a' * (CHUNK_SIZE * 2 + 123))
+    infected = tmp_path / 'eicar.pdf'
+    infected.write_bytes(EICAR)
+
+    assert client.scan_stream(str(clean)) == ('OK', None)
+    assert client.scan_stream(str(infected)) == ('FOUND', 'Eicar-Test-Signature')
+    assert server.streams[0] == clean.read_bytes()
+    # Ambos escaneos usaron la misma sesión
+    assert server.connections == 1
+
+
+def test_closed_idle_session_is_retried(tmp_path, server, client):
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(b'%PDF-1.4 contenido')
+    assert client.scan_stream(str(path)) == ('OK', None)
+
+    server.close_sessions()
+    assert client.scan_stream(str(path)) == ('OK', None)
+    assert server.connections == 2
+
+
+def test_fresh_session_failure_is_not_retried(tmp_path, server, client):
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(b'%PDF-1.4 contenido')
+    server.drop_next = 2
+
+    with pytest.raises(ClamdError):
+        client.scan_stream(str(path))
+    # Una sola conexión: el fallo de una sesión nueva no se repite
+    assert server.connections == 1
+
+
+def test_scan_many_pipelines_on_one_session(tmp_path, server):
+    client = ClamdClient(host='127.0.0.1', port=server.port, timeout=5.0, pipeline_depth=2)
+    paths = []
+    for i in range(5):
+        path = tmp_path / f'doc{i}.txt'
+        path.write_bytes(EICAR if i == 3 else b'limpio %d' % i * CHUNK_SIZE)
+        paths.append(str(path))
+    server.reverse_replies = True
+    try:
+        results = client.scan_many(paths)
+    finally:
+        client.close()
+    assert results == {path: ('FOUND', 'Eicar-Test-Signature') if i == 3 else ('OK', None)
+                       for i, path in enumerate(paths)}
+    # Tres lotes (2 + 2 + 1) en la misma sesión
+    assert server.connections == 1
+    assert server.commands.count(b'INSTREAM') == 5
+
+
+def test_scanner_uses_clamd(tmp_path, client):
+    path = tmp_path / 'eicar.txt'
+    path.write_bytes(b'sin firmas locales ' + EICAR)
+    result = ClamAVScanner(client=client, signatures=NoSignatures()).scan_file(str(path))
+    assert (result['status'], result['engine']) == ('infected', 'clamd')
+
+
+class NoSignatures:
+    def scan_file(self, path):
+        return []
+
+
+@pytest.mark.parametrize('fail_open', [False, True])
+def test_scanner_without_clamd(tmp_path, fail_open):
+    path = tmp_path / 'doc.txt'
+    path.write_bytes(b'texto')
+    scanner = ClamAVScanner(client=ClamdClient(host='127.0.0.1', port=unused_port(), timeout=1.0),
+                            signatures=NoSignatures(), fail_open=fail_open)
+    result = scanner.scan_file(str(path))
+    if fail_open:
+        assert result['status'] == 'clean' and result['degraded'] is True
+    else:
+        # clamd configurado pero caído: el archivo no se da por escaneado
+        assert result['status'] == 'error' and 'degraded' not in result
+
+
+def test_scanner_fails_closed_on_scan_error(tmp_path, server, client):
+    path = tmp_path / 'doc.txt'
+    path.write_bytes(b'texto')
+    scanner = ClamAVScanner(client=client, signatures=NoSignatures())
+    assert scanner.is_available()
+    # La sesión del PING se cierra y la nueva conexión se corta: falla el INSTREAM
+    server.close_sessions()
+    server.drop_next = 1
+    assert scanner.scan_file(str(path))['status'] == 'error'
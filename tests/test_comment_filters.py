@@ -0,0 +1,103 @@
+"""Filtros del panel de admin (/api/comments) y conteos filtrados en caché"""
+
+import uuid
+
+import pytest
+
+import db
+
+
+def comment(feature_id, user, created_at, municipality='Ponce'):
+    return (uuid.uuid4().hex, feature_id, user, 'e@example.com', municipality, 'Residente', 'texto', '', None,
+            created_at)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = db.Database(str(tmp_path / 'solicitudes.db'), pool_size=1)
+    assert database.init_schema()
+    with database.connection() as conn:
+        conn.executemany(db.SQL_INSERT_COMMENT, [
+            comment('f1', 'José Pérez', '2025-01-01T00:00:00'),
+            comment('f1', 'JOSEFINA', '2025-01-02T00:00:00'),
+            comment('f2', 'Álvaro', '2025-01-03T00:00:00'),
+            comment('f2', 'ana_100%', '2025-01-04T00:00:00'),
+        ])
+    yield database
+    database.pool.close_all()
+
+
+@pytest.mark.parametrize('text, users', [
+    ('jos', {'José Pérez', 'JOSEFINA'}),
+    ('pérez', {'José Pérez'}),
+    ('álv', {'Álvaro'}),
+    ('_100%', {'ana_100%'}),
+    ('a%1', set()),         # % y _ son literales, no comodines
+    ('nadie', set()),
+])
+def test_user_filter_is_case_insensitive_substring(database, text, users):
+    rows = database.fetch_comments_page({'user': text})
+    assert {row['user'] for row in rows} == users
+    assert database.count_comments({'user': text})[0] == len(users)
+
+
+def test_count_cache_follows_writes(database, tmp_path):
+    filters = {'user': 'jos'}
+    assert database.count_comments(filters)[0] == 2
+    assert database.count_comments(filters)[0] == 2
+    assert database.count_cache_hits == 1
+
+    # Escritura desde otro worker (otra instancia sobre el mismo archivo)
+    other = db.Database(database.db_file, pool_size=1)
+    other.execute(db.SQL_INSERT_COMMENT, comment('f3', 'josé luis', '2025-01-05T00:00:00'))
+    assert database.count_comments(filters)[0] == 3
+
+    other.execute("UPDATE solicitudes SET status = 'resolved' WHERE user = 'JOSEFINA'")
+    assert database.count_comments(dict(filters, status='new'))[0] == 2
+    other.pool.close_all()
+
+    # Un INSERT seguido de un DELETE deja igual solicitudes_counts: invalidate_counts()
+    with database.connection() as conn:
+        conn.execute(db.SQL_INSERT_COMMENT, comment('f3', 'Josué', '2025-01-06T00:00:00'))
+        conn.execute("DELETE FROM solicitudes WHERE user = 'Álvaro'")
+    database.invalidate_counts()
+    assert database.count_comments(filters)[0] == 4
+
+
+def point(uid, title, lng, lat):
+    return {"type": "Feature", "properties": {"feature_uid": uid, "title": title},
+            "geometry": {"type": "Point", "coordinates": [lng, lat]}}
+
+
+def test_location_filter_matches_feature_titles(client, app_module):
+    tag = uuid.uuid4().hex[:8]
+    app_module.feature_store.append(point(f'{tag}-a', f'Parque Central {tag}', -66.5, 18.2))
+    app_module.feature_store.append(point(f'{tag}-b', f'Escuela del parque {tag}', -65.5, 18.2))
+    app_module.feature_store.append(point(f'{tag}-c', f'Biblioteca {tag}', -66.5, 18.2))
+    for uid in ('a', 'b', 'c'):
+        assert app_module.insert_comment(comment(f'{tag}-{uid}', 'usuario', '2025-02-01T00:00:00'))
+
+    def titles(query):
+        response = client.get(f'/api/comments?{query}')
+        assert response.status_code == 200
+        return sorted(item['feature_title'] for item in response.get_json()['items'])
+
+    assert titles(f'location=PARQUE+{tag}') == [f'Escuela del parque {tag}']
+    assert [title for title in titles('location=parque') if tag in title] == \
+        [f'Escuela del parque {tag}', f'Parque Central {tag}']
+    # Combinado con bbox: la intersección de ambos
+    assert [title for title in titles('location=parque&bbox=-67,18,-66,19') if tag in title] == \
+        [f'Parque Central {tag}']
+    count = client.get(f'/api/comments/count?location={tag}').get_json()
+    assert count['total'] == 3
+
+
+def test_count_endpoint_sees_new_comments(client, app_module):
+    user = f'contador-{uuid.uuid4().hex[:8]}'
+    assert client.get(f'/api/comments/count?user={user}').get_json()['total'] == 0
+    assert app_module.insert_comment(comment('f1', user.upper(), '2025-03-01T00:00:00'))
+    assert client.get(f'/api/comments/count?user={user}').get_json()['total'] == 1
+
+    comment_id = client.get(f'/api/comments?user={user}').get_json()['items'][0]['comment_id']
+    assert client.delete(f'/api/comments/{comment_id}').status_code == 200
+    assert client.get(f'/api/comments/count?user={user}').get_json()['total'] == 0
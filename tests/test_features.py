@@ -0,0 +1,74 @@
+"""Coordenadas de /upload: nada no finito llega al índice espacial"""
+
+import json
+import math
+
+import pytest
+
+import db
+from Geo.feature_log import FeatureLog
+from Geo.feature_store import FeatureStore
+
+UPLOAD = {'name': 'n', 'email': 'e@example.com', 'municipality': 'Ponce', 'entity': 'Residente', 'comments': 'c'}
+MAP_ROUTES = ('/data.geojson', '/features?bbox=-67.5,17.8,-65.2,18.6', '/clusters?z=8&bbox=-67.5,17.8,-65.2,18.6',
+              '/tiles/8/87/113.geojson',
+              '/features/nearby?lat=18.2&lng=-66.5&radius=1000')
+
+
+def point(uid, lng, lat):
+    return {"type": "Feature", "properties": {"feature_uid": uid, "title": uid},
+            "geometry": {"type": "Point", "coordinates": [lng, lat]}}
+
+
+@pytest.mark.parametrize('lat,lng', [('nan', '-66.5'), ('18.2', 'inf'), ('-inf', '-66.5'), ('91', '-66.5'),
+                                     ('18.2', '-181'), ('abc', '-66.5')])
+def test_upload_rejects_invalid_coordinates(client, app_module, lat, lng):
+    count = app_module.database.fetch_one("SELECT COUNT(*) FROM feature_log")[0]
+    response = client.post('/upload', data=dict(UPLOAD, lat=lat, lng=lng))
+    assert response.status_code == 400
+    assert app_module.database.fetch_one("SELECT COUNT(*) FROM feature_log")[0] == count
+
+
+def test_bad_log_row_does_not_break_map_routes(client, app_module):
+    # Una fila escrita antes de la validación de /upload (o a mano) no tumba el mapa
+    app_module.feature_store.append(point('roto', math.nan, 18.2))
+    for route in MAP_ROUTES:
+        response = client.get(route)
+        assert response.status_code == 200, route
+        assert 'roto' not in response.get_data(as_text=True)
+
+
+def test_store_skips_non_finite_points(tmp_path):
+    database = db.Database(str(tmp_path / 'solicitudes.db'), pool_size=1)
+    assert database.init_schema()
+    log = FeatureLog(database)
+    log.append(point('bueno', -66.5, 18.2))
+    log.append(point('nan', math.nan, 18.2))
+    log.append(point('inf', -66.5, math.inf))
+    log.append(point('texto', 'x', 18.2))
+
+    store = FeatureStore(str(tmp_path / 'data.geojson'), log, check_interval=0)
+    uids = [f['properties']['feature_uid'] for f in store.collection()['features']]
+    assert uids == ['bueno']
+    assert [f['properties']['feature_uid'] for f in store.features_in_bbox(-67, 18, -66, 19)] == ['bueno']
+    json.dumps(store.collection(), allow_nan=False)
+    database.pool.close_all()
+
+
+def test_snapped_upload_refreshes_cluster_statuses(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'FEATURE_SNAP_RADIUS_M', 50.0)
+    lat, lng = 18.0123, -66.0456
+    bbox = f'{lng - 0.001},{lat - 0.001},{lng + 0.001},{lat + 0.001}'
+
+    def statuses():
+        features = client.get(f'/clusters?z=16&bbox={bbox}').get_json()['features']
+        assert len(features) == 1
+        return features[0]['properties']['statuses']
+
+    first = client.post('/upload', data=dict(UPLOAD, lat=str(lat), lng=str(lng))).get_json()
+    assert statuses() == {'new': 1}
+
+    # A pocos metros: se reasigna al mismo feature sin esperar a la relectura periódica
+    second = client.post('/upload', data=dict(UPLOAD, lat=str(lat + 0.0001), lng=str(lng))).get_json()
+    assert second['snapped']['feature_id'] == first['feature_id']
+    assert statuses() == {'new': 2}
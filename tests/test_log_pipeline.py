@@ -0,0 +1,106 @@
+"""Archivo de logs compartido entre procesos (flock + rotación) y cola sin bloqueo"""
+
+import os
+import glob
+import json
+import queue
+import logging
+import multiprocessing
+
+import pytest
+
+from log_pipeline import JSONFormatter, NonBlockingQueueHandler, ProcessSafeRotatingFileHandler, FCNTL_AVAILABLE
+
+WORKERS = 4
+RECORDS = 300
+MAX_BYTES = 4096
+
+
+def record(msg, **extra):
+    return logging.makeLogRecord(dict({'name': 'prueba', 'levelno': logging.INFO, 'levelname': 'INFO',
+                                       'msg': msg}, **extra))
+
+
+def make_handler(path):
+    handler = ProcessSafeRotatingFileHandler(path, maxBytes=MAX_BYTES, backupCount=1000)
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+
+def write_records(path, worker, handler=None):
+    handler = handler or make_handler(path)
+    for i in range(RECORDS):
+        handler.emit(record(f"{worker}:{i}", relleno='x' * 40))
+    handler.close()
+
+
+@pytest.mark.skipif(not FCNTL_AVAILABLE, reason="sin flock")
+@pytest.mark.parametrize('inherited', [False, True], ids=['por-worker', 'heredado-del-fork'])
+def test_rotation_across_processes_keeps_every_record(tmp_path, inherited):
+    path = str(tmp_path / 'security.log')
+    # Como los workers de gunicorn (cada uno abre el suyo) o como un proceso hijo
+    # que hereda el handler del padre
+    parent_handler = make_handler(path) if inherited else None
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=write_records, args=(path, worker, parent_handler))
+                 for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    if parent_handler is not None:
+        parent_handler.close()
+
+    files = glob.glob(path + '*')
+    files.remove(path + '.lock')
+    assert len(files) > 10      # hubo rotaciones
+    messages = []
+    for name in files:
+        assert os.path.getsize(name) <= MAX_BYTES, name
+        with open(name, encoding='utf-8') as f:
+            messages.extend(json.loads(line)['msg'] for line in f)
+    expected = [f"{worker}:{i}" for worker in range(WORKERS) for i in range(RECORDS)]
+    assert sorted(messages) == sorted(expected)
+
+
+def test_full_queue_drops_and_reports():
+    log_queue = queue.Queue(maxsize=2)
+    handler = NonBlockingQueueHandler(log_queue)
+    for i in range(5):
+        handler.emit(record(f"mensaje {i}"))
+    assert log_queue.qsize() == 2 and handler.dropped == 3
+
+    # Con espacio para el aviso pero no para el registro: el aviso sale y el registro cuenta
+    log_queue.get_nowait()
+    handler.emit(record("mensaje 5"))
+    assert handler.dropped == 1
+    assert log_queue.get_nowait().msg == "mensaje 1"
+    warning = log_queue.get_nowait()
+    assert (warning.levelname, warning.dropped) == ('WARNING', 3)
+
+    handler.emit(record("mensaje 6"))
+    warning, latest = log_queue.get_nowait(), log_queue.get_nowait()
+    assert warning.dropped == 1 and latest.msg == "mensaje 6"
+    assert handler.dropped == 0
+
+
+def test_warning_waits_while_queue_is_full():
+    log_queue = queue.Queue(maxsize=1)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.emit(record("primero"))
+    handler.emit(record("segundo"))
+    handler.emit(record("tercero"))
+    # Sin espacio ni para el aviso: no se pierde la cuenta
+    assert handler.dropped == 2
+    assert log_queue.get_nowait().msg == "primero"
+
+
+def test_prepare_resolves_message_in_calling_thread():
+    log_queue = queue.Queue()
+    handler = NonBlockingQueueHandler(log_queue)
+    args = ['antes']
+    handler.emit(record("valor %s", args=(args,)))
+    args[0] = 'después'
+    queued = log_queue.get_nowait()
+    assert queued.getMessage() == "valor ['antes']" and queued.args is None
@@ -0,0 +1,39 @@
+"""Suma de métricas entre procesos: los workers que terminan pasan a dead.json"""
+
+import os
+
+import metrics
+
+
+def worker_registry(directory, requests, seconds):
+    registry = metrics.Registry()
+    registry.directory = str(directory)
+    counter = registry.counter('requests_total', 'Peticiones', ('route',))
+    histogram = registry.histogram('duration_seconds', 'Duración', buckets=(0.1, 1.0))
+    counter.inc(requests, route='/')
+    for value in seconds:
+        histogram.observe(value)
+    return registry
+
+
+def test_dead_worker_totals_survive_pid_reuse(tmp_path):
+    first = worker_registry(tmp_path, 3, [0.05, 2.0])
+    first.flush()
+    metrics.mark_process_dead(os.getpid(), str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == [metrics.DEAD_FILE]
+
+    # Un worker nuevo con el mismo PID escribe su propio archivo sin pisar al anterior
+    second = worker_registry(tmp_path, 2, [0.5])
+    second.flush()
+    merged = second.collect()
+    assert merged['requests_total'] == {('/',): 5}
+    assert merged['duration_seconds'][()] == [1, 1, 1, 2.55]
+
+    metrics.mark_process_dead(os.getpid(), str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == [metrics.DEAD_FILE]
+    assert worker_registry(tmp_path, 0, []).collect()['requests_total'] == {('/',): 5}
+
+
+def test_missing_file_is_ignored(tmp_path):
+    metrics.mark_process_dead(12345, str(tmp_path))
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,92 @@
+"""/features/nearby: validación y límites de parámetros, y búsqueda por radio contra fuerza bruta"""
+
+import math
+import random
+import uuid
+
+import pytest
+
+from Geo.spatial_index import GridIndex, haversine_m
+
+# Lejos de los puntos de las demás pruebas (todas en Puerto Rico)
+ORIGIN_LAT, ORIGIN_LNG = -41.3, 174.8
+
+
+def point(uid, lng, lat):
+    return {"type": "Feature", "properties": {"feature_uid": uid, "title": uid},
+            "geometry": {"type": "Point", "coordinates": [lng, lat]}}
+
+
+def north_of(lat, lng, meters):
+    return lat + math.degrees(meters / 6371008.8), lng
+
+
+@pytest.mark.parametrize('query', ['lat=nan&lng=-66.5', 'lat=18.2&lng=inf', 'lat=18.2&lng=-66.5&radius=nan',
+                                   'lat=18.2&lng=-66.5&radius=inf', 'lat=91&lng=-66.5', 'lat=18.2&lng=-181',
+                                   'lat=18.2', 'lat=x&lng=-66.5', 'lat=18.2&lng=-66.5&limit=x'])
+def test_nearby_rejects_invalid_parameters(client, query):
+    assert client.get(f'/features/nearby?{query}').status_code == 400
+
+
+@pytest.fixture(scope='module')
+def placed(app_module):
+    """Puntos a 0 m, 300 m, 1 km, 4.9 km y 8 km al norte del origen"""
+    tag = uuid.uuid4().hex[:8]
+    uids = {}
+    for meters in (0, 300, 1000, 4900, 8000):
+        lat, lng = north_of(ORIGIN_LAT, ORIGIN_LNG, meters)
+        uids[meters] = f'{tag}-{meters}'
+        app_module.feature_store.append(point(uids[meters], lng, lat))
+    return uids
+
+
+def nearby(client, **params):
+    query = '&'.join(f'{key}={value}' for key, value in dict(lat=ORIGIN_LAT, lng=ORIGIN_LNG, **params).items())
+    response = client.get(f'/features/nearby?{query}')
+    assert response.status_code == 200
+    return [(f['properties']['feature_uid'], f['properties']['distance_m']) for f in response.get_json()['features']]
+
+
+def test_nearby_orders_by_distance(client, placed):
+    found = nearby(client, radius=1500)
+    assert [uid for uid, _ in found] == [placed[0], placed[300], placed[1000]]
+    assert [round(distance) for _, distance in found] == [0, 300, 1000]
+
+
+def test_nearby_clamps_radius(client, app_module, placed):
+    # Un radio enorme se recorta a NEARBY_MAX_RADIUS_M; uno negativo a 0
+    assert app_module.NEARBY_MAX_RADIUS_M < 8000
+    assert [uid for uid, _ in nearby(client, radius='1e12')] == [placed[m] for m in (0, 300, 1000, 4900)]
+    assert [uid for uid, _ in nearby(client, radius=-50)] == [placed[0]]
+    assert [uid for uid, _ in nearby(client)] == [placed[0]]      # 100 m por defecto
+
+
+def test_nearby_clamps_limit(client, app_module, placed):
+    assert [uid for uid, _ in nearby(client, radius=5000, limit=0)] == [placed[0]]
+    assert [uid for uid, _ in nearby(client, radius=5000, limit=2)] == [placed[0], placed[300]]
+    assert len(nearby(client, radius=5000, limit=10 ** 9)) == 4
+
+
+@pytest.mark.parametrize('center_lat', [0.0, 18.2, -41.3, 70.0])
+def test_query_radius_matches_brute_force(center_lat):
+    rng = random.Random(int(center_lat * 10))
+    center_lng = 10.0
+    radius = 5000.0
+    coords = []
+    grid = GridIndex()
+    # Puntos concentrados cerca del borde del círculo, en todas las direcciones
+    for row in range(2000):
+        bearing = rng.uniform(0, 2 * math.pi)
+        meters = radius * rng.uniform(0.97, 1.03)
+        dlat = math.degrees(meters * math.cos(bearing) / 6371008.8)
+        dlng = math.degrees(meters * math.sin(bearing) / (6371008.8 * math.cos(math.radians(center_lat))))
+        lng, lat = center_lng + dlng, center_lat + dlat
+        coords.extend((lng, lat))
+        grid.insert(row, lng, lat)
+
+    expected = sorted(
+        (haversine_m(center_lng, center_lat, coords[2 * row], coords[2 * row + 1]), row)
+        for row in range(2000)
+        if haversine_m(center_lng, center_lat, coords[2 * row], coords[2 * row + 1]) <= radius
+    )
+    assert grid.query_radius(center_lng, center_lat, radius, coords) == expected
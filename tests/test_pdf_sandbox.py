@@ -0,0 +1,150 @@
+"""PDFSandbox: cada validación corre en su propio proceso y solo se mata el que se pasa de tiempo"""
+
+import io
+import os
+import sys
+import time
+import subprocess
+import threading
+
+import pytest
+
+from pdf_validator import PDFValidator, PDFSandbox, SandboxTimeoutError
+
+
+def make_pdf(trailing=b''):
+    from reportlab.pdfgen import canvas
+    buf = io.BytesIO()
+    pdf = canvas.Canvas(buf)
+    pdf.drawString(72, 720, "Solicitud de permiso para la reparación de la acera")
+    pdf.save()
+    return buf.getvalue() + trailing
+
+
+@pytest.fixture
+def sandbox():
+    sandbox = PDFSandbox(PDFValidator(), max_workers=2, timeout=2.0, queue_wait=5.0)
+    yield sandbox
+    for worker in sandbox._idle:
+        worker.close()
+
+
+def test_validates_path_and_bytes(tmp_path, sandbox):
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(make_pdf())
+    assert sandbox.validate(str(path))[0] is True
+    assert sandbox.validate(make_pdf())[0] is True
+    valid, message, _ = sandbox.validate(b'%PDF-1.4 sin marcador de fin')
+    assert not valid and 'fin de archivo' in message
+
+
+def test_eof_marker_found_before_trailing_data():
+    # Datos después de %%EOF (p. ej. firmas o basura de un escáner): PyPDF2 los acepta
+    valid, _, _ = PDFValidator().validate(io.BytesIO(make_pdf(trailing=b'\n' + b'x' * 200000)))
+    assert valid
+
+
+@pytest.mark.skipif(not hasattr(os, 'mkfifo'), reason='requiere FIFOs (Unix)')
+def test_timeout_kills_only_the_offending_process(tmp_path, sandbox):
+    # Abrir una FIFO sin escritor bloquea al proceso hijo indefinidamente
+    fifo = str(tmp_path / 'cuelga.pdf')
+    os.mkfifo(fifo)
+    outcome = {}
+
+    def hang():
+        try:
+            sandbox.validate(fifo)
+        except SandboxTimeoutError:
+            outcome['timeout'] = time.perf_counter()
+
+    thread = threading.Thread(target=hang)
+    thread.start()
+    time.sleep(0.5)
+    # La otra validación en curso no se ve afectada por el timeout
+    assert sandbox.validate(make_pdf())[0] is True
+    thread.join()
+    assert 'timeout' in outcome
+    assert sandbox.validate(make_pdf())[0] is True
+    assert len(sandbox._idle) == 1
+
+
+def heavy_pdf(pages=40):
+    """PDF denso: con min_chars inalcanzable la validación recorre todas las páginas"""
+    from reportlab.pdfgen import canvas
+    buf = io.BytesIO()
+    pdf = canvas.Canvas(buf)
+    for _ in range(pages):
+        for line in range(60):
+            pdf.drawString(72, 760 - line * 12, "texto de relleno para medir el tiempo de validación")
+        pdf.showPage()
+    pdf.save()
+    return buf.getvalue()
+
+
+def test_timeout_does_not_include_queue_wait():
+    validator = PDFValidator(min_chars=10 ** 9, max_pages=1000, time_budget=60)
+    started = time.perf_counter()
+    validator.validate(io.BytesIO(heavy_pdf()))
+    # Páginas para que una validación dure ~0.6s en esta máquina
+    pages = max(40, int(40 * 0.6 / (time.perf_counter() - started)))
+    data = heavy_pdf(pages)
+    started = time.perf_counter()
+    validator.validate(io.BytesIO(data))
+    single = time.perf_counter() - started
+
+    # Un solo proceso y seis validaciones: la última espera ~5 validaciones en cola,
+    # bastante más que el timeout, pero su propia validación cabe en él con holgura
+    timeout = 3 * single
+    sandbox = PDFSandbox(validator, max_workers=1, timeout=timeout, queue_wait=60.0, max_cpu_seconds=None)
+    results = []
+    try:
+        sandbox.validate(data)      # arranca el proceso fuera del tiempo medido
+        threads = [threading.Thread(target=lambda: results.append(sandbox.validate(data)[2]['pages_scanned']))
+                   for _ in range(6)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.perf_counter() - started > timeout
+        assert results == [pages] * 6
+    finally:
+        for worker in sandbox._idle:
+            worker.close()
+
+
+def test_child_does_not_import_main_module(tmp_path):
+    # Un __main__ con efectos al importarse (como app.py lanzado con `python app.py`)
+    marker = tmp_path / 'importado'
+    script = tmp_path / 'servidor.py'
+    script.write_text(
+        "import sys, pathlib\n"
+        f"pathlib.Path({str(marker)!r}).write_text(__name__ + '\\n') if __name__ != '__main__' else None\n"
+        "if __name__ == '__main__':\n"
+        f"    sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})\n"
+        "    from pdf_validator import PDFValidator, PDFSandbox\n"
+        f"    print(PDFSandbox(PDFValidator()).validate({make_pdf()!r})[0])\n"
+    )
+    output = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=60)
+    assert output.stdout.strip() == 'True', output.stderr
+    assert not marker.exists()
+
+
+def test_validates_mmap_view(tmp_path):
+    # Sin sandbox (PDF_SANDBOX_WORKERS=0) la app valida la vista mmap del archivo ingerido
+    from upload_ingest import IngestedUpload
+    for name, data, expected in (('doc.pdf', make_pdf(b'\n' + b'x' * 200000), True),
+                                 ('roto.pdf', b'%PDF-1.4 sin marcador de fin', False)):
+        path = tmp_path / name
+        path.write_bytes(data)
+        with IngestedUpload.from_path(str(path), name).view() as view:
+            valid, message, _ = PDFValidator().validate(view)
+        assert valid is expected, message
+
+
+def test_app_validates_pdf_without_sandbox(tmp_path, app_module):
+    from upload_ingest import IngestedUpload
+    assert app_module.pdf_sandbox is None
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(make_pdf())
+    assert app_module.validate_pdf_with_text(IngestedUpload.from_path(str(path), 'doc.pdf'))[0] is True
@@ -0,0 +1,81 @@
+"""ScannerPipeline: etapas en paralelo, corto circuito y gate de las etapas costosas"""
+
+import time
+import threading
+
+import pytest
+
+from Security.pipeline import ScannerPipeline
+
+
+def sleeper(seconds, status):
+    def scan(path, sha256):
+        time.sleep(seconds)
+        return {'status': status}
+    return scan
+
+
+def gated_scan(seen):
+    """Etapa que, como VirusTotal, hace su trabajo barato y luego espera el gate"""
+    def scan(path, sha256, gate):
+        seen['gate'] = gate.result(timeout=5)
+        seen['done'].set()
+        return {'status': 'clean' if seen['gate'] else 'skipped'}
+    seen['done'] = threading.Event()
+    return scan
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = ScannerPipeline(max_workers=4)
+    yield pipeline
+    if pipeline._executor is not None:
+        pipeline._executor.shutdown(wait=False)
+
+
+def test_same_priority_runs_concurrently(pipeline):
+    pipeline.register('a', sleeper(0.3, 'clean'), accept=('clean',), reject=('infected',))
+    pipeline.register('b', sleeper(0.3, 'clean'), accept=('clean',), reject=('infected',))
+    results = pipeline.run('archivo')
+    assert results['final_decision'] == 'approved'
+    # La latencia es la del más lento, no la suma
+    assert results['timings']['total'] < 0.5
+    assert set(results['timings']) == {'a', 'b', 'total'}
+
+
+def test_reject_short_circuits_later_groups(pipeline):
+    calls = []
+    pipeline.register('local', sleeper(0.0, 'infected'), accept=('clean',), reject=('infected',))
+    pipeline.register('remoto', lambda path, sha256: calls.append(path) or {'status': 'clean'},
+                      accept=('clean',), reject=(), priority=200)
+    results = pipeline.run('archivo')
+    assert (results['final_decision'], results['rejected_by'], results['definitive']) == ('rejected', 'local', True)
+    assert results['skipped'] == ['remoto'] and calls == []
+
+
+@pytest.mark.parametrize('status,expected', [('clean', True), ('infected', False), ('error', False)])
+def test_gate_follows_the_other_stages(pipeline, status, expected):
+    seen = {}
+    pipeline.register('local', sleeper(0.2, status), accept=('clean',), reject=('infected',))
+    pipeline.register('remoto', gated_scan(seen), accept=('clean',), reject=('malicious',), cost=10, gated=True)
+    started = time.perf_counter()
+    results = pipeline.run('archivo')
+    # Ambas etapas corrieron a la vez
+    assert time.perf_counter() - started < 0.4
+    assert results['final_decision'] == ('approved' if expected else 'rejected')
+    # Tras un rechazo run() no espera a la etapa con gate, pero esta recibe False
+    assert seen['done'].wait(1) and seen['gate'] is expected
+
+
+def test_gate_resolved_when_local_stage_times_out(pipeline):
+    seen = {}
+    release = threading.Event()
+    pipeline.register('local', lambda path, sha256: release.wait(5) and {'status': 'clean'},
+                      accept=('clean',), reject=('infected',), timeout=0.2)
+    pipeline.register('remoto', gated_scan(seen), accept=('clean',), reject=(), gated=True)
+    try:
+        results = pipeline.run('archivo')
+    finally:
+        release.set()
+    assert seen['done'].wait(1) and seen['gate'] is False
+    assert (results['final_decision'], results['rejected_by']) == ('rejected', 'local')
@@ -0,0 +1,118 @@
+"""Las consultas calientes (db.HOT_QUERIES) se resuelven con índices"""
+
+import json
+import random
+import sqlite3
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = db.Database(str(tmp_path / 'solicitudes.db'), pool_size=1)
+    assert database.init_schema()
+    yield database
+    database.pool.close_all()
+
+
+def fill(database, count=5000, features=500):
+    """Solicitudes con distribuciones parecidas a producción y estadísticas de ANALYZE"""
+    rng = random.Random(7)
+    rows = [(
+        f"{i:032x}",
+        f"feat-{rng.randrange(features):03d}",
+        f"usuario{rng.randrange(800)}",
+        "correo@example.com",
+        rng.choice(('San Juan', 'Ponce', 'Cayey', 'Arecibo')),
+        rng.choice(('Residente', 'Escuela', 'Agencia')),
+        "texto",
+        "",
+        None,
+        f"2025-{1 + i * 12 // count:02d}-01T00:00:{i % 60:02d}.{i:06d}",
+    ) for i in range(count)]
+    with database.connection() as conn:
+        conn.executemany(db.SQL_INSERT_COMMENT, rows)
+        conn.execute("UPDATE solicitudes SET status = 'resolved' WHERE rowid % 5 = 0")
+        conn.execute('ANALYZE')
+
+
+def assert_indexed(conn):
+    problems = db.check_query_plans(conn)
+    assert not problems, "\n".join(f"{name}: {' | '.join(plan)}" for name, plan in problems.items())
+
+
+def test_hot_queries_on_empty_schema(database):
+    with database.connection() as conn:
+        assert_indexed(conn)
+
+
+def test_hot_queries_with_statistics(database):
+    fill(database)
+    with database.connection() as conn:
+        assert_indexed(conn)
+
+
+@pytest.mark.parametrize('plan, problem', [
+    (['SCAN solicitudes'], True),
+    (['SEARCH solicitudes USING INDEX idx_solicitudes_feature_status (feature_id=?)',
+      'USE TEMP B-TREE FOR ORDER BY'], True),
+    (['SCAN solicitudes USING COVERING INDEX idx_solicitudes_feature_status'], False),
+    (['SEARCH solicitudes USING INDEX idx_solicitudes_feature_status (feature_id=?)',
+      'LIST SUBQUERY 1', 'SCAN json_each VIRTUAL TABLE INDEX 1:'], False),
+])
+def test_check_detects_scans_and_temp_btrees(monkeypatch, plan, problem):
+    monkeypatch.setattr(db, 'HOT_QUERIES', {'query': ('SELECT 1', ())})
+    monkeypatch.setattr(db, 'explain', lambda conn, sql, params: plan)
+    assert bool(db.check_query_plans(None)) is problem
+
+
+@pytest.mark.parametrize('features', [3, db.BBOX_SORT_MAX_FEATURES + 50])
+def test_bbox_page_order_for_both_plans(database, features):
+    fill(database)
+    feature_ids = [f"feat-{i:03d}" for i in range(features)]
+    filters = {'feature_ids': json.dumps(feature_ids)}
+    expected = database.fetch_all(
+        "SELECT id, created_at FROM solicitudes WHERE feature_id IN (SELECT value FROM json_each(?)) "
+        "ORDER BY created_at DESC, id DESC", (filters['feature_ids'],)
+    )
+
+    rows, after = [], None
+    while True:
+        page = database.fetch_comments_page(filters, after=after, limit=40)
+        rows.extend(page)
+        if len(page) < 40:
+            break
+        after = (page[-1][8], page[-1][0])
+    assert [(row[0], row[8]) for row in rows] == [tuple(row) for row in expected]
+
+
+def test_legacy_database_migrates_to_final_schema(tmp_path):
+    # Tabla creada por la app antes de las migraciones, sin email/municipality/entity/status
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE solicitudes (id TEXT PRIMARY KEY, feature_id TEXT, user TEXT, text TEXT, "
+                 "file_path TEXT, created_at TEXT)")
+    conn.execute("INSERT INTO solicitudes VALUES ('a', 'feat-001', 'u', 't', '', '2025-01-01T00:00:00')")
+    conn.commit()
+    conn.close()
+
+    legacy, fresh = db.Database(path, pool_size=1), db.Database(str(tmp_path / 'nueva.db'), pool_size=1)
+    assert legacy.init_schema() and fresh.init_schema()
+
+    def schema(database):
+        with database.connection() as conn:
+            return {
+                'version': db.schema_version(conn),
+                'indexes': {row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")},
+                'columns': {table: {column[1] for column in conn.execute(f"PRAGMA table_info({table})")}
+                            for table in ('solicitudes', 'blobs')},
+            }
+
+    assert schema(legacy) == schema(fresh)
+    assert schema(fresh)['version'] == len(db.MIGRATIONS)
+    assert legacy.count_comments() == (1, {'new': 1})
+    legacy.pool.close_all()
+    fresh.pool.close_all()
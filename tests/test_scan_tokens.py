@@ -0,0 +1,87 @@
+"""Tokens de /scan-file: se consumen junto al INSERT de la solicitud y solo una vez"""
+
+import io
+import time
+import uuid
+import threading
+
+import db
+
+UPLOAD = {'name': 'n', 'email': 'e@example.com', 'municipality': 'Ponce', 'entity': 'Residente',
+          'comments': 'c', 'lat': '18.2', 'lng': '-66.5'}
+
+
+def make_pdf():
+    # Contenido distinto en cada llamada: un blob (y un veredicto) propio por prueba
+    from reportlab.pdfgen import canvas
+    buf = io.BytesIO()
+    pdf = canvas.Canvas(buf)
+    pdf.drawString(72, 720, f"Solicitud de permiso para la reparación de la acera {uuid.uuid4().hex}")
+    pdf.save()
+    return buf.getvalue()
+
+
+def scan_token(client):
+    response = client.post('/scan-file', data={'file': (io.BytesIO(make_pdf()), 'permiso.pdf')})
+    assert response.status_code in (200, 202), response.get_json()
+    status_url = response.get_json()['status_url']
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        job = client.get(status_url).get_json()
+        if job['status'] not in ('queued', 'running'):
+            assert job.get('scan_token'), job
+            return job['scan_token']
+        time.sleep(0.05)
+    raise AssertionError("el escaneo no terminó")
+
+
+def rows_with_file(app_module, token):
+    data, error = app_module.redeem_scan_token(token)
+    assert error is None
+    return app_module.database.fetch_one(
+        "SELECT COUNT(*) FROM solicitudes WHERE file_path = ?", (data['blob']['path'],))[0]
+
+
+def test_token_attaches_its_file_once(client, app_module):
+    token = scan_token(client)
+    assert client.post('/upload', data=dict(UPLOAD, scan_token=token)).status_code == 200
+
+    again = client.post('/upload', data=dict(UPLOAD, scan_token=token))
+    assert again.status_code == 400
+    assert 'ya fue utilizado' in again.get_json()['error']
+    comment = client.post('/comment', data={'feature_id': 'f1', 'user': 'u', 'email': 'e@example.com',
+                                            'municipality': 'Ponce', 'text': 't', 'scan_token': token})
+    assert comment.status_code == 400
+    assert rows_with_file(app_module, token) == 1
+
+
+def test_failed_insert_keeps_token_available(client, app_module, monkeypatch):
+    token = scan_token(client)
+    monkeypatch.setattr(db, 'SQL_INSERT_COMMENT', db.SQL_INSERT_COMMENT.replace('solicitudes', 'no_existe'))
+    assert client.post('/upload', data=dict(UPLOAD, scan_token=token)).status_code != 200
+    monkeypatch.undo()
+
+    # El UPDATE del token se deshizo con el INSERT fallido: se puede reintentar
+    assert client.post('/upload', data=dict(UPLOAD, scan_token=token)).status_code == 200
+    assert rows_with_file(app_module, token) == 1
+
+
+def test_concurrent_redemptions_insert_once(client, app_module):
+    token = scan_token(client)
+    data, _ = app_module.redeem_scan_token(token)
+    start = threading.Barrier(4)
+    results = []
+
+    def redeem():
+        params = (uuid.uuid4().hex, 'f1', 'u', 'e@example.com', 'Ponce', 'Residente', 't',
+                  data['blob']['path'], 'permiso.pdf', '2025-01-01T00:00:00')
+        start.wait()
+        results.append(app_module.insert_comment(params, data['job']))
+
+    threads = [threading.Thread(target=redeem) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False, False, False, True]
+    assert rows_with_file(app_module, token) == 1
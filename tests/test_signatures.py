@@ -0,0 +1,131 @@
+"""Motor de firmas Aho–Corasick contra una búsqueda ingenua, en bloques de cualquier tamaño"""
+
+import os
+import json
+import random
+from collections import Counter
+
+import pytest
+
+from Security.signatures import Rule, SignatureEngine, SignatureSet, DEFAULT_RULES_FILE
+
+
+def naive(rules, data):
+    """Todas las apariciones (solapadas) de cada regla: Counter de (id, offset)"""
+    found = Counter()
+    for rule in rules:
+        haystack, needle = (data.lower(), rule.pattern.lower()) if rule.nocase else (data, rule.pattern)
+        start = haystack.find(needle)
+        while start != -1:
+            if rule.max_offset is None or start < rule.max_offset:
+                found[(rule.id, start)] += 1
+            start = haystack.find(needle, start + 1)
+    return found
+
+
+def chunked(data, rng, max_size):
+    pos = 0
+    while pos < len(data):
+        size = rng.randint(1, max_size)
+        yield data[pos:pos + size]
+        pos += size
+
+
+def scan(signature_set, chunks):
+    return Counter((rule.id, offset) for rule, offset in signature_set.scan_chunks(chunks, stop_on_block=False))
+
+
+def rule(id, pattern, nocase=True, severity='warn', max_offset=None):
+    return Rule(id, pattern, nocase, severity, '', max_offset)
+
+
+def test_overlapping_and_nested_patterns():
+    rules = [rule('aa', b'aa'), rule('aaa', b'aaa'), rule('he', b'he'), rule('she', b'she'),
+             rule('his', b'his'), rule('hers', b'hers'), rule('dup', b'she')]
+    data = b'aaaa ushers his shelf aaa'
+    signature_set = SignatureSet(rules)
+    for size in (1, 2, 3, len(data)):
+        assert scan(signature_set, [data[i:i + size] for i in range(0, len(data), size)]) == naive(rules, data)
+
+
+def test_case_variants():
+    rules = [rule('js', b'/JavaScript'), rule('exact', b'/Launch', nocase=False), rule('hex', b'\x4d\x5a', nocase=False)]
+    data = b'/javascript /JAVASCRIPT /JavaScript /launch /LAUNCH /Launch mz MZ Mz'
+    found = scan(SignatureSet(rules), [data])
+    assert found == naive(rules, data)
+    assert sum(n for (rule_id, _), n in found.items() if rule_id == 'js') == 3
+    assert [offset for rule_id, offset in found if rule_id == 'exact'] == [data.index(b'/Launch')]
+    assert [offset for rule_id, offset in found if rule_id == 'hex'] == [data.index(b'MZ')]
+
+
+def test_case_sensitive_match_spanning_chunks():
+    # La verificación contra los bytes originales usa la cola del bloque anterior
+    rules = [rule('exact', b'AbCdEf', nocase=False), rule('corto', b'x')]
+    data = b'abcdef AbCdEf ABCDEF AbCdEf'
+    signature_set = SignatureSet(rules)
+    for cut in range(1, len(data)):
+        assert scan(signature_set, [data[:cut], data[cut:]]) == naive(rules, data), cut
+
+
+def test_max_offset():
+    rules = [rule('cabecera', b'%PDF', max_offset=4), rule('libre', b'%pdf')]
+    data = b'%PDF-1.4 ... %PDF otra vez'
+    found = scan(SignatureSet(rules), [data])
+    assert found == naive(rules, data)
+    assert ('cabecera', 0) in found and ('cabecera', data.rindex(b'%PDF')) not in found
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_random_against_naive(seed):
+    rng = random.Random(seed)
+    alphabet = b'aAbB/\x00'
+    rules = []
+    for i in range(rng.randint(1, 12)):
+        pattern = bytes(rng.choice(alphabet) for _ in range(rng.randint(1, 6)))
+        rules.append(rule(f'r{i}', pattern, nocase=rng.random() < 0.5,
+                          max_offset=rng.choice([None, None, rng.randint(0, 200)])))
+    data = bytes(rng.choice(alphabet) for _ in range(rng.randint(0, 400)))
+    signature_set = SignatureSet(rules)
+    assert scan(signature_set, chunked(data, rng, rng.choice([1, 3, 7, 64]))) == naive(rules, data)
+
+
+def test_stop_on_block_returns_first_blocking_match():
+    rules = [rule('aviso', b'warn'), rule('virus', b'EICAR', severity='block'), rule('tarde', b'late')]
+    data = b'warn ... eicar ... late ... eicar'
+    matches = SignatureSet(rules).scan_chunks([data[:10], data[10:]])
+    assert [(r.id, offset) for r, offset in matches] == [('aviso', 0), ('virus', data.index(b'eicar'))]
+
+
+def test_scan_file_in_small_blocks(tmp_path):
+    rules = [rule('js', b'/JavaScript'), rule('launch', b'/Launch', nocase=False)]
+    data = b'%PDF-1.4\n' + b'relleno ' * 50 + b'/JAVASCRIPT (x) /Launch /launch'
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(data)
+    found = Counter((r.id, offset) for r, offset in SignatureSet(rules).scan_file(str(path), chunk_size=5,
+                                                                                   stop_on_block=False))
+    assert found == naive(rules, data)
+
+
+def test_engine_reloads_and_keeps_rules_on_error(tmp_path):
+    rules_file = tmp_path / 'firmas.json'
+    sample = tmp_path / 'muestra.bin'
+    sample.write_bytes(b'uno dos')
+
+    def write_rules(version, rules):
+        rules_file.write_text(json.dumps({'rules': rules}))
+        # mtime distinto aunque el sistema de archivos tenga poca resolución
+        os.utime(rules_file, ns=(version * 10 ** 9, version * 10 ** 9))
+
+    write_rules(1, [{'id': 'uno', 'pattern': 'uno'}])
+    engine = SignatureEngine(str(rules_file), check_interval=0)
+    assert [r.id for r, _ in engine.scan_file(str(sample))] == ['uno']
+
+    write_rules(2, [{'id': 'dos', 'type': 'hex', 'pattern': b'dos'.hex()}])
+    assert [r.id for r, _ in engine.scan_file(str(sample))] == ['dos']
+
+    write_rules(3, [{'id': 'mala', 'type': 'regex', 'pattern': 'x'}])
+    assert [r.id for r, _ in engine.scan_file(str(sample))] == ['dos']
+
+
+def test_bundled_rules_compile():
+    assert SignatureSet.from_file(DEFAULT_RULES_FILE).rules
@@ -0,0 +1,165 @@
+"""Cliente de VirusTotal contra un servidor HTTP local que imita la API v3"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from Security import virus
+from Security.virus import AsyncVirusTotalClient, VirusTotalScanner
+
+CLEAN_STATS = {'malicious': 0, 'suspicious': 0, 'harmless': 60, 'undetected': 10}
+
+
+class FakeVirusTotal(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.known = {}             # sha256 -> stats
+        self.lookup_delay = 0.0     # segundos antes de responder GET /files/<sha>
+        self.statuses = []          # códigos a devolver antes de la respuesta normal
+        self.uploads = []           # cuerpos recibidos en POST /files
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/v3"
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None):
+        data = json.dumps(body or {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _forced_status(self):
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path))
+            return self.server.statuses.pop(0) if self.server.statuses else None
+
+    def do_GET(self):
+        forced = self._forced_status()
+        if forced:
+            return self._send(forced)
+        if self.path.startswith('/api/v3/files/'):
+            time.sleep(self.server.lookup_delay)
+            stats = self.server.known.get(self.path.rsplit('/', 1)[1])
+            if stats is None:
+                return self._send(404, {'error': {'code': 'NotFoundError'}})
+            return self._send(200, {'data': {'attributes': {'last_analysis_stats': stats}}})
+        if self.path.startswith('/api/v3/analyses/'):
+            return self._send(200, {'data': {'attributes': {'status': 'completed', 'stats': CLEAN_STATS}}})
+        self._send(404)
+
+    def do_POST(self):
+        forced = self._forced_status()
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if forced:
+            return self._send(forced)
+        with self.server.lock:
+            self.server.uploads.append(body)
+        self._send(200, {'data': {'id': f'analysis-{len(self.server.uploads)}'}})
+
+
+@pytest.fixture
+def server():
+    server = FakeVirusTotal()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['aiohttp', 'requests'])
+def client(request, server, monkeypatch):
+    if request.param == 'aiohttp' and not virus.AIOHTTP_AVAILABLE:
+        pytest.skip('aiohttp no instalado')
+    monkeypatch.setattr(virus, 'AIOHTTP_AVAILABLE', request.param == 'aiohttp')
+    client = AsyncVirusTotalClient('clave', base_url=server.url, timeout=5, max_wait=10,
+                                   requests_per_minute=600, backoff=0.01, poll_interval=0.05)
+    yield client
+    client.close()
+
+
+def write_file(directory, content):
+    path = os.path.join(directory, 'documento.pdf')
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path, hashlib.sha256(content).hexdigest()
+
+
+def test_unknown_file_uploaded_after_being_moved(tmp_path, server, client):
+    # El job mueve el archivo a cuarentena mientras la consulta por hash sigue en curso
+    content = b'%PDF-1.4 contenido nuevo'
+    path, sha256 = write_file(tmp_path, content)
+    server.lookup_delay = 0.3
+    scanner = VirusTotalScanner(api_key='clave', client=client, wait=0.05)
+
+    result = scanner.check_file_reputation(path, sha256=sha256)
+    assert result['status'] == 'pending'
+    os.replace(path, tmp_path / 'cuarentena.pdf')
+    os.remove(tmp_path / 'cuarentena.pdf')
+
+    verdict = result['future'].result(timeout=5)
+    assert verdict['status'] == 'clean'
+    assert len(server.uploads) == 1 and content in server.uploads[0]
+
+
+def test_known_hash_is_not_uploaded(tmp_path, server, client):
+    path, sha256 = write_file(tmp_path, b'malware conocido')
+    server.known[sha256] = dict(CLEAN_STATS, malicious=3)
+    scanner = VirusTotalScanner(api_key='clave', client=client, wait=5)
+
+    result = scanner.check_file_reputation(path, sha256=sha256)
+    assert result['status'] == 'malicious'
+    assert server.uploads == []
+
+
+def test_transient_errors_are_retried(tmp_path, server, client):
+    path, sha256 = write_file(tmp_path, b'contenido')
+    server.known[sha256] = CLEAN_STATS
+    server.statuses = [503, 429]
+
+    verdict = client.submit(sha256, b'contenido').result(timeout=5)
+    assert verdict['status'] == 'clean'
+    assert [method for method, _ in server.requests] == ['GET', 'GET', 'GET']
+
+
+def test_concurrent_lookups_of_same_hash_are_shared(server, client):
+    sha256 = hashlib.sha256(b'compartido').hexdigest()
+    server.known[sha256] = CLEAN_STATS
+    server.lookup_delay = 0.2
+
+    futures = [client.submit(sha256, b'compartido') for _ in range(3)]
+    assert all(f.result(timeout=5)['status'] == 'clean' for f in futures)
+    assert len(server.requests) == 1
+
+
+@pytest.mark.parametrize('allowed', [True, False])
+def test_unknown_file_waits_for_upload_gate(tmp_path, server, client, allowed):
+    # La consulta por hash no espera a los escáneres locales; la subida sí
+    path, sha256 = write_file(tmp_path, b'%PDF-1.4 desconocido')
+    gate = Future()
+    future = client.submit(sha256, b'%PDF-1.4 desconocido', gate=gate)
+    time.sleep(0.2)
+    assert [method for method, _ in server.requests] == ['GET']
+    assert server.uploads == []
+
+    gate.set_result(allowed)
+    verdict = future.result(timeout=5)
+    assert verdict['status'] == ('clean' if allowed else 'skipped')
+    assert len(server.uploads) == (1 if allowed else 0)
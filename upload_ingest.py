@@ -0,0 +1,147 @@
+"""
+Upload Ingest - Recepción de archivos en una sola pasada
+El parser multipart escribe cada archivo directamente en el volumen de uploads
+mientras calcula SHA-256, tamaño y guarda los primeros bytes (firma mágica).
+Los validadores reciben un IngestedUpload con esos datos y una vista mmap del
+archivo en lugar de volver a leerlo o copiarlo.
+"""
+
+import io
+import os
+import mmap
+import uuid
+import hashlib
+import logging
+from contextlib import contextmanager
+
+from flask import Request
+
+HEAD_BYTES = 512
+
+# Firma mágica -> tipo detectado (la más específica primero)
+MAGIC_SIGNATURES = [
+    (b'%PDF', 'pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'PK\x03\x04', 'zip'),
+    (b'\xd0\xcf\x11\xe0', 'ole'),
+    (b'\x7fELF', 'elf'),
+    (b'MZ', 'exe'),
+]
+
+
+def sniff(head):
+    """Tipo según la firma mágica de los primeros bytes, o None"""
+    for signature, kind in MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+class IngestFile:
+    """Destino del parser multipart: escribe a disco y acumula hash/tamaño/cabecera"""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, f"ingest_{uuid.uuid4().hex}")
+        self._file = open(self.path, 'w+b')
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        if len(self.head) < HEAD_BYTES:
+            self.head += bytes(data[:HEAD_BYTES - len(self.head)])
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __getattr__(self, name):
+        # read/seek/tell/close/... del archivo real (FileStorage.save los usa)
+        return getattr(self._file, name)
+
+
+class IngestedUpload:
+    """Archivo recibido en disco con sus metadatos calculados al ingerirlo"""
+
+    def __init__(self, path, filename, size, sha256, head):
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.head = head
+        self.kind = sniff(head)
+
+    @classmethod
+    def from_file_storage(cls, file_storage, directory):
+        """Desde un FileStorage de la petición; si no vino por StreamingRequest se copia una vez"""
+        stream = file_storage.stream
+        if isinstance(stream, IngestFile):
+            # Cerrar antes de mover/mapear el archivo (necesario en Windows)
+            stream.close()
+            return cls(stream.path, file_storage.filename, stream.size, stream.sha256, stream.head)
+
+        target = IngestFile(directory)
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(64 * 1024), b''):
+            target.write(chunk)
+        target.close()
+        return cls(target.path, file_storage.filename, target.size, target.sha256, target.head)
+
+    @classmethod
+    def from_path(cls, path, filename):
+        """Desde un archivo ya en disco (lectura única en bloques)"""
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+                size += len(chunk)
+                if len(head) < HEAD_BYTES:
+                    head += chunk[:HEAD_BYTES - len(head)]
+        return cls(path, filename, size, digest.hexdigest(), head)
+
+    @contextmanager
+    def view(self):
+        """Vista de solo lectura (mmap) del archivo: read/seek/tell sin copiar a memoria"""
+        if self.size == 0:
+            yield io.BytesIO(b'')
+            return
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                yield view
+
+
+class StreamingRequest(Request):
+    """Request cuyos archivos multipart se escriben directo en ingest_folder.
+
+    Los archivos que la vista no movió a otro lugar se borran al cerrar la petición.
+    """
+
+    ingest_folder = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.ingest_folder is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        stream = IngestFile(self.ingest_folder)
+        self.__dict__.setdefault('_ingest_files', []).append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        for stream in self.__dict__.get('_ingest_files', ()):
+            try:
+                stream.close()
+                if os.path.exists(stream.path):
+                    os.remove(stream.path)
+            except OSError as e:
+                logging.warning(f"No se pudo borrar el archivo temporal {stream.path}: {e}")
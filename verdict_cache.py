@@ -0,0 +1,170 @@
+"""
+Verdict Cache - Veredictos de escaneo por SHA-256 del contenido
+El mismo PDF (formularios municipales, plantillas) llega muchas veces: el
+veredicto se guarda en SQLite para que todos los workers lo compartan y un
+archivo repetido se apruebe o rechace sin volver a pasar por los escáneres.
+Una copia LRU pequeña en memoria evita incluso la consulta a SQLite.
+
+La copia en memoria guarda y entrega copias del resultado: quien lo recibe
+puede modificarlo (p. ej. añadirle un token) sin alterar la caché.
+"""
+
+import copy
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+SCAN_VERDICT_VERSION = '2'      # Cambiarlo invalida los veredictos de reglas anteriores
+
+SQL_GET_VERDICT = (
+    "SELECT approved, result, created_at, last_hit FROM scan_verdicts "
+    "WHERE sha256 = ? AND version = ? AND created_at > ?"
+)
+SQL_PUT_VERDICT = (
+    "INSERT OR REPLACE INTO scan_verdicts (sha256, version, approved, result, created_at, last_hit, hits) "
+    "VALUES (?, ?, ?, ?, ?, ?, 0)"
+)
+SQL_TOUCH_VERDICT = "UPDATE scan_verdicts SET last_hit = ?, hits = hits + ? WHERE sha256 = ?"
+SQL_COUNT_VERDICTS = "SELECT COUNT(*) FROM scan_verdicts"
+SQL_PURGE_VERDICTS = "DELETE FROM scan_verdicts WHERE created_at <= ? OR version != ?"
+SQL_EVICT_VERDICTS = (
+    "DELETE FROM scan_verdicts WHERE sha256 IN "
+    "(SELECT sha256 FROM scan_verdicts ORDER BY last_hit LIMIT ?)"
+)
+
+
+class VerdictCache:
+    def __init__(self, database, ttl=7 * 24 * 3600, max_entries=10000, memory_entries=256,
+                 touch_interval=60, version=SCAN_VERDICT_VERSION):
+        """ttl en segundos; max_entries se aplica en SQLite expulsando los menos usados (LRU).
+
+        version puede ser un texto o una función que lo devuelva (p. ej. si
+        incluye el digest de reglas que se recargan en caliente).
+
+        last_hit se actualiza como mucho cada touch_interval segundos por hash,
+        así un archivo muy repetido no genera una escritura por petición.
+        """
+        self.database = database
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.touch_interval = touch_interval
+        self._version = version if callable(version) else (lambda: version)
+        self._memory_version = None
+        self._memory = OrderedDict()    # sha256 -> (approved, result, created_at, last_hit, hits pendientes)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        return self._version()
+
+    def _check_version(self):
+        """Versión actual; si cambió, la copia en memoria deja de valer"""
+        version = self._version()
+        if version != self._memory_version:
+            self._memory.clear()
+            self._memory_version = version
+        return version
+
+    def get(self, sha256):
+        """(aprobado, resultado) si hay un veredicto vigente, si no None"""
+        now = time.time()
+        with self._lock:
+            version = self._check_version()
+            entry = self._memory.get(sha256)
+            if entry is not None and now - entry[2] < self.ttl:
+                self._memory.move_to_end(sha256)
+                approved, result, created_at, last_hit, pending = entry
+                if now - last_hit < self.touch_interval:
+                    self._memory[sha256] = (approved, result, created_at, last_hit, pending + 1)
+                    self.hits += 1
+                    return approved, copy.deepcopy(result)
+                self._memory[sha256] = (approved, result, created_at, now, 0)
+                self.hits += 1
+                touch = pending + 1
+            else:
+                self._memory.pop(sha256, None)
+                touch = None
+
+        if touch is not None:
+            self._touch(sha256, now, touch)
+            return approved, copy.deepcopy(result)
+
+        try:
+            row = self.database.fetch_one(SQL_GET_VERDICT, (sha256, version, now - self.ttl))
+        except Exception as e:
+            logging.warning(f"No se pudo leer la caché de veredictos: {e}")
+            row = None
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        approved, result, created_at, last_hit = bool(row[0]), json.loads(row[1]), row[2], row[3]
+        if now - last_hit >= self.touch_interval:
+            self._touch(sha256, now, 1)
+            last_hit = now
+        with self._lock:
+            self.hits += 1
+            self._remember(sha256, (approved, result, created_at, last_hit, 0))
+        return approved, result
+
+    def put(self, sha256, approved, result):
+        """Guardar el veredicto de un escaneo completo"""
+        now = time.time()
+        with self._lock:
+            version = self._check_version()
+        serialized = json.dumps(result, default=str)
+        try:
+            self.database.execute(
+                SQL_PUT_VERDICT,
+                (sha256, version, int(bool(approved)), serialized, now, now)
+            )
+        except Exception as e:
+            logging.warning(f"No se pudo guardar el veredicto de {sha256[:16]}: {e}")
+            return
+        with self._lock:
+            # Lo mismo que devolvería SQLite, no el objeto del llamador
+            self._remember(sha256, (bool(approved), json.loads(serialized), now, now, 0))
+            self._puts += 1
+            evict = self._puts % 100 == 1
+        if evict:
+            self._evict(now, version)
+
+    def _remember(self, sha256, entry):
+        approved, result, created_at, last_hit, pending = entry
+        self._memory[sha256] = (approved, copy.deepcopy(result), created_at, last_hit, pending)
+        self._memory.move_to_end(sha256)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _touch(self, sha256, now, hits):
+        try:
+            self.database.execute(SQL_TOUCH_VERDICT, (now, hits, sha256))
+        except Exception as e:
+            logging.warning(f"No se pudo actualizar el uso del veredicto {sha256[:16]}: {e}")
+
+    def _evict(self, now, version):
+        """Borrar vencidos y, si aún se excede max_entries, los de last_hit más antiguo"""
+        try:
+            self.database.execute(SQL_PURGE_VERDICTS, (now - self.ttl, version))
+            excess = self.database.fetch_one(SQL_COUNT_VERDICTS)[0] - self.max_entries
+            if excess > 0:
+                self.database.execute(SQL_EVICT_VERDICTS, (excess,))
+                logging.info(f"Caché de veredictos: {excess} entradas expulsadas (LRU)")
+        except Exception as e:
+            logging.warning(f"No se pudo depurar la caché de veredictos: {e}")
+
+    def invalidate(self, sha256=None):
+        """Olvidar el veredicto de un hash (o todos en memoria si sha256 es None)"""
+        with self._lock:
+            if sha256 is None:
+                self._memory.clear()
+                return
+            self._memory.pop(sha256, None)
+        self.database.execute("DELETE FROM scan_verdicts WHERE sha256 = ?", (sha256,))